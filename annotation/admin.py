@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import TextAnnotation, AnnotationChange, DrugListEntry, ADEListEntry
+from django.db import transaction
+from django.utils import timezone
+from .models import TextAnnotation, AnnotationChange, AnnotationLease, DrugListEntry, ADEListEntry, ProgressCounter, ImportJob, PublishJob, BrandGenericMapping, DeletedAnnotation, DataVersion
 
 
 @admin.register(TextAnnotation)
@@ -52,13 +54,21 @@ class TextAnnotationAdmin(admin.ModelAdmin):
     
     def mark_as_validated(self, request, queryset):
         """Mark selected annotations as validated"""
-        updated = queryset.update(is_validated=True)
+        with transaction.atomic():
+            updated = queryset.filter(is_validated=False).update(is_validated=True, updated_at=timezone.now())
+            ProgressCounter.adjust(validated=updated)
+            if updated:
+                DataVersion.bump()
         self.message_user(request, f'{updated} annotations marked as validated.')
     mark_as_validated.short_description = "Mark selected annotations as validated"
     
     def mark_as_unvalidated(self, request, queryset):
         """Mark selected annotations as unvalidated"""
-        updated = queryset.update(is_validated=False)
+        with transaction.atomic():
+            updated = queryset.filter(is_validated=True).update(is_validated=False, updated_at=timezone.now())
+            ProgressCounter.adjust(validated=-updated)
+            if updated:
+                DataVersion.bump()
         self.message_user(request, f'{updated} annotations marked as unvalidated.')
     mark_as_unvalidated.short_description = "Mark selected annotations as unvalidated"
 
@@ -107,6 +117,61 @@ class AnnotationChangeAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         """Allow deletion for admin cleanup"""
         return True
+    
+    def delete_model(self, request, obj):
+        """Delete one change and invalidate cached exports that include it"""
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            DataVersion.bump()
+    
+    def delete_queryset(self, request, queryset):
+        """Delete the selected changes in one query, bumping the data version once"""
+        with transaction.atomic():
+            queryset.delete()
+            DataVersion.bump()
 
 admin.site.register(DrugListEntry)
 admin.site.register(ADEListEntry)
+admin.site.register(AnnotationLease)
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    """Admin interface for background imports"""
+    
+    list_display = ['id', 'original_name', 'status', 'rows_inserted', 'rows_rejected', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = [field.name for field in ImportJob._meta.fields]
+
+
+@admin.register(PublishJob)
+class PublishJobAdmin(admin.ModelAdmin):
+    """Admin interface for background Hugging Face publishing"""
+    
+    list_display = ['id', 'dataset_name', 'status', 'step', 'retries', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = [field.name for field in PublishJob._meta.fields]
+
+
+@admin.register(BrandGenericMapping)
+class BrandGenericMappingAdmin(admin.ModelAdmin):
+    """Admin interface for brand to generic drug names"""
+    
+    list_display = ['brand', 'generic']
+    search_fields = ['brand_key', 'generic']
+    exclude = ['brand_key']
+
+
+@admin.register(DeletedAnnotation)
+class DeletedAnnotationAdmin(admin.ModelAdmin):
+    """Read-only list of deleted annotation ids reported by delta exports"""
+    
+    list_display = ['annotation_id', 'deleted_at']
+    list_filter = ['deleted_at']
+    search_fields = ['annotation_id']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,113 @@
+"""Token-level BIO tags for NER training exports.
+
+Texts are split with one precompiled regex that keeps each token's
+character offsets, and the DRUG/ADVERSE_EVENT spans from
+``annotation.offsets`` are aligned to those tokens in a single sweep (both
+lists are sorted by position). Tokens are also split where a span starts or
+ends inside them, so "ofloxacin-induced" becomes "ofloxacin", "-",
+"induced" when only "ofloxacin" is an entity. A token that overlaps a span takes its tag:
+``B-`` for the first token of the span and ``I-`` for the rest; everything
+else is ``O``. Each annotation is one sentence.
+"""
+import json
+import re
+from bisect import bisect_right
+
+from .offsets import entity_offsets
+
+# Words with inner hyphens/apostrophes ("5-fluorouracil"), decimals ("2.5mg")
+# and single punctuation marks
+TOKEN_RE = re.compile(r"\w+(?:(?:[-'’]|(?<=\d)[.,](?=\d))\w+)*|[^\w\s]")
+
+OUTSIDE = 'O'
+BIO_FIELDS = ('id', 'text', 'drugs', 'adverse_events', 'is_validated', 'updated_at')
+FORMATS = ('conll', 'jsonl')
+
+
+def tokenize(text, boundaries=()):
+    """(start, end, token) for every token in ``text``, also split at the sorted ``boundaries``"""
+    tokens = []
+    for match in TOKEN_RE.finditer(text):
+        start, end = match.span()
+        first = bisect_right(boundaries, start)
+        if first == len(boundaries) or boundaries[first] >= end:
+            tokens.append((start, end, match.group()))
+            continue
+        cuts = [start]
+        while first < len(boundaries) and boundaries[first] < end:
+            cuts.append(boundaries[first])
+            first += 1
+        cuts.append(end)
+        # Re-tokenize each piece so a split-off "-induced" gives "-" and "induced"
+        for piece_start, piece_end in zip(cuts, cuts[1:]):
+            tokens.extend(
+                (piece.start(), piece.end(), piece.group())
+                for piece in TOKEN_RE.finditer(text, piece_start, piece_end)
+            )
+    return tokens
+
+
+def bio_tags(tokens, offsets):
+    """One BIO tag per token for the (start, end, label, name) entity offsets"""
+    tags = [OUTSIDE] * len(tokens)
+    index = 0
+    last_span = None
+    for start, end, label, _ in offsets:
+        if (start, end) == last_span:
+            # Same span under a second label: the first (DRUG) wins
+            continue
+        last_span = (start, end)
+        # Skip tokens that end before the span
+        while index < len(tokens) and tokens[index][1] <= start:
+            index += 1
+        prefix = 'B-'
+        position = index
+        while position < len(tokens) and tokens[position][0] < end:
+            tags[position] = prefix + label
+            prefix = 'I-'
+            position += 1
+    return tags
+
+
+def bio_sentence(row, word_boundary=True):
+    """(tokens, tags) for one annotation value row"""
+    offsets = entity_offsets(
+        row['id'], row['updated_at'], row['text'], row['drugs'], row['adverse_events'],
+        word_boundary=word_boundary,
+    )
+    boundaries = sorted({position for start, end, _, _ in offsets for position in (start, end)})
+    tokens = tokenize(row['text'], boundaries)
+    return [token for _, _, token in tokens], bio_tags(tokens, offsets)
+
+
+def iter_conll(rows, word_boundary=True, stats=None):
+    """Yield one CoNLL block (token<TAB>tag lines and a blank line) per sentence"""
+    for row in rows:
+        tokens, tags = bio_sentence(row, word_boundary)
+        if stats is not None:
+            stats['sentences'] += 1
+            stats['tokens'] += len(tokens)
+        if tokens:
+            yield ''.join(f'{token}\t{tag}\n' for token, tag in zip(tokens, tags)) + '\n'
+
+
+def iter_bio_jsonl(rows, word_boundary=True, stats=None):
+    """Yield one {"id", "tokens", "tags", "is_validated"} JSON line per sentence"""
+    for row in rows:
+        tokens, tags = bio_sentence(row, word_boundary)
+        if stats is not None:
+            stats['sentences'] += 1
+            stats['tokens'] += len(tokens)
+        yield json.dumps({
+            'id': row['id'],
+            'tokens': tokens,
+            'tags': tags,
+            'is_validated': row['is_validated'],
+        }, ensure_ascii=False) + '\n'
+
+
+def iter_bio(rows, output_format='conll', word_boundary=True, stats=None):
+    """Yield BIO output lines in ``output_format`` ('conll' or 'jsonl')"""
+    if output_format == 'jsonl':
+        return iter_bio_jsonl(rows, word_boundary, stats)
+    return iter_conll(rows, word_boundary, stats)
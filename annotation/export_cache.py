@@ -0,0 +1,133 @@
+"""On-disk snapshots of full exports, keyed by the data version.
+
+Every write to annotations or their change history bumps ``DataVersion``.
+An export response carries the version in its ETag (plus Last-Modified), so
+a client repeating a request with ``If-None-Match``/``If-Modified-Since``
+gets a 304 while nothing has changed. Otherwise the first request for a
+given (export, parameters, version) streams the export to the client and
+to a temporary file at the same time; once it completes, and only if the
+version did not move meanwhile, the file becomes the snapshot that later
+requests are served from at disk speed. Snapshots of older versions are
+removed when a new one is stored.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from . import exporter
+from .models import DataVersion
+
+CACHE_DIR = getattr(settings, 'ANNOTATION_EXPORT_CACHE_DIR', settings.BASE_DIR / 'export_cache')
+# Unfinished snapshot files older than this are left over from crashed workers
+STALE_PART_SECONDS = 24 * 60 * 60
+
+
+def snapshot_key(name, params):
+    """Digest identifying one export and the parameters that shape its output"""
+    return hashlib.sha256(json.dumps([name, params], sort_keys=True).encode()).hexdigest()
+
+
+def version_token(data_version):
+    """The version number plus its timestamp: a rolled-back write can reuse a number, never both"""
+    return f'{data_version.version}.{int(data_version.updated_at.timestamp() * 1000000)}'
+
+
+def snapshot_path(token, key):
+    return os.path.join(CACHE_DIR, f'{token}-{key}')
+
+
+def export_response(request, name, params, make_lines, filename, content_type='application/json', compress=None):
+    """Conditional, snapshot-cached response for a full export.
+
+    ``make_lines`` is only called on a cache miss and returns the export
+    lines; ``params`` must include everything that changes the output.
+    """
+    data_version = DataVersion.current()
+    token = version_token(data_version)
+    key = snapshot_key(name, {**params, 'compress': compress})
+    etag = f'"{token}-{key[:20]}"'
+    last_modified = int(data_version.updated_at.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        path = snapshot_path(token, key)
+        try:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response['X-Export-Cache'] = 'hit'
+        except FileNotFoundError:
+            chunks = _write_through(exporter.encode(make_lines(), compress), path, token)
+            response = StreamingHttpResponse(chunks, content_type=content_type)
+            response['X-Export-Cache'] = 'miss'
+        exporter.attachment_headers(response, filename, compress)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def _write_through(chunks, path, token):
+    """Yield ``chunks`` while saving them as the snapshot at ``path``.
+
+    A failing cache write never interrupts the download; an incomplete
+    stream (client gone, error) or a version change leaves no snapshot.
+    """
+    handle = temp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.part')
+        handle = os.fdopen(fd, 'wb')
+    except OSError:
+        handle = None
+
+    complete = False
+    try:
+        for chunk in chunks:
+            if handle is not None:
+                try:
+                    handle.write(chunk)
+                except OSError:
+                    handle = _discard(handle, temp_path)
+            yield chunk
+        complete = True
+    finally:
+        if handle is not None:
+            if complete and version_token(DataVersion.current()) == token:
+                handle.close()
+                os.replace(temp_path, path)
+                prune(keep=token)
+            else:
+                _discard(handle, temp_path)
+
+
+def _discard(handle, temp_path):
+    handle.close()
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+    return None
+
+
+def prune(keep=None):
+    """Delete snapshots of other versions and abandoned partial files"""
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return
+    now = time.time()
+    for name in names:
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            if name.endswith('.part'):
+                if now - os.path.getmtime(path) > STALE_PART_SECONDS:
+                    os.remove(path)
+            elif not name.startswith(f'{keep}-'):
+                os.remove(path)
+        except OSError:
+            pass
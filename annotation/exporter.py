@@ -0,0 +1,336 @@
+"""Streaming JSONL export of annotations.
+
+Exports read plain ``.values()`` rows with ``queryset.iterator(chunk_size)``
+instead of caching model instances, serialise them one at a time and hand
+the lines to a ``StreamingHttpResponse`` in buffers of a few tens of KiB.
+The first bytes go out as soon as the first chunk is read, and memory stays
+the same whether the corpus has thousands or millions of rows.
+
+Delta exports (``since=``) only read rows whose ``updated_at`` is past a
+watermark, through its index, plus the tombstones of deleted rows, and hand
+back a cursor for the next sync.
+"""
+import base64
+import json
+import zlib
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import BooleanField, Exists, ExpressionWrapper, OuterRef, Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import TextAnnotation, AnnotationChange, DeletedAnnotation, change_summary_aggregates
+from .offsets import entity_offsets
+
+# Rows fetched from the database per round trip
+CHUNK_SIZE = getattr(settings, 'ANNOTATION_EXPORT_CHUNK_SIZE', 2000)
+# Bytes of serialised lines collected before a chunk is sent to the client
+BUFFER_SIZE = 64 * 1024
+# On-the-fly compression (compress=gzip): level, and input bytes between sync flushes
+COMPRESSIONS = ('gzip',)
+GZIP_LEVEL = 6
+GZIP_FLUSH_BYTES = 1024 * 1024
+# zlib window bits for a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Seconds before a delta cursor that are exported again, for late commits
+DELTA_OVERLAP = getattr(settings, 'ANNOTATION_EXPORT_DELTA_OVERLAP', 60)
+
+EXPORT_FIELDS = ('id', 'text', 'drugs', 'adverse_events', 'is_validated', 'created_at', 'updated_at')
+CHANGE_FIELDS = ('change_type', 'field_name', 'entity_name', 'old_value', 'new_value', 'timestamp', 'session_id')
+SUMMARY_COUNTS = ('total_changes', 'drug_additions', 'drug_removals', 'event_additions', 'event_removals')
+CHANGE_TYPE_DISPLAY = dict(AnnotationChange.CHANGE_TYPES)
+
+FILTER_NAMES = {
+    'annotated': 'annotated_only',
+    'validated': 'validated_only',
+    'annotated_validated': 'annotated_validated',
+    'modified': 'modified_only',
+    'all': 'all',
+}
+
+
+def filter_condition(filter_type):
+    """Q selecting the annotations of an export filter, or None for 'all' (and unknown values)"""
+    annotated = ~(Q(drugs=[]) & Q(adverse_events=[]))
+    if filter_type == 'annotated':
+        # Only texts that have drugs or adverse events
+        return annotated
+    if filter_type == 'validated':
+        return Q(is_validated=True)
+    if filter_type == 'annotated_validated':
+        return annotated & Q(is_validated=True)
+    if filter_type == 'modified':
+        # Only texts with tracked changes (EXISTS avoids a join and DISTINCT)
+        return Q(Exists(AnnotationChange.objects.filter(annotation=OuterRef('pk'))))
+    return None
+
+
+def filtered_annotations(filter_type):
+    """Annotations selected by an export filter"""
+    annotations = TextAnnotation.objects.all()
+    condition = filter_condition(filter_type)
+    if condition is not None:
+        annotations = annotations.filter(condition)
+    return annotations
+
+
+def iter_rows(queryset, fields, chunk_size=CHUNK_SIZE, include_changes=False):
+    """Yield value dicts in id order without caching the results on the queryset.
+
+    With ``include_changes`` each row also gets a 'change_fields' dict,
+    merged in from two more streamed queries (see ``iter_change_fields``),
+    so the export runs the same number of queries for any number of rows.
+    """
+    rows = queryset.order_by('id').values(*fields).iterator(chunk_size=chunk_size)
+    if not include_changes:
+        return rows
+    return _merge_changes(rows, iter_change_fields(queryset, chunk_size))
+
+
+def _merge_changes(rows, change_fields):
+    pending = next(change_fields, None)
+    for row in rows:
+        while pending is not None and pending[0] < row['id']:
+            pending = next(change_fields, None)
+        if pending is not None and pending[0] == row['id']:
+            row['change_fields'] = pending[1]
+        else:
+            row['change_fields'] = empty_change_fields()
+        yield row
+
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+
+def build_change_fields(summary, changes):
+    """change_summary, changes and change_statistics from an aggregated summary and change rows"""
+    counts = {field: summary.get(field, 0) for field in SUMMARY_COUNTS}
+    last_modified = isoformat(summary.get('last_modified'))
+    return {
+        'change_summary': {**counts, 'last_modified': last_modified},
+        'changes': [
+            {
+                'change_type': change['change_type'],
+                'change_type_display': CHANGE_TYPE_DISPLAY.get(change['change_type'], change['change_type']),
+                'field_name': change['field_name'],
+                'entity_name': change['entity_name'],
+                'old_value': change['old_value'],
+                'new_value': change['new_value'],
+                'timestamp': isoformat(change['timestamp']),
+                'session_id': change['session_id'],
+            }
+            for change in changes
+        ],
+        'change_statistics': {
+            **counts,
+            'total_additions': counts['drug_additions'] + counts['event_additions'],
+            'total_removals': counts['drug_removals'] + counts['event_removals'],
+            'last_modified': last_modified,
+        },
+    }
+
+
+def empty_change_fields():
+    return build_change_fields({}, [])
+
+
+def iter_change_fields(annotations, chunk_size=CHUNK_SIZE):
+    """Yield (annotation_id, change_fields) for the annotations with tracked changes, in id order.
+
+    Per-annotation counts come from one conditional-aggregation query and the
+    detailed changes from one query ordered by annotation; both are streamed
+    and merge-joined on the annotation id.
+    """
+    changes = AnnotationChange.objects.filter(annotation_id__in=annotations.order_by().values('id'))
+    summaries = (
+        changes.order_by('annotation_id')
+        .values('annotation_id')
+        .annotate(**change_summary_aggregates())
+        .iterator(chunk_size=chunk_size)
+    )
+    details = (
+        changes.order_by('annotation_id', '-timestamp')
+        .values('annotation_id', *CHANGE_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    summary = next(summaries, None)
+    for annotation_id, group in groupby(details, key=itemgetter('annotation_id')):
+        while summary is not None and summary['annotation_id'] < annotation_id:
+            summary = next(summaries, None)
+        matched = summary if summary is not None and summary['annotation_id'] == annotation_id else {}
+        yield annotation_id, build_change_fields(matched, group)
+
+
+def annotation_record(row, include_changes=False):
+    """The export_jsonl object for one value row"""
+    data = {
+        'text': row['text'],
+        'drugs': row['drugs'],
+        'adverse_events': row['adverse_events'],
+        'is_validated': row['is_validated'],
+        'created_at': isoformat(row['created_at']),
+        'updated_at': isoformat(row['updated_at']),
+    }
+    if include_changes:
+        data.update(row['change_fields'])
+    return data
+
+
+def entities_record(row, include_changes=False, word_boundary=True):
+    """The export_entities_jsonl object (character offsets per entity) for one value row"""
+    offsets = entity_offsets(
+        row['id'], row['updated_at'], row['text'], row['drugs'], row['adverse_events'],
+        word_boundary=word_boundary,
+    )
+    data = {
+        'text': row['text'],
+        'entities': [
+            {'start': start, 'end': end, 'label': label, 'text': name}
+            for start, end, label, name in offsets
+        ],
+        'is_validated': row['is_validated'],
+        'created_at': isoformat(row['created_at']),
+        'updated_at': isoformat(row['updated_at']),
+    }
+    if include_changes:
+        data.update(row['change_fields'])
+    return data
+
+
+def encode_cursor(moment):
+    """Opaque delta-export cursor for a point in time"""
+    return base64.urlsafe_b64encode(moment.isoformat().encode()).decode().rstrip('=')
+
+
+def parse_since(value):
+    """Datetime of a ``since`` parameter: an ISO 8601 timestamp or a cursor from X-Export-Cursor"""
+    moment = parse_datetime(value)
+    if moment is None:
+        try:
+            padded = value + '=' * (-len(value) % 4)
+            moment = parse_datetime(base64.urlsafe_b64decode(padded.encode()).decode())
+        except (ValueError, UnicodeDecodeError):
+            moment = None
+    if moment is None:
+        raise ValueError(f'"{value}" is neither an ISO 8601 timestamp nor an export cursor')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, timezone.get_default_timezone())
+    return moment
+
+
+def iter_delta(filter_type, since, until, include_changes=False):
+    """Yield JSON lines for annotations changed or deleted after ``since`` and up to ``until``.
+
+    Each changed annotation that matches the filter is exported with its id;
+    deleted ones, and changed ones that no longer match the filter, are
+    reported as {"id": ..., "deleted": true} so a mirror can drop them. The
+    window starts DELTA_OVERLAP seconds before ``since`` to pick up rows from
+    transactions that committed after the previous cursor was issued, so
+    consumers should upsert by id.
+    """
+    window_start = since - timedelta(seconds=DELTA_OVERLAP)
+    changed = TextAnnotation.objects.filter(updated_at__gt=window_start, updated_at__lte=until)
+    fields = EXPORT_FIELDS
+    condition = filter_condition(filter_type)
+    if condition is not None:
+        changed = changed.annotate(in_export=ExpressionWrapper(condition, output_field=BooleanField()))
+        fields += ('in_export',)
+
+    for row in iter_rows(changed, fields, include_changes=include_changes):
+        if row.get('in_export', True):
+            data = {'id': row['id'], **annotation_record(row, include_changes)}
+        else:
+            data = {'id': row['id'], 'deleted': True}
+        yield json.dumps(data, ensure_ascii=False) + '\n'
+
+    deleted = (
+        DeletedAnnotation.objects.filter(deleted_at__gt=window_start, deleted_at__lte=until)
+        .order_by('annotation_id')
+        .values_list('annotation_id', flat=True)
+        .distinct()
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for annotation_id in deleted:
+        yield json.dumps({'id': annotation_id, 'deleted': True}) + '\n'
+
+
+def iter_jsonl(rows, record, **kwargs):
+    """Yield one JSON line per row"""
+    for row in rows:
+        yield json.dumps(record(row, **kwargs), ensure_ascii=False) + '\n'
+
+
+def buffered(lines, buffer_size=BUFFER_SIZE):
+    """Join lines into UTF-8 chunks of roughly ``buffer_size`` bytes"""
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_stream(chunks, level=GZIP_LEVEL, flush_every=GZIP_FLUSH_BYTES):
+    """Compress byte chunks into one gzip stream as they arrive.
+
+    A sync flush every ``flush_every`` input bytes pushes what has been
+    compressed so far to the client without resetting the dictionary, so a
+    slow export still shows progress while keeping nearly the full ratio.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_every:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def check_compression(compress):
+    """Validate a ``compress`` query parameter, returning None for no compression"""
+    if not compress:
+        return None
+    if compress not in COMPRESSIONS:
+        raise ValueError(f'Unsupported compression "{compress}" (supported: {", ".join(COMPRESSIONS)})')
+    return compress
+
+
+def encode(lines, compress=None):
+    """Byte chunks of the response body for ``lines``, gzip-compressed if asked"""
+    chunks = buffered(lines)
+    if compress == 'gzip':
+        chunks = gzip_stream(chunks)
+    return chunks
+
+
+def attachment_headers(response, filename, compress=None):
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    if compress == 'gzip':
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+def streaming_response(lines, filename, content_type='application/json', compress=None):
+    """Attachment response that sends ``lines`` as they are produced.
+
+    With ``compress='gzip'`` the body is gzip-compressed on the fly and sent
+    with ``Content-Encoding: gzip``: browsers and HTTP libraries decompress
+    it transparently and save ``filename`` (use ``curl --compressed``).
+    """
+    response = StreamingHttpResponse(encode(lines, compress), content_type=content_type)
+    return attachment_headers(response, filename, compress)
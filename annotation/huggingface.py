@@ -0,0 +1,316 @@
+"""Publishing the dataset to the Hugging Face Hub.
+
+Every call goes through one pooled ``requests.Session`` with connect/read
+timeouts; its adapter retries connection failures, and idempotent requests
+on rate limiting and gateway errors, with exponential backoff. The upload
+body is a multipart stream produced by generators: annotation rows are read
+from the database and serialised while the request is being sent, so memory
+stays flat for any dataset size. Its Content-Length is computed by a first
+pass over the same stream (nothing is kept) because not every server or
+proxy accepts chunked uploads; ``HUGGINGFACE_UPLOAD_CHUNKED`` skips that pass.
+
+``HUGGINGFACE_ENDPOINT`` points the client at another server, e.g. a mirror
+or a local stand-in for testing. Token checks are cached for a short while
+(under a digest of the token) so repeated validations stay off the network.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import exporter
+
+ENDPOINT = getattr(settings, 'HUGGINGFACE_ENDPOINT', 'https://huggingface.co').rstrip('/')
+# (connect, read) seconds; the read timeout also bounds the wait for the upload's response
+TIMEOUT = getattr(settings, 'HUGGINGFACE_TIMEOUT', (10, 120))
+RETRIES = getattr(settings, 'HUGGINGFACE_RETRIES', 3)
+BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+UPLOAD_CHUNKED = getattr(settings, 'HUGGINGFACE_UPLOAD_CHUNKED', False)
+# Seconds a whoami result is reused by ``whoami(cached=True)``
+WHOAMI_TTL = getattr(settings, 'HUGGINGFACE_WHOAMI_TTL', 60)
+WHOAMI_KEY = 'annotation:huggingface:whoami:{digest}'
+
+# Upload filters offered by upload_hf.html (anything else uploads everything)
+FILTER_TYPES = ('all', 'annotated', 'validated')
+UPLOAD_FIELDS = exporter.EXPORT_FIELDS
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class HubError(Exception):
+    """A Hub request failed; the message is meant for the user"""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        # Network errors, rate limiting and gateway errors may pass on a later attempt
+        self.retryable = retryable
+
+
+def _failed(message, response):
+    return HubError(message, retryable=response.status_code in RETRY_STATUSES)
+
+
+def get_session():
+    """The shared session, created on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=RETRIES,
+                backoff_factor=BACKOFF,
+                status_forcelist=RETRY_STATUSES,
+                # POST bodies are streamed once; those are retried by ``_post``
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def _headers(token, **extra):
+    return {'Authorization': f'Bearer {token}', **extra}
+
+
+def _post(url, token, make_body=None, headers=None, retries=RETRIES, **kwargs):
+    """POST with the backoff of the session's GETs, building a fresh body for every attempt.
+
+    Callers that retry on their own (``annotation.publish_jobs``) pass
+    ``retries=0`` so a body is not streamed again by two nested retry loops.
+    """
+    for attempt in range(retries + 1):
+        if make_body is not None:
+            kwargs['data'] = make_body()
+        response = get_session().post(url, headers=_headers(token, **(headers or {})), timeout=TIMEOUT, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+        response.close()
+        time.sleep(BACKOFF * (2 ** attempt))
+
+
+def whoami(token, cached=False):
+    """Username the token belongs to.
+
+    With ``cached`` a result (or rejection) from the last ``WHOAMI_TTL``
+    seconds is reused; network failures are never cached.
+    """
+    key = WHOAMI_KEY.format(digest=hashlib.sha256(token.encode()).hexdigest())
+    if cached:
+        result = cache.get(key)
+        if result is not None:
+            if result['error']:
+                raise HubError(result['error'])
+            return result['username']
+    try:
+        username = _whoami(token)
+    except HubError as e:
+        if not e.retryable:
+            cache.set(key, {'username': '', 'error': str(e)}, WHOAMI_TTL)
+        raise
+    cache.set(key, {'username': username, 'error': ''}, WHOAMI_TTL)
+    return username
+
+
+def _whoami(token):
+    try:
+        response = get_session().get(f'{ENDPOINT}/api/whoami', headers=_headers(token), timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        raise HubError(f'Network error while validating token: {e}', retryable=True)
+    if response.status_code == 401:
+        raise HubError('Invalid Hugging Face token. Please check your token and try again.')
+    if response.status_code != 200:
+        raise _failed(f'Error validating token: {response.text}', response)
+    username = response.json().get('name', '')
+    if not username:
+        raise HubError('Could not retrieve username from token. Please check your token.')
+    return username
+
+
+def create_repo(token, dataset_name, description, is_private, retries=RETRIES):
+    """Create the dataset repository; an existing one is reused"""
+    try:
+        response = _post(f'{ENDPOINT}/api/repos/create', token, retries=retries, json={
+            'name': dataset_name,
+            'type': 'dataset',
+            'description': description,
+            'private': is_private,
+        })
+    except requests.exceptions.RequestException as e:
+        raise HubError(f'Network error while creating the dataset repository: {e}', retryable=True)
+    # 409 means it already exists
+    if response.status_code not in (200, 201, 409):
+        if 'already exists' in response.text.lower():
+            raise HubError(f'Dataset "{dataset_name}" already exists. Please choose a different name.')
+        raise _failed(f'Failed to create dataset repository: {response.text}', response)
+
+
+class MultipartBody:
+    """A multipart/form-data body streamed from (field, filename, content_type, make_chunks) parts.
+
+    ``make_chunks`` returns an iterable of bytes and is called once per pass;
+    ``len()`` runs one pass to count the bytes, iterating streams them and
+    calls ``progress(bytes_sent, total_bytes or None)`` after every chunk.
+    """
+
+    def __init__(self, parts, boundary=None, progress=None):
+        self.parts = parts
+        self.boundary = boundary or uuid.uuid4().hex
+        self.progress = progress
+        self._length = None
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __iter__(self):
+        sent = 0
+        for chunk in self._chunks():
+            sent += len(chunk)
+            # Rows written between the length pass and the upload would corrupt the request
+            if self._length is not None and sent > self._length:
+                raise HubError('The data changed while it was being uploaded. Please try again.', retryable=True)
+            yield chunk
+            if self.progress is not None:
+                self.progress(sent, self._length)
+        if self._length is not None and sent != self._length:
+            raise HubError('The data changed while it was being uploaded. Please try again.', retryable=True)
+
+    def _chunks(self):
+        for field_name, filename, content_type, make_chunks in self.parts:
+            yield (
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'
+            ).encode()
+            for chunk in make_chunks():
+                if chunk:
+                    yield chunk
+            yield b'\r\n'
+        yield f'--{self.boundary}--\r\n'.encode()
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(len(chunk) for chunk in self._chunks())
+        return self._length
+
+
+def upload_files(token, username, dataset_name, parts, chunked=UPLOAD_CHUNKED, progress=None, retries=RETRIES):
+    """Stream ``parts`` to the dataset's upload endpoint"""
+    body = MultipartBody(parts, progress=progress)
+    try:
+        response = _post(
+            f'{ENDPOINT}/api/datasets/{username}/{dataset_name}/upload',
+            token,
+            # A plain generator has no length, so requests sends it chunked
+            make_body=lambda: iter(body) if chunked else body,
+            headers={'Content-Type': body.content_type},
+            retries=retries,
+        )
+    except requests.exceptions.RequestException as e:
+        raise HubError(f'Network error while uploading the dataset: {e}', retryable=True)
+    if response.status_code not in (200, 201):
+        raise _failed(f'Failed to upload dataset: {response.text}', response)
+
+
+def upload_annotations(filter_type):
+    if filter_type not in FILTER_TYPES:
+        filter_type = 'all'
+    return exporter.filtered_annotations(filter_type)
+
+
+def upload_record(row):
+    return {'id': row['id'], **exporter.annotation_record(row)}
+
+
+def iter_data_lines(annotations):
+    """data.jsonl lines (newline-separated, no trailing newline) streamed from the database"""
+    separator = ''
+    for row in exporter.iter_rows(annotations, UPLOAD_FIELDS):
+        yield separator + json.dumps(upload_record(row), ensure_ascii=False)
+        separator = '\n'
+
+
+def dataset_info(annotations, dataset_name, dataset_description, filter_type, is_private):
+    """Contents of dataset_info.json"""
+    # Counts come from one aggregate query, not from the rows
+    counts = annotations.aggregate(total=Count('id'), validated=Count('id', filter=Q(is_validated=True)))
+    total = counts['total']
+    return {
+        'dataset_name': dataset_name,
+        'description': dataset_description or f'Medical text annotation dataset with {total} examples',
+        'upload_timestamp': datetime.now().isoformat(),
+        'total_examples': total,
+        'filter_type': filter_type,
+        'is_private': is_private,
+        'validated_count': counts['validated'],
+        'unvalidated_count': total - counts['validated'],
+    }
+
+
+def dataset_parts(annotations, dataset_info):
+    """(field, filename, content_type, make_chunks) for data.jsonl, dataset_info.json and README.md"""
+    uploaded_at = datetime.fromisoformat(dataset_info['upload_timestamp'])
+    readme = f'''# {dataset_info['dataset_name']}
+
+{dataset_info['description']}
+
+## Dataset Information
+- **Total Examples**: {dataset_info['total_examples']}
+- **Validated Examples**: {dataset_info['validated_count']}
+- **Unvalidated Examples**: {dataset_info['unvalidated_count']}
+- **Filter Type**: {dataset_info['filter_type']}
+- **Privacy**: {'Private' if dataset_info['is_private'] else 'Public'}
+- **Upload Date**: {uploaded_at.strftime('%Y-%m-%d %H:%M:%S')}
+
+## Data Format
+Each example contains:
+- `id`: Annotation ID
+- `text`: Medical text content
+- `drugs`: List of identified drugs
+- `adverse_events`: List of identified adverse events
+- `is_validated`: Validation status
+- `created_at`: Creation timestamp
+- `updated_at`: Last update timestamp
+
+## Usage
+This dataset can be used for training medical text annotation models or for research in pharmacovigilance and medical text analysis.
+'''
+    info_bytes = json.dumps(dataset_info, ensure_ascii=False, indent=2).encode('utf-8')
+    readme_bytes = readme.encode('utf-8')
+    return [
+        ('data.jsonl', 'data.jsonl', 'application/jsonl', lambda: exporter.buffered(iter_data_lines(annotations))),
+        ('dataset_info.json', 'dataset_info.json', 'application/json', lambda: [info_bytes]),
+        ('README.md', 'README.md', 'text/markdown', lambda: [readme_bytes]),
+    ]
+
+
+def dataset_url(username, dataset_name):
+    return f'{ENDPOINT}/datasets/{username}/{dataset_name}'
+
+
+def publish(token, dataset_name, dataset_description='', is_private=False, filter_type='all'):
+    """Validate the token, create the repository and upload the dataset; returns its URL.
+
+    Runs in the caller's thread; ``annotation.publish_jobs`` runs the same
+    steps in the background with retries.
+    """
+    username = whoami(token)
+    annotations = upload_annotations(filter_type)
+    info = dataset_info(annotations, dataset_name, dataset_description, filter_type, is_private)
+    create_repo(token, dataset_name, info['description'], is_private)
+    upload_files(token, username, dataset_name, dataset_parts(annotations, info))
+    return dataset_url(username, dataset_name)
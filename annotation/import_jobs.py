@@ -0,0 +1,240 @@
+"""Background JSONL imports.
+
+An upload is spooled to ``ANNOTATION_IMPORT_SPOOL_DIR`` and an ``ImportJob``
+row records it; a small thread pool then runs the spooled file through
+``annotation.importer.parse_ranges`` (on worker processes for parallel jobs). Every batch is committed in its own transaction
+together with the job's progress (byte offset, line number and counts), so
+a cancelled, failed or interrupted job resumes right after its last
+committed batch without re-inserting anything.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import navigation, vocabulary
+from .importer import BatchWriter, ErrorReport, parse_ranges, read_chunks
+from .models import TextAnnotation, ImportJob, ProgressCounter
+from .signals import bulk_changes
+
+SPOOL_DIR = Path(getattr(settings, 'ANNOTATION_IMPORT_SPOOL_DIR', settings.BASE_DIR / 'import_spool'))
+MAX_WORKERS = getattr(settings, 'ANNOTATION_IMPORT_WORKERS', 1)
+# A running job whose progress has not moved for this long is treated as
+# interrupted (e.g. the server restarted) and may be resumed
+STALE_AFTER = timedelta(minutes=5)
+
+RESUMABLE_STATUSES = ('failed', 'cancelled')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised between batches when a cancel was requested"""
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='annotation-import')
+        return _executor
+
+
+def spool_upload(uploaded_file):
+    """Copy an upload to the spool directory, returning (path, size)"""
+    SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    path = SPOOL_DIR / f'{uuid.uuid4().hex}.jsonl'
+    size = 0
+    with open(path, 'wb') as handle:
+        for chunk in read_chunks(uploaded_file):
+            handle.write(chunk)
+            size += len(chunk)
+    return path, size
+
+
+def create_job(uploaded_file, clear_existing=False, upsert=False, batch_size=None, workers=1):
+    """Spool an upload and queue it for import once the caller's transaction commits"""
+    path, size = spool_upload(uploaded_file)
+    job = ImportJob.objects.create(
+        original_name=uploaded_file.name[:255],
+        spool_path=str(path),
+        file_size=size,
+        clear_existing=clear_existing,
+        upsert=upsert,
+        batch_size=batch_size or settings.ANNOTATION_IMPORT_BATCH_SIZE,
+        workers=workers,
+    )
+    transaction.on_commit(lambda: submit(job.pk))
+    return job
+
+
+def submit(job_id):
+    return _get_executor().submit(run_job, job_id)
+
+
+def cancel(job):
+    """Stop a job: queued jobs never start, running ones stop after the current batch"""
+    if ImportJob.objects.filter(pk=job.pk, status='queued').update(
+        status='cancelled', finished_at=timezone.now()
+    ):
+        return True
+    return bool(ImportJob.objects.filter(pk=job.pk, status='running').update(cancel_requested=True))
+
+
+def is_resumable(job):
+    if not os.path.exists(job.spool_path):
+        return False
+    if job.status in RESUMABLE_STATUSES:
+        return True
+    return job.status == 'running' and job.updated_at < timezone.now() - STALE_AFTER
+
+
+def resume(job):
+    """Queue a stopped job again; it continues after its last committed batch"""
+    if not is_resumable(job):
+        return False
+    queued = ImportJob.objects.filter(pk=job.pk, status=job.status).update(
+        status='queued', cancel_requested=False, message='', finished_at=None
+    )
+    if queued:
+        transaction.on_commit(lambda: submit(job.pk))
+    return bool(queued)
+
+
+def run_job(job_id):
+    """Import a queued job in the current thread"""
+    close_old_connections()
+    try:
+        _run(job_id)
+    finally:
+        connection.close()
+
+
+def _run(job_id):
+    now = timezone.now()
+    if not ImportJob.objects.filter(pk=job_id, status='queued').update(status='running', updated_at=now):
+        # Cancelled before it started, or picked up by another worker
+        return
+    job = ImportJob.objects.get(pk=job_id)
+    if job.started_at is None:
+        ImportJob.objects.filter(pk=job_id).update(started_at=now)
+
+    started = time.perf_counter()
+    status, message = 'completed', ''
+    try:
+        _import(job, started)
+    except JobCancelled:
+        status, message = 'cancelled', 'Cancelled by user'
+    except Exception as e:
+        status, message = 'failed', str(e)
+    finally:
+        ImportJob.objects.filter(pk=job_id).update(
+            status=status,
+            message=message,
+            cancel_requested=False,
+            finished_at=timezone.now(),
+            updated_at=timezone.now(),
+            elapsed_seconds=job.elapsed_seconds + (time.perf_counter() - started),
+        )
+        # Rows were added with bulk_create, reload the derived caches
+        vocabulary.invalidate()
+        navigation.invalidate()
+    if status == 'completed':
+        try:
+            os.remove(job.spool_path)
+        except OSError:
+            pass
+
+
+def _import(job, started):
+    errors = ErrorReport()
+    errors.count = job.rows_rejected
+    errors.errors = [tuple(error) for error in job.errors]
+    writer = BatchWriter(job.batch_size, upsert=job.upsert, session_id=f'import:{job.pk}')
+    writer.inserted = job.rows_inserted
+    writer.updated = job.rows_updated
+    writer.unchanged = job.rows_unchanged
+    clear = job.clear_existing and not job.lines_committed
+    
+    # Ranges end on line boundaries, so every commit leaves a clean resume point
+    batch = []
+    offset, line_number = job.bytes_committed, job.lines_committed
+    parsed_ranges = parse_ranges(
+        job.spool_path,
+        start=job.bytes_committed,
+        first_line=job.lines_committed + 1,
+        workers=job.workers,
+    )
+    for parsed in parsed_ranges:
+        for error_line, message in parsed.errors:
+            errors.add(error_line, message)
+        batch.extend(parsed.rows)
+        offset, line_number = parsed.end, parsed.last_line
+        if len(batch) >= job.batch_size:
+            _commit(job, writer, batch, clear, offset, line_number, errors, started)
+            batch = []
+            clear = False
+            if ImportJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+                parsed_ranges.close()
+                raise JobCancelled()
+    _commit(job, writer, batch, clear, offset, line_number, errors, started)
+
+
+def _commit(job, writer, rows, clear, offset, line_number, errors, started):
+    """Write one batch and record the job's progress in the same transaction"""
+    with transaction.atomic():
+        if clear:
+            with bulk_changes():
+                TextAnnotation.objects.all().delete()
+        inserted_before = writer.inserted
+        writer.validated_delta = 0
+        if rows:
+            writer.write_batch(rows)
+        ProgressCounter.adjust(total=writer.inserted - inserted_before, validated=writer.validated_delta)
+        ImportJob.objects.filter(pk=job.pk).update(
+            bytes_committed=offset,
+            lines_committed=line_number,
+            rows_inserted=writer.inserted,
+            rows_updated=writer.updated,
+            rows_unchanged=writer.unchanged,
+            rows_rejected=errors.count,
+            rows_parsed=writer.inserted + writer.updated + writer.unchanged + errors.count,
+            errors=[list(error) for error in errors.errors],
+            elapsed_seconds=job.elapsed_seconds + (time.perf_counter() - started),
+            updated_at=timezone.now(),
+        )
+
+
+def job_payload(job):
+    """JSON-serializable progress of an import job"""
+    return {
+        'id': job.id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'original_name': job.original_name,
+        'file_size': job.file_size,
+        'bytes_committed': job.bytes_committed,
+        'progress_percentage': job.progress_percentage,
+        'rows_parsed': job.rows_parsed,
+        'rows_inserted': job.rows_inserted,
+        'rows_updated': job.rows_updated,
+        'rows_unchanged': job.rows_unchanged,
+        'rows_rejected': job.rows_rejected,
+        'rows_per_second': round(job.rows_per_second, 1),
+        'workers': job.workers,
+        'errors': job.errors,
+        'message': job.message,
+        'cancel_requested': job.cancel_requested,
+        'resumable': is_resumable(job),
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
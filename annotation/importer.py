@@ -0,0 +1,314 @@
+"""Streaming JSONL import of annotations.
+
+Uploads are read in fixed-size chunks and split into lines as bytes (a
+newline byte never occurs inside a multi-byte UTF-8 sequence), so each line
+is decoded and parsed on its own and a bad line only rejects itself. Parsed
+rows are inserted with ``bulk_create`` in batches and then dropped, so peak
+memory depends on the batch size rather than on the size of the file.
+
+Rows can be appended, or upserted: matched on a hash of their normalised
+text so re-importing a corrected file only writes what changed and keeps
+the annotations' change history.
+
+Files on disk can also be parsed in parallel: ``parse_ranges`` cuts the file
+into newline-aligned byte ranges, decodes them on a pool of worker processes
+and hands the results back in file order to the single writer.
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .jsonl import RANGE_SIZE, RowError, iter_lines, parse_range, parse_row, split_ranges
+from .models import TextAnnotation, AnnotationChange, DataVersion, text_content_hash
+from .signals import bulk_changes
+
+READ_CHUNK_SIZE = 256 * 1024
+DEFAULT_BATCH_SIZE = getattr(settings, 'ANNOTATION_IMPORT_BATCH_SIZE', 2000)
+# Rejected lines kept with their message; the rest are only counted
+ERROR_REPORT_LIMIT = getattr(settings, 'ANNOTATION_IMPORT_ERROR_LIMIT', 50)
+# Fields an upsert compares and overwrites (when the line has them) on a matching annotation
+UPSERT_FIELDS = ('drugs', 'adverse_events', 'is_validated')
+# Content hashes per IN (...) lookup, below SQLite's bound parameter limit
+HASH_LOOKUP_SIZE = 900
+PARALLEL_WORKERS = getattr(settings, 'ANNOTATION_IMPORT_PARALLEL_WORKERS', None) or os.cpu_count() or 1
+
+
+class ErrorReport:
+    """Bounded record of rejected lines"""
+
+    def __init__(self, limit=ERROR_REPORT_LIMIT):
+        self.limit = limit
+        self.count = 0
+        self.errors = []
+
+    def __len__(self):
+        return self.count
+
+    def add(self, line_number, message):
+        self.count += 1
+        if len(self.errors) < self.limit:
+            self.errors.append((line_number, message))
+
+    @property
+    def omitted(self):
+        """Number of rejected lines not kept in the report"""
+        return self.count - len(self.errors)
+
+
+class ImportResult:
+    """Counts and timing of one import run"""
+
+    def __init__(self, errors):
+        self.lines = 0
+        self.imported = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = errors
+        self.elapsed = 0.0
+
+    @property
+    def skipped(self):
+        return self.errors.count
+
+    @property
+    def rows_per_second(self):
+        written = self.imported + self.updated + self.unchanged
+        return written / self.elapsed if self.elapsed else 0.0
+
+
+class ParsedRange:
+    """Rows parsed from one byte range of a file, with file-wide line numbers"""
+    __slots__ = ('rows', 'errors', 'last_line', 'end')
+
+    def __init__(self, rows, errors, last_line, end):
+        self.rows = rows
+        self.errors = errors
+        self.last_line = last_line
+        self.end = end
+
+
+def read_chunks(fileobj, chunk_size=READ_CHUNK_SIZE):
+    """Yield byte chunks from an uploaded file or a binary file object"""
+    if hasattr(fileobj, 'chunks'):
+        yield from fileobj.chunks(chunk_size)
+        return
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_lines(lines, errors, result=None, validated_field='is_validated'):
+    """Yield parsed rows, recording rejected lines in ``errors``"""
+    for line_number, raw in lines:
+        if result is not None:
+            result.lines = line_number
+        if not raw.strip():
+            continue
+        try:
+            yield parse_row(raw, validated_field)
+        except RowError as e:
+            errors.add(line_number, str(e))
+
+
+def parse_ranges(path, start=0, first_line=1, workers=1, range_size=RANGE_SIZE, validated_field='is_validated'):
+    """Yield a ParsedRange for each byte range of ``path`` from ``start``, in file order.
+
+    With more than one worker the ranges are decoded on a process pool; at
+    most two ranges per worker are in flight so memory stays bounded.
+    """
+    line = first_line - 1
+    ranges = split_ranges(path, start, range_size)
+    if workers <= 1:
+        for range_start, range_end in ranges:
+            rows, errors, line_count = parse_range(path, range_start, range_end, validated_field)
+            yield ParsedRange(rows, [(line + n, message) for n, message in errors], line + line_count, range_end)
+            line += line_count
+        return
+
+    # Spawned workers only import annotation.jsonl, so they never touch Django or the database
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+    try:
+        pending = deque()
+        ranges = iter(ranges)
+        while True:
+            for range_start, range_end in ranges:
+                future = pool.submit(parse_range, path, range_start, range_end, validated_field)
+                pending.append((range_end, future))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            range_end, future = pending.popleft()
+            rows, errors, line_count = future.result()
+            yield ParsedRange(rows, [(line + n, message) for n, message in errors], line + line_count, range_end)
+            line += line_count
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class BatchWriter:
+    """Writes parsed rows in batches, appending them or upserting on the content hash.
+
+    In upsert mode every line is matched to one stored annotation with the
+    same normalised text that no earlier line of the import matched, so a
+    file with the same text on several lines (with different entities)
+    lines up with the copies a previous import of it created. A copy that
+    already holds the line's values is preferred; otherwise the oldest one
+    gets the fields the line contains, in one ``bulk_update`` per batch,
+    with every changed field logged as a 'bulk_update' AnnotationChange.
+    Lines left without a match are inserted. Importing the same file again
+    therefore changes nothing.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, upsert=False, session_id='import'):
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.session_id = session_id
+        # Rows written, each input row counted once as inserted, updated or unchanged
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        # Net change in validated annotations, for the progress counters
+        self.validated_delta = 0
+        # Ids matched by earlier upserted lines (an int per line; a resumed
+        # job starts with an empty set)
+        self.matched_ids = set()
+
+    def write(self, rows):
+        """Write an iterable of parsed rows batch by batch"""
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+
+    def write_batch(self, rows):
+        """Write one batch of (text, drugs, adverse_events, is_validated) rows"""
+        if self.upsert:
+            rows = self._update_existing(rows)
+        # Fields a line leaves out (None) get the model defaults
+        annotations = [
+            TextAnnotation(
+                text=text,
+                drugs=drugs or [],
+                adverse_events=adverse_events or [],
+                is_validated=bool(is_validated),
+                content_hash=text_content_hash(text),
+            )
+            for text, drugs, adverse_events, is_validated in rows
+        ]
+        if annotations:
+            TextAnnotation.objects.bulk_create(annotations, batch_size=self.batch_size)
+            DataVersion.bump()
+            if self.upsert:
+                self.matched_ids.update(annotation.pk for annotation in annotations)
+        self.inserted += len(annotations)
+        self.validated_delta += sum(1 for annotation in annotations if annotation.is_validated)
+
+    def _update_existing(self, rows):
+        """Apply rows to annotations with the same text, returning the rows that are new"""
+        hashes = list({text_content_hash(row[0]) for row in rows})
+        existing = {}
+        for start in range(0, len(hashes), HASH_LOOKUP_SIZE):
+            matches = TextAnnotation.objects.filter(
+                content_hash__in=hashes[start:start + HASH_LOOKUP_SIZE]
+            ).only('id', 'content_hash', *UPSERT_FIELDS).order_by('id')
+            for annotation in matches:
+                if annotation.pk not in self.matched_ids:
+                    existing.setdefault(annotation.content_hash, []).append(annotation)
+
+        now = timezone.now()
+        updated = []
+        changes = []
+        new_rows = []
+        for row in rows:
+            candidates = existing.get(text_content_hash(row[0]))
+            if not candidates:
+                new_rows.append(row)
+                continue
+            values = {field: value for field, value in zip(UPSERT_FIELDS, row[1:]) if value is not None}
+
+            def differing(annotation):
+                return [field for field in values if getattr(annotation, field) != values[field]]
+
+            annotation = next((candidate for candidate in candidates if not differing(candidate)), candidates[0])
+            candidates.remove(annotation)
+            self.matched_ids.add(annotation.pk)
+            changed = differing(annotation)
+            if not changed:
+                self.unchanged += 1
+                continue
+            for field in changed:
+                changes.append(AnnotationChange(
+                    annotation=annotation,
+                    change_type='bulk_update',
+                    field_name=field,
+                    old_value=getattr(annotation, field),
+                    new_value=values[field],
+                    session_id=self.session_id,
+                ))
+                setattr(annotation, field, values[field])
+            if 'is_validated' in changed:
+                self.validated_delta += 1 if annotation.is_validated else -1
+            annotation.updated_at = now
+            updated.append(annotation)
+            self.updated += 1
+
+        if updated:
+            TextAnnotation.objects.bulk_update(updated, [*UPSERT_FIELDS, 'updated_at'], batch_size=self.batch_size)
+            AnnotationChange.objects.bulk_create(changes, batch_size=self.batch_size)
+            DataVersion.bump()
+        return new_rows
+
+
+def _finish(result, writer, started):
+    result.imported = writer.inserted
+    result.updated = writer.updated
+    result.unchanged = writer.unchanged
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def import_stream(chunks, batch_size=DEFAULT_BATCH_SIZE, clear=False, upsert=False,
+                  error_limit=ERROR_REPORT_LIMIT, session_id='import', validated_field='is_validated'):
+    """Import JSONL from byte chunks in one transaction and return an ImportResult"""
+    result = ImportResult(ErrorReport(error_limit))
+    writer = BatchWriter(batch_size, upsert=upsert, session_id=session_id)
+    started = time.perf_counter()
+    with transaction.atomic(), bulk_changes():
+        if clear:
+            TextAnnotation.objects.all().delete()
+        writer.write(parse_lines(iter_lines(chunks), result.errors, result, validated_field))
+    return _finish(result, writer, started)
+
+
+def import_file(path, batch_size=DEFAULT_BATCH_SIZE, clear=False, upsert=False, workers=1,
+                error_limit=ERROR_REPORT_LIMIT, session_id='import', validated_field='is_validated'):
+    """Import a JSONL file in one transaction, parsing it on ``workers`` processes"""
+    result = ImportResult(ErrorReport(error_limit))
+    writer = BatchWriter(batch_size, upsert=upsert, session_id=session_id)
+    started = time.perf_counter()
+
+    def rows():
+        for parsed in parse_ranges(path, workers=workers, validated_field=validated_field):
+            for line_number, message in parsed.errors:
+                result.errors.add(line_number, message)
+            result.lines = parsed.last_line
+            yield from parsed.rows
+
+    with transaction.atomic(), bulk_changes():
+        if clear:
+            TextAnnotation.objects.all().delete()
+        writer.write(rows())
+    return _finish(result, writer, started)
@@ -0,0 +1,105 @@
+"""Line splitting and row parsing for JSONL imports.
+
+This module has no Django dependencies so the parallel import can run
+``parse_range`` in worker processes without setting Django up there.
+"""
+import json
+import os
+
+# Byte ranges handed to parse workers; each result holds roughly this much text
+RANGE_SIZE = 4 * 1024 * 1024
+
+
+class RowError(ValueError):
+    """A JSONL line that cannot be imported"""
+
+
+def iter_lines(chunks, first_line=1):
+    """Yield (line_number, raw_bytes) for every line in a stream of byte chunks"""
+    pending = b''
+    line_number = first_line - 1
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n') if pending else chunk.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            yield line_number, line
+    if pending:
+        yield line_number + 1, pending
+
+
+def parse_row(raw, validated_field='is_validated'):
+    """Decode and validate one JSONL line into a (text, drugs, adverse_events, is_validated) tuple.
+
+    ``validated_field`` names the key holding the validation flag; any key
+    other than ``is_validated`` marks the row validated when it is present
+    with a non-empty value (e.g. ``drug_ade_pairs`` in gold data). Entity
+    lists and the flag are None when the line leaves them out, so an upsert
+    keeps the stored value.
+    """
+    try:
+        data = json.loads(raw.decode('utf-8-sig'))
+    except UnicodeDecodeError as e:
+        raise RowError(f'Invalid UTF-8: {e}')
+    except json.JSONDecodeError as e:
+        raise RowError(f'Invalid JSON: {e}')
+    if not isinstance(data, dict):
+        raise RowError('Expected a JSON object')
+
+    text = data.get('text', '')
+    drugs = data.get('drugs')
+    adverse_events = data.get('adverse_events')
+    is_validated = data.get(validated_field)
+    if not isinstance(text, str):
+        raise RowError('"text" must be a string')
+    for field, values in (('drugs', drugs), ('adverse_events', adverse_events)):
+        if field not in data:
+            continue
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise RowError(f'"{field}" must be a list of strings')
+    if validated_field not in data:
+        is_validated = None
+    elif validated_field != 'is_validated':
+        is_validated = bool(is_validated)
+    elif not isinstance(is_validated, bool):
+        raise RowError('"is_validated" must be true or false')
+    return text, drugs, adverse_events, is_validated
+
+
+def split_ranges(path, start=0, range_size=RANGE_SIZE):
+    """Yield (start, end) byte ranges of ``path`` that begin and end on line boundaries"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as handle:
+        while start < size:
+            end = min(start + range_size, size)
+            if end < size:
+                handle.seek(end)
+                # Extend to the end of the line the cut fell into
+                handle.readline()
+                end = handle.tell()
+            yield start, end
+            start = end
+
+
+def parse_range(path, start, end, validated_field='is_validated'):
+    """Parse the lines in one byte range.
+
+    Returns (rows, errors, line_count) where errors are (line, message) pairs
+    numbered from 1 within the range.
+    """
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        data = handle.read(end - start)
+    lines = data.split(b'\n')
+    if lines and not lines[-1]:
+        lines.pop()
+    rows = []
+    errors = []
+    for line_number, raw in enumerate(lines, 1):
+        if not raw.strip():
+            continue
+        try:
+            rows.append(parse_row(raw, validated_field))
+        except RowError as e:
+            errors.append((line_number, str(e)))
+    return rows, errors, len(lines)
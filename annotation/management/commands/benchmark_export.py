@@ -0,0 +1,124 @@
+import itertools
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from annotation import importer
+from annotation.models import TextAnnotation
+
+DEFAULT_SOURCE = settings.BASE_DIR / 'extracted_data.jsonl'
+ENDPOINTS = {
+    'export': 'export_jsonl',
+    'entities': 'export_entities_jsonl',
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure time to first byte, throughput and peak memory of the streaming exports for several corpus sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            default=str(DEFAULT_SOURCE),
+            help='JSONL file whose lines are repeated to fill the corpus up to each size (default: extracted_data.jsonl)',
+        )
+        parser.add_argument(
+            '--sizes',
+            default='5000,100000,1000000',
+            help='Comma-separated corpus sizes in rows (default: 5000,100000,1000000)',
+        )
+        parser.add_argument(
+            '--endpoints',
+            default='export,entities',
+            help=f'Comma-separated exports to request (choices: {", ".join(ENDPOINTS)})',
+        )
+        parser.add_argument(
+            '--query',
+            default='',
+            help='Extra query string for every request, e.g. "filter=validated"',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(',') if size.strip())
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = [name for name in endpoints if name not in ENDPOINTS]
+        if unknown:
+            raise CommandError(f'Unknown endpoint(s): {", ".join(unknown)}')
+        try:
+            with open(options['source'], 'rb') as handle:
+                source_lines = [line.rstrip(b'\n') + b'\n' for line in handle if line.strip()]
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["source"]}: {e}')
+        if not source_lines:
+            raise CommandError(f'{options["source"]} has no lines')
+
+        self.stdout.write(
+            self.style.SUCCESS('=== Streaming Export Benchmark ===\n')
+        )
+        self.stdout.write(f'Source: {options["source"]} ({len(source_lines)} lines)\n')
+
+        # DEBUG keeps every executed statement in memory, which would
+        # dominate the measurement for large exports
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']), transaction.atomic():
+            lines = itertools.cycle(source_lines)
+            for size in sizes:
+                missing = size - TextAnnotation.objects.count()
+                if missing > 0:
+                    self.stdout.write(f'Filling the corpus to {size} rows...')
+                    importer.import_stream(self._chunks(lines, missing))
+                for name in endpoints:
+                    self._measure(name, size, options['query'])
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark completed (all inserted rows rolled back).'))
+
+    def _measure(self, name, size, query):
+        """Request one export and consume it like a client would"""
+        url = reverse(ENDPOINTS[name]) + (f'?{query}' if query else '')
+        client = Client()
+        tracemalloc.start()
+        try:
+            started = time.perf_counter()
+            response = client.get(url)
+            if not response.streaming:
+                raise CommandError(f'{url} returned a non-streaming {response.status_code} response')
+            first_byte = None
+            total_bytes = 0
+            rows = 0
+            for chunk in response.streaming_content:
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                total_bytes += len(chunk)
+                rows += chunk.count(b'\n')
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.stdout.write(
+            f'{name:>9} {size:>9} rows  first byte {(first_byte or elapsed) * 1000:8.1f} ms  '
+            f'{elapsed:8.2f} s  {rows / elapsed if elapsed else 0:9.0f} rows/sec  '
+            f'{total_bytes / (1024 * 1024):9.1f} MiB sent  peak heap {peak / (1024 * 1024):6.1f} MiB'
+        )
+
+    def _chunks(self, lines, size):
+        """Stream ``size`` lines from the cycled source without building the whole input"""
+        buffer = []
+        buffered = 0
+        for line in itertools.islice(lines, size):
+            buffer.append(line)
+            buffered += len(line)
+            if buffered >= importer.READ_CHUNK_SIZE:
+                yield b''.join(buffer)
+                buffer = []
+                buffered = 0
+        if buffer:
+            yield b''.join(buffer)
@@ -0,0 +1,101 @@
+import itertools
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from annotation import importer
+
+DEFAULT_SOURCE = settings.BASE_DIR / 'extracted_data.jsonl'
+
+
+class Command(BaseCommand):
+    help = 'Measure streaming JSONL import throughput (rows/sec) for several file sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            default=str(DEFAULT_SOURCE),
+            help='JSONL file whose lines are repeated to build each input (default: extracted_data.jsonl)',
+        )
+        parser.add_argument(
+            '--sizes',
+            default='5000,100000,1000000',
+            help='Comma-separated line counts to import (default: 5000,100000,1000000)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=importer.DEFAULT_BATCH_SIZE,
+            help=f'Rows per bulk_create (default: {importer.DEFAULT_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--memory',
+            action='store_true',
+            help='Also report peak Python heap usage (slower, uses tracemalloc)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+        try:
+            with open(options['source'], 'rb') as handle:
+                source_lines = [line.rstrip(b'\n') + b'\n' for line in handle if line.strip()]
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["source"]}: {e}')
+        if not source_lines:
+            raise CommandError(f'{options["source"]} has no lines')
+
+        self.stdout.write(
+            self.style.SUCCESS('=== JSONL Import Benchmark ===\n')
+        )
+        self.stdout.write(f'Source: {options["source"]} ({len(source_lines)} lines), batch size {options["batch_size"]}\n')
+
+        for size in sizes:
+            result, peak = self._run(source_lines, size, options['batch_size'], options['memory'])
+            line = (
+                f'{size:>9} lines  {result.imported:>9} rows  '
+                f'{result.elapsed:8.2f} s  {result.rows_per_second:10.0f} rows/sec'
+            )
+            if peak is not None:
+                line += f'  peak heap {peak / (1024 * 1024):7.1f} MiB'
+            self.stdout.write(line)
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark completed (all imports rolled back).'))
+
+    def _run(self, source_lines, size, batch_size, trace_memory):
+        """Import ``size`` lines inside a transaction that is rolled back afterwards"""
+        chunks = self._chunks(source_lines, size)
+        peak = None
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            # DEBUG keeps every executed statement in memory, which would
+            # dominate the measurement for large batches
+            with override_settings(DEBUG=False), transaction.atomic():
+                result = importer.import_stream(chunks, batch_size=batch_size)
+                transaction.set_rollback(True)
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        return result, peak
+
+    def _chunks(self, source_lines, size):
+        """Stream ``size`` lines cycled from the source without building the whole input"""
+        lines = itertools.islice(itertools.cycle(source_lines), size)
+        buffer = []
+        buffered = 0
+        for line in lines:
+            buffer.append(line)
+            buffered += len(line)
+            if buffered >= importer.READ_CHUNK_SIZE:
+                yield b''.join(buffer)
+                buffer = []
+                buffered = 0
+        if buffer:
+            yield b''.join(buffer)
@@ -0,0 +1,93 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from annotation.models import TextAnnotation, AnnotationChange
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = 'Compare writes per save for per-entity change logging and batched change sets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--saves',
+            type=int,
+            default=200,
+            help='Number of saves to run for each strategy (default: 200)',
+        )
+        parser.add_argument(
+            '--entities',
+            type=int,
+            default=4,
+            help='Entities added and removed per field on each save (default: 4)',
+        )
+
+    def handle(self, *args, **options):
+        saves = options['saves']
+        entities = options['entities']
+
+        self.stdout.write(
+            self.style.SUCCESS('=== Annotation Save Benchmark ===\n')
+        )
+        self.stdout.write(f'{saves} saves, {entities} drugs and {entities} adverse events swapped per save\n')
+
+        results = [
+            ('per-entity log_*_change', self._run(self._save_per_entity, saves, entities)),
+            ('AnnotationChange.change_set', self._run(self._save_change_set, saves, entities)),
+        ]
+
+        for label, (writes, statements, elapsed) in results:
+            self.stdout.write(
+                f'{label:<30} {writes / saves:6.1f} writes/save  '
+                f'{statements / saves:6.1f} statements/save  '
+                f'{elapsed / saves * 1000:7.2f} ms/save'
+            )
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark completed (all changes rolled back).'))
+
+    def _run(self, save, saves, entities):
+        """Run one strategy inside a transaction that is rolled back afterwards"""
+        with transaction.atomic():
+            annotation = TextAnnotation.objects.create(text='Benchmark annotation')
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for iteration in range(saves):
+                    drugs = [f'drug-{iteration}-{n}' for n in range(entities)]
+                    events = [f'event-{iteration}-{n}' for n in range(entities)]
+                    save(annotation, drugs, events)
+                elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        statements = [query['sql'].lstrip().upper() for query in queries.captured_queries]
+        writes = sum(1 for sql in statements if sql.startswith(WRITE_PREFIXES))
+        return writes, len(statements), elapsed
+
+    def _save_per_entity(self, annotation, drugs, events):
+        """The previous save path: one INSERT per changed entity, then the UPDATE"""
+        old_drugs = annotation.drugs.copy()
+        old_events = annotation.adverse_events.copy()
+        annotation.drugs = drugs
+        annotation.adverse_events = events
+        for drug in [d for d in drugs if d not in old_drugs]:
+            AnnotationChange.log_drug_change(annotation, 'drug_added', drug, old_drugs, drugs, 'benchmark')
+        for drug in [d for d in old_drugs if d not in drugs]:
+            AnnotationChange.log_drug_change(annotation, 'drug_removed', drug, old_drugs, drugs, 'benchmark')
+        for event in [e for e in events if e not in old_events]:
+            AnnotationChange.log_event_change(annotation, 'event_added', event, old_events, events, 'benchmark')
+        for event in [e for e in old_events if e not in events]:
+            AnnotationChange.log_event_change(annotation, 'event_removed', event, old_events, events, 'benchmark')
+        annotation.save()
+
+    def _save_change_set(self, annotation, drugs, events):
+        """The batched save path used by annotation_list"""
+        changes = AnnotationChange.change_set(annotation, 'benchmark')
+        changes.diff_drugs(annotation.drugs.copy(), drugs)
+        changes.diff_events(annotation.adverse_events.copy(), events)
+        annotation.drugs = drugs
+        annotation.adverse_events = events
+        with transaction.atomic():
+            annotation.save()
+            changes.save()
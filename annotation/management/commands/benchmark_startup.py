@@ -0,0 +1,131 @@
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from annotation.models import ProgressCounter
+
+# Runs in a fresh interpreter so module import cost is measured from scratch.
+# The first request claims a lease and fills the shared caches, so the probe
+# works on a copy of the database and its own cache directory (argv 2 and 3)
+PROBE_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+from django.conf import settings
+settings.DATABASES["default"]["NAME"] = sys.argv[2]
+settings.CACHES = {"default": {
+    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+    "LOCATION": sys.argv[3],
+}}
+import django
+django.setup()
+setup_done = time.perf_counter()
+import annotation.views
+from django.urls import get_resolver
+get_resolver().url_patterns
+import_done = time.perf_counter()
+if sys.argv[1] == "cold":
+    from annotation import navigation, vocabulary
+    vocabulary.invalidate()
+    navigation.invalidate()
+from django.test import Client
+client = Client(HTTP_HOST="localhost")
+request_started = time.perf_counter()
+first = client.get("/annotation/", follow=True)
+first_done = time.perf_counter()
+second = client.get(first.request["PATH_INFO"])
+second_done = time.perf_counter()
+print(json.dumps({
+    "setup": setup_done - started,
+    "import": import_done - setup_done,
+    "first_request": first_done - request_started,
+    "warm_request": second_done - first_done,
+    "status": first.status_code,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measure import time and first-request latency of the annotation app'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=5,
+            help='Number of fresh interpreters to start (default: 5)',
+        )
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Drop the vocabulary and navigation caches before each first request',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_startup copies the database and only supports SQLite')
+        runs = options['runs']
+        mode = 'cold' if options['cold'] else 'warm'
+
+        self.stdout.write(
+            self.style.SUCCESS('=== Annotation Startup Benchmark ===\n')
+        )
+        self.stdout.write(f'Corpus size: {ProgressCounter.get().total} annotations')
+        self.stdout.write(f'Runs: {runs} ({mode} caches)\n')
+
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE
+        ))
+        samples = []
+        with tempfile.TemporaryDirectory() as directory:
+            database = Path(directory) / 'db.sqlite3'
+            cache_location = Path(directory) / 'cache'
+            self._copy_database(database)
+            # An unrecorded run fills the private caches so warm runs find them populated
+            probes = ([] if mode == 'cold' else [False]) + [True] * runs
+            for record in probes:
+                result = subprocess.run(
+                    [sys.executable, '-c', PROBE_SCRIPT, mode, str(database), str(cache_location)],
+                    cwd=settings.BASE_DIR,
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                )
+                if result.returncode != 0:
+                    self.stderr.write(result.stderr)
+                    return
+                if record:
+                    samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+        if any(sample['status'] != 200 for sample in samples):
+            self.stdout.write(self.style.WARNING('First request did not return 200, timings may be misleading'))
+
+        for key, label in (
+            ('setup', 'django.setup()'),
+            ('import', 'Import annotation views/urls'),
+            ('first_request', 'First request'),
+            ('warm_request', 'Second request'),
+        ):
+            values = [sample[key] * 1000 for sample in samples]
+            self.stdout.write(
+                f'{label:<30} median {statistics.median(values):8.1f} ms   '
+                f'max {max(values):8.1f} ms'
+            )
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark completed!'))
+
+    def _copy_database(self, target):
+        """Snapshot the live database with SQLite's online backup"""
+        connection.ensure_connection()
+        destination = sqlite3.connect(target)
+        try:
+            connection.connection.backup(destination)
+        finally:
+            destination.close()
@@ -0,0 +1,60 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from annotation import bio, exporter
+
+
+class Command(BaseCommand):
+    help = 'Stream token-level BIO tags (CoNLL or JSONL) for the whole corpus in one pass'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write, or - for standard output')
+        parser.add_argument(
+            '--format',
+            choices=bio.FORMATS,
+            default='conll',
+            help='conll: token<TAB>tag lines with a blank line per sentence; jsonl: one {"tokens", "tags"} object per line',
+        )
+        parser.add_argument(
+            '--filter',
+            choices=list(exporter.FILTER_NAMES),
+            default='all',
+            help='Which annotations to export (default: all)',
+        )
+        parser.add_argument(
+            '--substrings',
+            action='store_true',
+            help='Also tag entity names found inside longer words',
+        )
+
+    def handle(self, *args, **options):
+        annotations = exporter.filtered_annotations(options['filter'])
+        stats = {'sentences': 0, 'tokens': 0}
+        lines = bio.iter_bio(
+            exporter.iter_rows(annotations, bio.BIO_FIELDS),
+            options['format'],
+            word_boundary=not options['substrings'],
+            stats=stats,
+        )
+
+        started = time.perf_counter()
+        if options['output'] == '-':
+            for chunk in exporter.buffered(lines):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            try:
+                with open(options['output'], 'wb') as handle:
+                    for chunk in exporter.buffered(lines):
+                        handle.write(chunk)
+            except OSError as e:
+                raise CommandError(f'Cannot write {options["output"]}: {e}')
+        elapsed = time.perf_counter() - started
+
+        rate = stats['sentences'] / elapsed if elapsed else 0.0
+        # Report on stderr so it never mixes with output written to stdout
+        self.stderr.write(
+            f'{stats["sentences"]} sentences, {stats["tokens"]} tokens in {elapsed:.2f} s '
+            f'({rate:.0f} sentences/sec)'
+        )
@@ -0,0 +1,107 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from annotation import exporter, partitioned_export
+
+
+class Command(BaseCommand):
+    help = 'Export the dataset for offline builds, serialising id ranges on several processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output',
+            help='File to write (- for standard output), or a directory with --shards',
+        )
+        parser.add_argument(
+            '--flavour',
+            choices=partitioned_export.FLAVOURS,
+            default='jsonl',
+            help='jsonl: like export_jsonl; entities: character offsets; conll / bio-jsonl: token BIO tags',
+        )
+        parser.add_argument(
+            '--filter',
+            choices=list(exporter.FILTER_NAMES),
+            default='all',
+            help='Which annotations to export (default: all)',
+        )
+        parser.add_argument(
+            '--include-changes',
+            action='store_true',
+            help='Add change summaries and history (jsonl and entities flavours)',
+        )
+        parser.add_argument(
+            '--substrings',
+            action='store_true',
+            help='Also match entity names inside longer words (entities and BIO flavours)',
+        )
+        parser.add_argument(
+            '--shards',
+            action='store_true',
+            help='Write part-00000.<ext>, part-00001.<ext>, ... and manifest.json into the output directory',
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Gzip the output (each shard, or each range of a single file, is compressed by its worker)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=partitioned_export.WORKERS,
+            help=f'Serialising processes (default: {partitioned_export.WORKERS}; 1 runs in this process)',
+        )
+        parser.add_argument(
+            '--rows-per-part',
+            type=int,
+            default=partitioned_export.RANGE_SIZE,
+            help=f'Annotations per id range / shard (default: {partitioned_export.RANGE_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        if options['rows_per_part'] < 1:
+            raise CommandError('--rows-per-part must be at least 1')
+        if options['include_changes'] and options['flavour'] not in ('jsonl', 'entities'):
+            raise CommandError('--include-changes is only available for the jsonl and entities flavours')
+        kwargs = {
+            'flavour': options['flavour'],
+            'filter_type': options['filter'],
+            'include_changes': options['include_changes'],
+            'word_boundary': not options['substrings'],
+            'compress': options['gzip'],
+            'workers': options['workers'],
+            'range_size': options['rows_per_part'],
+        }
+
+        if options['shards']:
+            if options['output'] == '-':
+                raise CommandError('--shards needs an output directory')
+            try:
+                result = partitioned_export.write_shards(options['output'], **kwargs)
+            except OSError as e:
+                raise CommandError(f'Cannot write shards to {options["output"]}: {e}')
+            self.stderr.write(f'Wrote {len(result.shards)} shard(s) and {partitioned_export.MANIFEST_NAME} to {options["output"]}')
+        else:
+            result = partitioned_export.ExportResult()
+            started = time.perf_counter()
+            chunks = partitioned_export.iter_export(result=result, **kwargs)
+            if options['output'] == '-':
+                for chunk in chunks:
+                    sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+            else:
+                try:
+                    with open(options['output'], 'wb') as handle:
+                        for chunk in chunks:
+                            handle.write(chunk)
+                except OSError as e:
+                    raise CommandError(f'Cannot write {options["output"]}: {e}')
+            result.elapsed = time.perf_counter() - started
+
+        # Report on stderr so it never mixes with output written to stdout
+        self.stderr.write(
+            f'{result.rows} rows in {result.ranges} range(s), {result.bytes / (1024 * 1024):.1f} MiB, '
+            f'{result.elapsed:.2f} s ({result.rows_per_second:.0f} rows/sec) with {options["workers"]} worker(s)'
+        )
@@ -0,0 +1,183 @@
+import gzip
+import os
+import sys
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from annotation import importer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+# Page cache for the bulk load, in KiB (negative values are KiB for SQLite)
+SQLITE_CACHE_KIB = 256 * 1024
+
+
+def is_gzip(path):
+    with open(path, 'rb') as handle:
+        return handle.read(2) == GZIP_MAGIC
+
+
+def peak_rss_mib():
+    """Peak resident set size of this process and of its finished children, in MiB"""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+
+class Command(BaseCommand):
+    help = 'Import annotations from a (optionally gzipped) JSONL file with streaming, batched inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL or JSONL.gz file with one {"text", "drugs", "adverse_events", "is_validated"} object per line')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=importer.DEFAULT_BATCH_SIZE,
+            help=f'Rows per bulk_create/bulk_update (default: {importer.DEFAULT_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete existing annotations (and their change history) before importing',
+        )
+        parser.add_argument(
+            '--upsert',
+            action='store_true',
+            help='Update annotations with the same normalised text instead of adding duplicates',
+        )
+        parser.add_argument(
+            '--validated-from-field',
+            default='is_validated',
+            metavar='FIELD',
+            help='JSON key marking rows as validated; keys other than is_validated count when non-empty '
+                 '(e.g. drug_ade_pairs for gold data)',
+        )
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            nargs='?',
+            const=0,
+            default=1,
+            metavar='WORKERS',
+            help='Decode JSON on WORKERS processes (default: 1; without a value, one per CPU core). '
+                 'Not available for gzip input',
+        )
+        parser.add_argument(
+            '--no-tune',
+            action='store_true',
+            help='Leave SQLite pragmas and indexes alone during the load',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'{path} is not a file')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        workers = options['parallel'] or importer.PARALLEL_WORKERS
+        if workers < 1:
+            raise CommandError('--parallel must be at least 1')
+        compressed = is_gzip(path)
+        if compressed and workers > 1:
+            raise CommandError('--parallel needs an uncompressed file (byte ranges cannot be read from gzip)')
+
+        kwargs = {
+            'batch_size': options['batch_size'],
+            'clear': options['clear'],
+            'upsert': options['upsert'],
+            'session_id': 'import_jsonl',
+            'validated_field': options['validated_from_field'],
+        }
+        tune = not options['no_tune'] and connection.vendor == 'sqlite'
+        self.stdout.write(
+            f'Importing {path}{" (gzip)" if compressed else ""} with {workers} parser process(es), '
+            f'batch size {options["batch_size"]}{", upsert" if options["upsert"] else ""}...'
+        )
+
+        with self.sqlite_bulk_load(tune):
+            # Indexes are dropped and rebuilt inside the import transaction, so
+            # a failed or interrupted load leaves the schema untouched
+            with transaction.atomic():
+                deferred = self.drop_indexes(keep_content_hash=options['upsert']) if tune else []
+                if compressed:
+                    with gzip.open(path, 'rb') as handle:
+                        result = importer.import_stream(importer.read_chunks(handle), **kwargs)
+                else:
+                    result = importer.import_file(path, workers=workers, **kwargs)
+                if deferred:
+                    self.stdout.write(f'Rebuilding {len(deferred)} deferred index(es)...')
+                    with connection.cursor() as cursor:
+                        for sql in deferred:
+                            cursor.execute(sql)
+
+        for line_number, error in result.errors.errors:
+            self.stdout.write(self.style.WARNING(f'Skipped line {line_number}: {error}'))
+        if result.errors.omitted:
+            self.stdout.write(self.style.WARNING(f'... and {result.errors.omitted} more lines skipped.'))
+
+        self.stdout.write(f'Lines read: {result.lines}')
+        self.stdout.write(f'Inserted: {result.imported}')
+        if options['upsert']:
+            self.stdout.write(f'Updated: {result.updated}')
+            self.stdout.write(f'Unchanged: {result.unchanged}')
+        self.stdout.write(f'Skipped: {result.skipped}')
+        self.stdout.write(f'Elapsed: {result.elapsed:.2f} s ({result.rows_per_second:.0f} rows/sec)')
+        own, children = peak_rss_mib()
+        if own is not None:
+            line = f'Peak RSS: {own:.1f} MiB'
+            if workers > 1:
+                line += f' (parser processes: {children:.1f} MiB)'
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS('Import completed!'))
+
+    @contextmanager
+    def sqlite_bulk_load(self, enabled):
+        """Relax SQLite durability settings for the run and restore them afterwards"""
+        if not enabled:
+            yield
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+            cursor.execute('PRAGMA synchronous')
+            synchronous = cursor.fetchone()[0]
+            cursor.execute('PRAGMA cache_size')
+            cache_size = cursor.fetchone()[0]
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KIB}')
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA cache_size={int(cache_size)}')
+                cursor.execute(f'PRAGMA synchronous={int(synchronous)}')
+                if journal_mode.lower() != 'wal':
+                    cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+
+    def drop_indexes(self, keep_content_hash=False):
+        """Drop secondary indexes on the annotations table, returning the SQL to recreate them"""
+        table = importer.TextAnnotation._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                [table],
+            )
+            indexes = cursor.fetchall()
+            deferred = []
+            for name, sql in indexes:
+                if keep_content_hash and 'content_hash' in sql:
+                    # Upserts look rows up by hash while loading
+                    continue
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+                deferred.append(sql)
+        return deferred
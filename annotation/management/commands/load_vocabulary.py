@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from annotation import vocabulary_loader
+from annotation.models import DrugListEntry, ADEListEntry
+
+DEFAULT_DRUGS = settings.BASE_DIR / 'drugs_list.txt'
+DEFAULT_MEDICATIONS = settings.BASE_DIR / 'Support Docs' / 'medications_top500.json'
+
+
+class Command(BaseCommand):
+    help = 'Bulk load drug/ADE term lists and the brand to generic medications file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drugs', action='append', default=[], metavar='PATH',
+                            help='Plain text drug list, one name per line (repeatable)')
+        parser.add_argument('--ades', action='append', default=[], metavar='PATH',
+                            help='Plain text adverse event list, one name per line (repeatable)')
+        parser.add_argument('--medications', action='append', default=[], metavar='PATH',
+                            help='JSON list of {"generic", "brand": "A; B"} entries (repeatable)')
+
+    def handle(self, *args, **options):
+        drugs, ades, medications = options['drugs'], options['ades'], options['medications']
+        if not (drugs or ades or medications):
+            # Load the lists shipped with the project
+            drugs = [DEFAULT_DRUGS]
+            medications = [DEFAULT_MEDICATIONS]
+
+        for path in drugs:
+            self._load(path, 'drugs', lambda handle: vocabulary_loader.load_terms(
+                DrugListEntry, vocabulary_loader.read_terms(handle)))
+        for path in ades:
+            self._load(path, 'adverse events', lambda handle: vocabulary_loader.load_terms(
+                ADEListEntry, vocabulary_loader.read_terms(handle)))
+        for path in medications:
+            self._load(path, 'drugs', lambda handle: vocabulary_loader.load_medications(
+                vocabulary_loader.read_medications(handle)))
+
+        self.stdout.write(self.style.SUCCESS('Vocabulary loaded!'))
+
+    def _load(self, path, label, load):
+        started = time.perf_counter()
+        try:
+            with open(path, 'rb') as handle:
+                result = load(handle)
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+        except (ValueError, UnicodeDecodeError) as e:
+            raise CommandError(f'Invalid file {path}: {e}')
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f'{path}: {result.terms} distinct {label}, {result.added} new ({elapsed:.2f} s)')
+        if result.mappings:
+            self.stdout.write(f'  {result.mappings} brand names, {result.mappings_added} new brand -> generic mappings')
+        if result.too_long:
+            self.stdout.write(self.style.WARNING(
+                f'  {result.too_long} names longer than {vocabulary_loader.MAX_NAME_LENGTH} characters skipped'
+            ))
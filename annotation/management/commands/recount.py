@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from annotation.models import ProgressCounter
+from annotation import navigation, vocabulary
+
+
+class Command(BaseCommand):
+    help = 'Recompute materialized progress counters and reset cached derived data'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            before = ProgressCounter.objects.select_for_update().filter(pk=ProgressCounter.SINGLETON_ID).first()
+            after = ProgressCounter.recount()
+
+        if before is None:
+            self.stdout.write('No counters row found, created one.')
+        elif (before.total, before.validated) != (after.total, after.validated):
+            self.stdout.write(self.style.WARNING(
+                f'Repaired drift: total {before.total} -> {after.total}, '
+                f'validated {before.validated} -> {after.validated}'
+            ))
+        else:
+            self.stdout.write('Counters were already accurate.')
+
+        self.stdout.write(f'Total: {after.total}')
+        self.stdout.write(f'Validated: {after.validated}')
+        self.stdout.write(f'Unvalidated: {after.unvalidated}')
+
+        # The vocabulary and navigation caches are derived data too
+        vocabulary.invalidate()
+        navigation.invalidate()
+
+        self.stdout.write(self.style.SUCCESS('Recount completed!'))
@@ -0,0 +1,241 @@
+"""Multi-pattern entity matcher used for quick-add suggestions.
+
+An Aho-Corasick automaton over the case-folded drug/ADE vocabulary (plus the
+static ``drugs_list.txt``) finds every known entity in a text with a single
+pass, including multi-word entities such as "acetylsalicylic acid". Overlaps
+are resolved leftmost-longest so each suggestion covers a distinct span.
+"""
+from collections import deque
+
+from django.conf import settings
+
+from .vocabulary import get_vocabulary
+
+DRUG = 'drug'
+ADE = 'ade'
+
+# Vocabulary fields mapped to matcher labels
+FIELD_LABELS = {'drugs': DRUG, 'ades': ADE}
+
+DRUG_LIST_FILE = settings.BASE_DIR / 'drugs_list.txt'
+
+# Process-local matcher, synced to the shared vocabulary version
+_local = {'matcher': None}
+
+
+def fold(text):
+    """Lowercase text without changing its length so offsets stay valid"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(ch if len(ch.lower()) != 1 else ch.lower() for ch in text)
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+
+class Match:
+    """A matched entity span in the original text"""
+    __slots__ = ('start', 'end', 'text', 'labels')
+
+    def __init__(self, start, end, text, labels):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.labels = labels
+
+    def __repr__(self):
+        return f'Match({self.start}, {self.end}, {self.text!r}, {sorted(self.labels)!r})'
+
+    def as_dict(self):
+        return {'text': self.text, 'start': self.start, 'end': self.end}
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton over folded patterns with labelled outputs.
+
+    Patterns can be added and removed at any time. Removal only clears the
+    node's output; additions mark the failure links stale and they are
+    recomputed with one breadth-first pass before the next search.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._dict = [0]
+        self._depth = [0]
+        # Per node: {label: reference count}
+        self._out = [None]
+        self._stale = False
+
+    def __len__(self):
+        return sum(1 for out in self._out if out)
+
+    def add(self, pattern, label):
+        """Add one reference to ``pattern`` under ``label``"""
+        key = fold(pattern)
+        if not key.strip():
+            return
+        node = 0
+        for ch in key:
+            child = self._goto[node].get(ch)
+            if child is None:
+                child = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._dict.append(0)
+                self._depth.append(self._depth[node] + 1)
+                self._out.append(None)
+                self._goto[node][ch] = child
+                self._stale = True
+            node = child
+        out = self._out[node]
+        if out is None:
+            out = self._out[node] = {}
+            self._stale = True
+        out[label] = out.get(label, 0) + 1
+
+    def discard(self, pattern, label):
+        """Drop one reference to ``pattern`` under ``label``"""
+        node = self._find(fold(pattern))
+        if node is None or not self._out[node] or label not in self._out[node]:
+            return
+        out = self._out[node]
+        out[label] -= 1
+        if out[label] <= 0:
+            del out[label]
+
+    def _find(self, key):
+        node = 0
+        for ch in key:
+            node = self._goto[node].get(ch)
+            if node is None:
+                return None
+        return node
+
+    def _build_links(self):
+        goto, fail, dict_link, out = self._goto, self._fail, self._dict, self._out
+        queue = deque()
+        for child in goto[0].values():
+            fail[child] = 0
+            dict_link[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(ch, 0)
+                fail[child] = target if target != child else 0
+                # Nearest proper suffix that is (or was) a pattern
+                dict_link[child] = fail[child] if out[fail[child]] is not None else dict_link[fail[child]]
+                queue.append(child)
+        self._stale = False
+
+    def find_all(self, text, word_boundary=True):
+        """Yield (start, end, labels) for every pattern occurrence in ``text``"""
+        if self._stale:
+            self._build_links()
+        folded = fold(text)
+        goto, fail, dict_link, depth, out = self._goto, self._fail, self._dict, self._depth, self._out
+        length = len(folded)
+        state = 0
+        for index, ch in enumerate(folded):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            node = state
+            while node:
+                labels = out[node]
+                if labels:
+                    end = index + 1
+                    start = end - depth[node]
+                    if not word_boundary or (
+                        (start == 0 or not (_is_word_char(folded[start - 1]) and _is_word_char(folded[start])))
+                        and (end == length or not (_is_word_char(folded[end - 1]) and _is_word_char(folded[end])))
+                    ):
+                        yield start, end, labels
+                node = dict_link[node]
+
+    def search(self, text, word_boundary=True):
+        """Non-overlapping leftmost-longest matches in ``text``"""
+        candidates = sorted(
+            self.find_all(text, word_boundary=word_boundary),
+            key=lambda match: (match[0], match[0] - match[1]),
+        )
+        matches = []
+        last_end = 0
+        for start, end, labels in candidates:
+            if start < last_end:
+                continue
+            matches.append(Match(start, end, text[start:end], frozenset(labels)))
+            last_end = end
+        return matches
+
+
+class SuggestionMatcher:
+    """Automaton kept in step with the shared vocabulary"""
+
+    def __init__(self, vocabulary):
+        self.automaton = AhoCorasick()
+        for term in vocabulary.drugs.terms:
+            self.automaton.add(term, DRUG)
+        for term in vocabulary.ades.terms:
+            self.automaton.add(term, ADE)
+        for term in _load_drug_list():
+            self.automaton.add(term, DRUG)
+        self.version = vocabulary.version
+
+    def sync(self, vocabulary):
+        """Replay vocabulary changes; returns False if a full rebuild is needed"""
+        if vocabulary.version == self.version:
+            return True
+        changes = vocabulary.changes_since(self.version)
+        if changes is None:
+            return False
+        for field, added, term in changes:
+            if added:
+                self.automaton.add(term, FIELD_LABELS[field])
+            else:
+                self.automaton.discard(term, FIELD_LABELS[field])
+        self.version = vocabulary.version
+        return True
+
+    def suggest(self, text, drugs=(), adverse_events=()):
+        """Drug and ADE suggestions for ``text`` that are not yet annotated"""
+        annotated_drugs = {fold(d) for d in drugs}
+        annotated_ades = {fold(a) for a in adverse_events}
+        all_annotated = annotated_drugs | annotated_ades
+        drug_suggestions = []
+        ade_suggestions = []
+        seen = set()
+        for match in self.automaton.search(text):
+            key = fold(match.text)
+            if any(key in entity for entity in all_annotated):
+                continue
+            if DRUG in match.labels and key not in annotated_drugs and (DRUG, key) not in seen:
+                seen.add((DRUG, key))
+                drug_suggestions.append(match.as_dict())
+            if ADE in match.labels and key not in annotated_ades and (ADE, key) not in seen:
+                seen.add((ADE, key))
+                ade_suggestions.append(match.as_dict())
+        return drug_suggestions, ade_suggestions
+
+
+def _load_drug_list():
+    try:
+        with open(DRUG_LIST_FILE, encoding='utf-8') as handle:
+            return [line.strip() for line in handle if line.strip()]
+    except OSError:
+        return []
+
+
+def get_matcher():
+    """Return the process-local matcher for the current vocabulary"""
+    vocabulary = get_vocabulary()
+    matcher = _local['matcher']
+    if matcher is None or not matcher.sync(vocabulary):
+        matcher = _local['matcher'] = SuggestionMatcher(vocabulary)
+    return matcher
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_counters(apps, schema_editor):
+    TextAnnotation = apps.get_model("annotation", "TextAnnotation")
+    ProgressCounter = apps.get_model("annotation", "ProgressCounter")
+    counts = TextAnnotation.objects.aggregate(
+        total=Count("id"),
+        validated=Count("id", filter=Q(is_validated=True)),
+    )
+    ProgressCounter.objects.update_or_create(pk=1, defaults=counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotation", "0008_entitytype_alter_annotationchange_change_type_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProgressCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "total",
+                    models.IntegerField(default=0, help_text="Number of annotations"),
+                ),
+                (
+                    "validated",
+                    models.IntegerField(
+                        default=0, help_text="Number of validated annotations"
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
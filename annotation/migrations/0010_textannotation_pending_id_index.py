@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotation", "0009_progresscounter"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="textannotation",
+            index=models.Index(
+                condition=models.Q(("is_validated", False)),
+                fields=["id"],
+                name="annotation_pending_id_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotation", "0010_textannotation_pending_id_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AnnotationLease",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "holder",
+                    models.CharField(
+                        db_index=True,
+                        help_text="Session or user holding the lease",
+                        max_length=100,
+                    ),
+                ),
+                ("acquired_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "expires_at",
+                    models.DateTimeField(
+                        db_index=True, help_text="When the lease lapses unless renewed"
+                    ),
+                ),
+                (
+                    "annotation",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lease",
+                        to="annotation.textannotation",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,89 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotation", "0011_annotationlease"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "original_name",
+                    models.CharField(
+                        help_text="Name of the uploaded file", max_length=255
+                    ),
+                ),
+                (
+                    "spool_path",
+                    models.CharField(
+                        help_text="Spooled copy of the upload being imported",
+                        max_length=500,
+                    ),
+                ),
+                ("file_size", models.BigIntegerField(default=0)),
+                (
+                    "clear_existing",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Delete existing annotations with the first batch",
+                    ),
+                ),
+                ("batch_size", models.PositiveIntegerField(default=2000)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                            ("cancelled", "Cancelled"),
+                        ],
+                        db_index=True,
+                        default="queued",
+                        max_length=20,
+                    ),
+                ),
+                ("cancel_requested", models.BooleanField(default=False)),
+                ("bytes_committed", models.BigIntegerField(default=0)),
+                ("lines_committed", models.BigIntegerField(default=0)),
+                ("rows_parsed", models.BigIntegerField(default=0)),
+                ("rows_inserted", models.BigIntegerField(default=0)),
+                ("rows_rejected", models.BigIntegerField(default=0)),
+                (
+                    "errors",
+                    models.JSONField(
+                        default=list,
+                        help_text="First rejected lines as [line, message] pairs",
+                    ),
+                ),
+                ("message", models.TextField(blank=True, default="")),
+                (
+                    "elapsed_seconds",
+                    models.FloatField(
+                        default=0, help_text="Time spent importing, across resumes"
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotation", "0012_importjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="workers",
+            field=models.PositiveSmallIntegerField(
+                default=1,
+                help_text="Processes decoding JSON; 1 parses in the job's thread",
+            ),
+        ),
+    ]
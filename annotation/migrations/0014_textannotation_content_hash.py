@@ -0,0 +1,65 @@
+import hashlib
+import unicodedata
+
+from django.db import migrations, models
+
+
+def _content_hash(text):
+    normalized = " ".join(unicodedata.normalize("NFC", text or "").split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def fill_content_hashes(apps, schema_editor):
+    TextAnnotation = apps.get_model("annotation", "TextAnnotation")
+    last_id = 0
+    while True:
+        batch = list(
+            TextAnnotation.objects.filter(id__gt=last_id).order_by("id").only("id", "text")[:2000]
+        )
+        if not batch:
+            return
+        for annotation in batch:
+            annotation.content_hash = _content_hash(annotation.text)
+        TextAnnotation.objects.bulk_update(batch, ["content_hash"])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotation", "0013_importjob_workers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="textannotation",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                default="",
+                editable=False,
+                help_text="Hash of the normalised text, used to match re-imported rows",
+                max_length=64,
+            ),
+        ),
+        migrations.RunPython(fill_content_hashes, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name="importjob",
+            name="upsert",
+            field=models.BooleanField(
+                default=False,
+                help_text="Update annotations with the same text instead of adding duplicates",
+            ),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="rows_updated",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="rows_unchanged",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
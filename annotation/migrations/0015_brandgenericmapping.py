@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotation", "0014_textannotation_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BrandGenericMapping",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("brand", models.CharField(max_length=255)),
+                (
+                    "brand_key",
+                    models.CharField(
+                        help_text="Case-folded brand name used for lookups",
+                        max_length=255,
+                    ),
+                ),
+                ("generic", models.CharField(max_length=255)),
+            ],
+            options={
+                "ordering": ["brand_key", "generic"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("brand_key", "generic"),
+                        name="annotation_brand_generic_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotation", "0015_brandgenericmapping"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="textannotation",
+            index=models.Index(fields=["updated_at"], name="annotation_updated_at_idx"),
+        ),
+        migrations.CreateModel(
+            name="DeletedAnnotation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "annotation_id",
+                    models.BigIntegerField(help_text="Id of the deleted TextAnnotation"),
+                ),
+                (
+                    "deleted_at",
+                    models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+                ),
+            ],
+            options={
+                "ordering": ["deleted_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,103 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotation", "0017_dataversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PublishJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("dataset_name", models.CharField(max_length=255)),
+                ("dataset_description", models.TextField(blank=True, default="")),
+                ("is_private", models.BooleanField(default=False)),
+                ("filter_type", models.CharField(default="all", max_length=20)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="queued",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "step",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("whoami", "Validating token"),
+                            ("create_repo", "Creating repository"),
+                            ("upload", "Uploading dataset"),
+                        ],
+                        default="",
+                        help_text="Step being run, or the step that failed",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "attempt",
+                    models.PositiveSmallIntegerField(
+                        default=0, help_text="Attempt of the current step"
+                    ),
+                ),
+                (
+                    "retries",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Failed attempts that were retried, across all steps",
+                    ),
+                ),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="When a step waiting after a failure runs again",
+                        null=True,
+                    ),
+                ),
+                (
+                    "step_timings",
+                    models.JSONField(
+                        default=dict,
+                        help_text="Seconds spent in each finished step, retries included",
+                    ),
+                ),
+                ("bytes_sent", models.BigIntegerField(default=0)),
+                (
+                    "bytes_total",
+                    models.BigIntegerField(
+                        default=0,
+                        help_text="Size of the upload body (0 when sent chunked)",
+                    ),
+                ),
+                ("username", models.CharField(blank=True, default="", max_length=255)),
+                ("dataset_url", models.CharField(blank=True, default="", max_length=500)),
+                ("message", models.TextField(blank=True, default="")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
@@ -1,5 +1,23 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Q
+from django.utils import timezone
+import hashlib
 import json
+import time
+import unicodedata
+
+
+# Entity list fields mapped to their (added, removed) change types
+ENTITY_FIELDS = {
+    'drugs': ('drug_added', 'drug_removed'),
+    'adverse_events': ('event_added', 'event_removed'),
+}
+
+
+def text_content_hash(text):
+    """SHA-256 of the text after Unicode (NFC) and whitespace normalisation"""
+    normalized = ' '.join(unicodedata.normalize('NFC', text or '').split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
 
 
 class TextAnnotation(models.Model):
@@ -10,13 +28,29 @@ class TextAnnotation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_validated = models.BooleanField(default=False, help_text="Whether this annotation has been validated")
+    content_hash = models.CharField(max_length=64, db_index=True, blank=True, default='', editable=False, help_text="Hash of the normalised text, used to match re-imported rows")
     
     class Meta:
         ordering = ['id']
+        indexes = [
+            # Keyset pagination over pending annotations (see annotation_prefetch)
+            models.Index(fields=['id'], condition=Q(is_validated=False), name='annotation_pending_id_idx'),
+            # Delta exports of rows changed since a watermark (export_jsonl?since=)
+            models.Index(fields=['updated_at'], name='annotation_updated_at_idx'),
+        ]
     
     def __str__(self):
         return f"Text {self.id}: {self.text[:50]}..."
     
+    def save(self, *args, **kwargs):
+        self.content_hash = text_content_hash(self.text)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'text' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'content_hash'}
+        # Keep the row and its derived counters (see annotation.signals) in one transaction
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+    
     def get_drugs_as_string(self):
         """Return drugs as comma-separated string for easier editing"""
         return ", ".join(self.drugs) if self.drugs else ""
@@ -39,24 +73,61 @@ class TextAnnotation(models.Model):
         else:
             self.adverse_events = []
     
+    def apply_entity_operations(self, operations, changes):
+        """Apply add/remove entity operations in order, logging the effective ones to a change set.
+        
+        Adding an entity that is already present or removing one that is not
+        is a no-op, so replaying the same operations leaves the annotation
+        unchanged. Returns the operations that changed something.
+        """
+        old_values = {field: list(getattr(self, field)) for field in ENTITY_FIELDS}
+        applied = []
+        for operation in operations:
+            values = getattr(self, operation['field'])
+            entity = operation['entity']
+            if operation['op'] == 'add':
+                if entity in values:
+                    continue
+                values.append(entity)
+            else:
+                if entity not in values:
+                    continue
+                values.remove(entity)
+            applied.append(operation)
+        
+        for operation in applied:
+            field = operation['field']
+            added_type, removed_type = ENTITY_FIELDS[field]
+            changes.add(
+                added_type if operation['op'] == 'add' else removed_type,
+                field,
+                operation['entity'],
+                old_values[field],
+                list(getattr(self, field)),
+            )
+        return applied
+    
     def get_change_summary(self):
         """Get a summary of changes made to this annotation"""
-        changes = self.changes.all()
-        summary = {
-            'total_changes': changes.count(),
-            'drug_additions': changes.filter(change_type='drug_added').count(),
-            'drug_removals': changes.filter(change_type='drug_removed').count(),
-            'event_additions': changes.filter(change_type='event_added').count(),
-            'event_removals': changes.filter(change_type='event_removed').count(),
-            'last_modified': changes.order_by('-timestamp').first().timestamp if changes.exists() else None,
-        }
-        return summary
+        return self.changes.aggregate(**change_summary_aggregates())
     
     def get_recent_changes(self, limit=10):
         """Get recent changes for this annotation"""
         return self.changes.all().order_by('-timestamp')[:limit]
 
 
+def change_summary_aggregates():
+    """Conditional aggregates over AnnotationChange rows giving a change summary in one query"""
+    return {
+        'total_changes': Count('id'),
+        'drug_additions': Count('id', filter=Q(change_type='drug_added')),
+        'drug_removals': Count('id', filter=Q(change_type='drug_removed')),
+        'event_additions': Count('id', filter=Q(change_type='event_added')),
+        'event_removals': Count('id', filter=Q(change_type='event_removed')),
+        'last_modified': Max('timestamp'),
+    }
+
+
 class AnnotationChange(models.Model):
     """Model to track changes made to annotations"""
     CHANGE_TYPES = [
@@ -108,6 +179,11 @@ class AnnotationChange(models.Model):
             session_id=session_id
         )
     
+    @classmethod
+    def change_set(cls, annotation, session_id=None):
+        """Start collecting the changes of one save, see AnnotationChangeSet"""
+        return AnnotationChangeSet(annotation, session_id)
+    
     @classmethod
     def log_bulk_update(cls, annotation, field_name, old_value, new_value, session_id=None):
         """Log a bulk update change"""
@@ -122,6 +198,89 @@ class AnnotationChange(models.Model):
         )
 
 
+class AnnotationLease(models.Model):
+    """Time-limited claim of an annotation by one annotator (see annotation.work_queue)"""
+    annotation = models.OneToOneField(TextAnnotation, on_delete=models.CASCADE, related_name='lease')
+    holder = models.CharField(max_length=100, db_index=True, help_text="Session or user holding the lease")
+    acquired_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True, help_text="When the lease lapses unless renewed")
+    
+    def __str__(self):
+        return f"Text {self.annotation_id} leased to {self.holder} until {self.expires_at}"
+
+
+class DeletedAnnotation(models.Model):
+    """Tombstone of a deleted annotation so delta exports can report the deletion"""
+    annotation_id = models.BigIntegerField(help_text="Id of the deleted TextAnnotation")
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ['deleted_at']
+    
+    def __str__(self):
+        return f"Text {self.annotation_id} deleted at {self.deleted_at}"
+    
+    @classmethod
+    def record(cls, annotation_ids, batch_size=2000):
+        """Store tombstones for deleted annotation ids"""
+        if annotation_ids:
+            now = timezone.now()
+            cls.objects.bulk_create(
+                [cls(annotation_id=annotation_id, deleted_at=now) for annotation_id in annotation_ids],
+                batch_size=batch_size,
+            )
+
+
+class AnnotationChangeSet:
+    """Collects AnnotationChange rows for one save and writes them with a single INSERT"""
+    
+    def __init__(self, annotation, session_id=None):
+        self.annotation = annotation
+        self.session_id = session_id
+        self.changes = []
+    
+    def __len__(self):
+        return len(self.changes)
+    
+    def add(self, change_type, field_name, entity_name, old_value, new_value):
+        self.changes.append(AnnotationChange(
+            annotation=self.annotation,
+            change_type=change_type,
+            field_name=field_name,
+            old_value=old_value,
+            new_value=new_value,
+            entity_name=entity_name,
+            session_id=self.session_id,
+        ))
+    
+    def _diff(self, field_name, added_type, removed_type, old_values, new_values):
+        if old_values == new_values:
+            return
+        old_set = set(old_values)
+        new_set = set(new_values)
+        for entity in new_values:
+            if entity not in old_set:
+                self.add(added_type, field_name, entity, old_values, new_values)
+        for entity in old_values:
+            if entity not in new_set:
+                self.add(removed_type, field_name, entity, old_values, new_values)
+    
+    def diff_drugs(self, old_drugs, new_drugs):
+        """Record drug additions/removals between two lists"""
+        self._diff('drugs', 'drug_added', 'drug_removed', old_drugs, new_drugs)
+    
+    def diff_events(self, old_events, new_events):
+        """Record adverse event additions/removals between two lists"""
+        self._diff('adverse_events', 'event_added', 'event_removed', old_events, new_events)
+    
+    def save(self):
+        """Write all collected changes with one bulk_create"""
+        if not self.changes:
+            return []
+        DataVersion.bump()
+        return AnnotationChange.objects.bulk_create(self.changes)
+
+
 class DrugListEntry(models.Model):
     name = models.CharField(max_length=255, unique=True)
     def __str__(self):
@@ -130,4 +289,248 @@ class DrugListEntry(models.Model):
 class ADEListEntry(models.Model):
     name = models.CharField(max_length=255, unique=True)
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class BrandGenericMapping(models.Model):
+    """Brand name of a drug mapped to its generic name (see annotation.vocabulary_loader)"""
+    brand = models.CharField(max_length=255)
+    # Leading column of the unique index below, so lookups by brand are index seeks
+    brand_key = models.CharField(max_length=255, help_text="Case-folded brand name used for lookups")
+    generic = models.CharField(max_length=255)
+    
+    class Meta:
+        ordering = ['brand_key', 'generic']
+        constraints = [
+            models.UniqueConstraint(fields=['brand_key', 'generic'], name='annotation_brand_generic_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.brand} -> {self.generic}"
+    
+    def save(self, *args, **kwargs):
+        self.brand_key = self.key_for(self.brand)
+        super().save(*args, **kwargs)
+    
+    @staticmethod
+    def key_for(brand):
+        return brand.strip().casefold()
+    
+    @classmethod
+    def generics_for(cls, brand):
+        """Generic names for a brand, matched case-insensitively through the brand_key index"""
+        return list(cls.objects.filter(brand_key=cls.key_for(brand)).values_list('generic', flat=True))
+
+
+class ProgressCounter(models.Model):
+    """Materialized annotation progress counters, stored as a single row"""
+    SINGLETON_ID = 1
+    
+    total = models.IntegerField(default=0, help_text="Number of annotations")
+    validated = models.IntegerField(default=0, help_text="Number of validated annotations")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.validated}/{self.total} validated"
+    
+    @property
+    def unvalidated(self):
+        return self.total - self.validated
+    
+    @classmethod
+    def get(cls):
+        """Return the counters row, computing it if it does not exist yet"""
+        counter = cls.objects.filter(pk=cls.SINGLETON_ID).first()
+        return counter if counter is not None else cls.recount()
+    
+    @classmethod
+    def adjust(cls, total=0, validated=0):
+        """Apply deltas to the counters in the caller's transaction"""
+        if not total and not validated:
+            return
+        updated = cls.objects.filter(pk=cls.SINGLETON_ID).update(
+            total=F('total') + total,
+            validated=F('validated') + validated,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            cls.recount()
+    
+    @classmethod
+    def recount(cls):
+        """Recompute the counters from the annotations table"""
+        counts = TextAnnotation.objects.aggregate(
+            total=Count('id'),
+            validated=Count('id', filter=Q(is_validated=True)),
+        )
+        counter, _ = cls.objects.update_or_create(pk=cls.SINGLETON_ID, defaults=counts)
+        return counter
+
+
+class DataVersion(models.Model):
+    """Counter bumped by every write to annotations or their changes, stored as a single row.
+
+    Exports are cached per version and send it as their ETag (see
+    annotation.export_cache), so an unchanged dataset is never serialised twice.
+    """
+    SINGLETON_ID = 1
+    
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now, help_text="When the data last changed")
+    
+    def __str__(self):
+        return f"Data version {self.version} ({self.updated_at})"
+    
+    @classmethod
+    def current(cls):
+        """Return the version row, creating it if it does not exist yet"""
+        row = cls.objects.filter(pk=cls.SINGLETON_ID).first()
+        if row is None:
+            row, _ = cls.objects.get_or_create(pk=cls.SINGLETON_ID)
+        return row
+    
+    @classmethod
+    def bump(cls):
+        """Advance the version in the caller's transaction"""
+        updated = cls.objects.filter(pk=cls.SINGLETON_ID).update(
+            version=F('version') + 1,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            cls.objects.get_or_create(pk=cls.SINGLETON_ID, defaults={'version': 1})
+
+
+class CacheVersion(models.Model):
+    """Version counter of a cached structure shared by worker processes, one row per name.
+
+    Writers lock the row (``lock``) for as long as they update the cached
+    copy, so updates are serialised by the database whatever cache backend
+    is configured (see annotation.vocabulary and annotation.navigation).
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name} version {self.version}"
+    
+    @classmethod
+    def lock(cls, name):
+        """Lock and return the row for ``name`` until the caller's transaction ends"""
+        row = cls.objects.select_for_update().filter(name=name).first()
+        if row is None:
+            # Seed from the clock so versions never repeat after the row is lost
+            cls.objects.get_or_create(name=name, defaults={'version': int(time.time() * 1000)})
+            row = cls.objects.select_for_update().get(name=name)
+        return row
+    
+    def advance(self):
+        """Take the next version; call with the row locked"""
+        self.version += 1
+        self.save(update_fields=['version'])
+        return self.version
+
+
+class ImportJob(models.Model):
+    """Background JSONL import with its progress (see annotation.import_jobs)"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+    
+    original_name = models.CharField(max_length=255, help_text="Name of the uploaded file")
+    spool_path = models.CharField(max_length=500, help_text="Spooled copy of the upload being imported")
+    file_size = models.BigIntegerField(default=0)
+    clear_existing = models.BooleanField(default=False, help_text="Delete existing annotations with the first batch")
+    upsert = models.BooleanField(default=False, help_text="Update annotations with the same text instead of adding duplicates")
+    batch_size = models.PositiveIntegerField(default=2000)
+    workers = models.PositiveSmallIntegerField(default=1, help_text="Processes decoding JSON; 1 parses in the job's thread")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    cancel_requested = models.BooleanField(default=False)
+    # Progress as of the last committed batch; a resumed job continues from here
+    bytes_committed = models.BigIntegerField(default=0)
+    lines_committed = models.BigIntegerField(default=0)
+    rows_parsed = models.BigIntegerField(default=0)
+    rows_inserted = models.BigIntegerField(default=0)
+    rows_updated = models.BigIntegerField(default=0)
+    rows_unchanged = models.BigIntegerField(default=0)
+    rows_rejected = models.BigIntegerField(default=0)
+    errors = models.JSONField(default=list, help_text="First rejected lines as [line, message] pairs")
+    message = models.TextField(blank=True, default='')
+    elapsed_seconds = models.FloatField(default=0, help_text="Time spent importing, across resumes")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Import {self.id} ({self.original_name}): {self.get_status_display()}"
+    
+    @property
+    def rows_per_second(self):
+        written = self.rows_inserted + self.rows_updated + self.rows_unchanged
+        return written / self.elapsed_seconds if self.elapsed_seconds else 0.0
+    
+    @property
+    def progress_percentage(self):
+        if self.status == 'completed':
+            return 100
+        return int(self.bytes_committed * 100 / self.file_size) if self.file_size else 0
+
+
+class PublishJob(models.Model):
+    """Background Hugging Face publish with its progress (see annotation.publish_jobs)"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    STEP_CHOICES = [
+        ('whoami', 'Validating token'),
+        ('create_repo', 'Creating repository'),
+        ('upload', 'Uploading dataset'),
+    ]
+    
+    dataset_name = models.CharField(max_length=255)
+    dataset_description = models.TextField(blank=True, default='')
+    is_private = models.BooleanField(default=False)
+    filter_type = models.CharField(max_length=20, default='all')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    step = models.CharField(max_length=20, choices=STEP_CHOICES, blank=True, default='', help_text="Step being run, or the step that failed")
+    attempt = models.PositiveSmallIntegerField(default=0, help_text="Attempt of the current step")
+    retries = models.PositiveIntegerField(default=0, help_text="Failed attempts that were retried, across all steps")
+    next_attempt_at = models.DateTimeField(null=True, blank=True, help_text="When a step waiting after a failure runs again")
+    step_timings = models.JSONField(default=dict, help_text="Seconds spent in each finished step, retries included")
+    bytes_sent = models.BigIntegerField(default=0)
+    bytes_total = models.BigIntegerField(default=0, help_text="Size of the upload body (0 when sent chunked)")
+    username = models.CharField(max_length=255, blank=True, default='')
+    dataset_url = models.CharField(max_length=500, blank=True, default='')
+    message = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Publish {self.id} ({self.dataset_name}): {self.get_status_display()}"
+    
+    @property
+    def elapsed_seconds(self):
+        if not self.started_at:
+            return 0.0
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+    
+    @property
+    def progress_percentage(self):
+        if self.status == 'completed':
+            return 100
+        return int(self.bytes_sent * 100 / self.bytes_total) if self.bytes_total else 0
@@ -0,0 +1,159 @@
+"""Ordered index of annotation ids for constant-time navigation.
+
+Each process keeps the sorted ids in a compact array and answers
+previous/next/position/total with binary search. A version counter in
+Django's cache tells processes when another worker inserted or deleted
+annotations so they reload the ids (inserts and deletes are rare compared
+to page views and saves, which don't touch the index).
+
+Writers take the next version from the navigation ``CacheVersion`` row while
+holding its lock, as annotation.vocabulary does, so two processes never
+claim the same version on cache backends whose ``incr`` is not atomic (such
+as the shipped file-based cache).
+"""
+import json
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'annotation:navigation:version'
+# CacheVersion row locked by writers
+LOCK_NAME = 'navigation'
+
+_lock = threading.Lock()
+_local = {'version': None, 'index': None}
+
+
+class IdIndex:
+    """Sorted annotation ids with binary-search lookups"""
+
+    def __init__(self, ids=()):
+        self.ids = array('q', ids)
+        self._ranges_json = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def total(self):
+        return len(self.ids)
+
+    def position(self, annotation_id):
+        """1-based position of an annotation, or None if it is not indexed"""
+        index = bisect_left(self.ids, annotation_id)
+        if index < len(self.ids) and self.ids[index] == annotation_id:
+            return index + 1
+        return None
+
+    def previous(self, annotation_id):
+        index = bisect_left(self.ids, annotation_id)
+        return self.ids[index - 1] if index > 0 else None
+
+    def next(self, annotation_id):
+        index = bisect_right(self.ids, annotation_id)
+        return self.ids[index] if index < len(self.ids) else None
+
+    def id_at(self, position):
+        """Annotation id at a 1-based position"""
+        if 1 <= position <= len(self.ids):
+            return self.ids[position - 1]
+        return None
+
+    def insert(self, annotation_id):
+        index = bisect_left(self.ids, annotation_id)
+        if index == len(self.ids) or self.ids[index] != annotation_id:
+            self.ids.insert(index, annotation_id)
+            self._ranges_json = None
+
+    def remove(self, annotation_id):
+        index = bisect_left(self.ids, annotation_id)
+        if index < len(self.ids) and self.ids[index] == annotation_id:
+            del self.ids[index]
+            self._ranges_json = None
+
+    def ranges(self):
+        """Run-length encode the ids as [[first, last], ...] contiguous ranges"""
+        ranges = []
+        for annotation_id in self.ids:
+            if ranges and ranges[-1][1] == annotation_id - 1:
+                ranges[-1][1] = annotation_id
+            else:
+                ranges.append([annotation_id, annotation_id])
+        return ranges
+
+    def ranges_json(self):
+        """JSON-encoded ranges, memoised until the ids change"""
+        if self._ranges_json is None:
+            self._ranges_json = json.dumps(self.ranges())
+        return self._ranges_json
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        from .models import CacheVersion
+
+        # Publish the locked row's version so the next writer's is one above it
+        with transaction.atomic():
+            version = CacheVersion.lock(LOCK_NAME).version
+            cache.set(VERSION_KEY, version, None)
+    return version
+
+
+def get_index():
+    """Return the id index for the current navigation version"""
+    from .models import TextAnnotation
+
+    version = _current_version()
+    with _lock:
+        if _local['index'] is not None and _local['version'] == version:
+            return _local['index']
+        # Read the version before the ids so a concurrent change triggers a reload
+        ids = TextAnnotation.objects.order_by('id').values_list('id', flat=True)
+        index = IdIndex(ids.iterator(chunk_size=10000))
+        _local['version'] = version
+        _local['index'] = index
+        return index
+
+
+def _advance():
+    """Publish the next navigation version; call inside a transaction"""
+    from .models import CacheVersion
+
+    version = CacheVersion.lock(LOCK_NAME).advance()
+    cache.set(VERSION_KEY, version, None)
+    return version
+
+
+def _apply(change, annotation_id):
+    with transaction.atomic():
+        version = _advance()
+    with _lock:
+        index = _local['index']
+        if index is not None and _local['version'] == version - 1:
+            # No other writer got in between, follow along without reloading
+            getattr(index, change)(annotation_id)
+            _local['version'] = version
+        else:
+            _local['version'] = None
+
+
+def record_insert(annotation_id):
+    _apply('insert', annotation_id)
+
+
+def record_delete(annotation_id):
+    _apply('remove', annotation_id)
+
+
+def invalidate():
+    """Make every process reload the ids, e.g. after bulk_create or bulk deletes"""
+    with transaction.atomic():
+        _advance()
+    with _lock:
+        _local['version'] = None
+        _local['index'] = None
@@ -0,0 +1,102 @@
+"""Character offsets of an annotation's entities in its text.
+
+The text is case-folded once (keeping its length, see ``matcher.fold``) and
+each distinct drug/ADE name is located in it with ``str.find``. Matches can
+be restricted to word boundaries, so "aspirin" is not found inside
+"aspirinemia", and overlapping matches are resolved leftmost-longest, so
+"acid" is not reported again inside "acetylsalicylic acid". Results for
+the most recently exported rows are cached per (annotation id, updated_at),
+so delta exports re-sending recent rows skip the matching. A full export
+streams every row through the cache, so it is kept small: it bounds memory
+per process rather than holding the dataset.
+
+An annotation has a handful of entities, so one C-level ``find`` scan per
+name is faster than walking the text character by character through the
+suggestion automaton in ``annotation.matcher``.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .matcher import _is_word_char, fold
+
+DRUG = 'DRUG'
+ADVERSE_EVENT = 'ADVERSE_EVENT'
+
+# Annotations whose offsets are kept per process (0 disables the cache)
+CACHE_SIZE = getattr(settings, 'ANNOTATION_OFFSET_CACHE_SIZE', 1000)
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+def _splits_word(folded, index):
+    """True if ``index`` falls between two word characters"""
+    return 0 < index < len(folded) and _is_word_char(folded[index - 1]) and _is_word_char(folded[index])
+
+
+def find_offsets(text, drugs, adverse_events, word_boundary=True):
+    """(start, end, label, name) for every entity occurrence in ``text``, left to right.
+
+    Names that differ only in case are matched once, under the first
+    spelling. A span listed both as a drug and as an adverse event is
+    reported once per label.
+    """
+    # Folded name -> [(label, name)], drugs first
+    entities = {}
+    for label, names in ((DRUG, drugs), (ADVERSE_EVENT, adverse_events)):
+        for name in names:
+            key = fold(name)
+            if not key.strip():
+                continue
+            labels = entities.setdefault(key, [])
+            if all(existing != label for existing, _ in labels):
+                labels.append((label, name))
+
+    folded = fold(text)
+    candidates = []
+    for key, labels in entities.items():
+        start = folded.find(key)
+        while start != -1:
+            end = start + len(key)
+            if not word_boundary or not (_splits_word(folded, start) or _splits_word(folded, end)):
+                candidates.append((start, end, labels))
+            start = folded.find(key, start + 1)
+
+    candidates.sort(key=lambda candidate: (candidate[0], -candidate[1]))
+    offsets = []
+    last_end = 0
+    for start, end, labels in candidates:
+        if start < last_end:
+            continue
+        for label, name in labels:
+            offsets.append((start, end, label, name))
+        last_end = end
+    return offsets
+
+
+def entity_offsets(annotation_id, updated_at, text, drugs, adverse_events, word_boundary=True):
+    """find_offsets for a stored annotation, cached per (annotation id, updated_at)"""
+    key = (annotation_id, updated_at, word_boundary)
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+    # Writes that bypass save() keep updated_at, so the entity lists are compared too
+    if cached is not None and cached[0] == drugs and cached[1] == adverse_events:
+        return cached[2]
+
+    offsets = tuple(find_offsets(text, drugs, adverse_events, word_boundary=word_boundary))
+    if CACHE_SIZE:
+        with _lock:
+            _cache[key] = (list(drugs), list(adverse_events), offsets)
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return offsets
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,201 @@
+"""Parallel export of large datasets by id range.
+
+The annotations selected by an export filter are split into ranges of
+consecutive ids, and each range is serialised on a pool of worker processes
+(``json.dumps``, entity offsets and timestamps are CPU-bound and would
+otherwise run on one core). Workers set Django up themselves and open their
+own database connection. Results are either streamed back in id order, with
+at most two ranges per worker in flight so memory stays bounded, or written
+as numbered shard files (``part-00000.jsonl``, ...) with a manifest.
+
+An export flavour plugs in with a branch in ``_lines`` turning value rows
+into output lines, the fields it reads (``_fields``) and the extension of
+its shards (``EXTENSIONS``).
+
+Only the standard library and Django's settings are imported at module level
+so spawned workers can unpickle the task functions before Django is set up.
+"""
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+
+# Rows per id range (and per shard file)
+RANGE_SIZE = getattr(settings, 'ANNOTATION_EXPORT_RANGE_SIZE', 50000)
+WORKERS = getattr(settings, 'ANNOTATION_EXPORT_WORKERS', None) or os.cpu_count() or 1
+
+FLAVOURS = ('jsonl', 'entities', 'conll', 'bio-jsonl')
+EXTENSIONS = {'jsonl': 'jsonl', 'entities': 'jsonl', 'conll': 'conll', 'bio-jsonl': 'jsonl'}
+MANIFEST_NAME = 'manifest.json'
+
+
+class ExportResult:
+    """Counts and timing of one partitioned export"""
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.ranges = 0
+        self.shards = []
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def _setup_worker():
+    # Spawned workers start without Django; each then opens its own connection on first query
+    django.setup()
+
+
+def _lines(flavour, rows, options):
+    """Output lines of ``flavour`` for an iterable of value rows"""
+    from . import bio, exporter
+
+    if flavour == 'jsonl':
+        return exporter.iter_jsonl(rows, exporter.annotation_record, include_changes=options['include_changes'])
+    if flavour == 'entities':
+        return exporter.iter_jsonl(
+            rows, exporter.entities_record,
+            include_changes=options['include_changes'], word_boundary=options['word_boundary'],
+        )
+    return bio.iter_bio(
+        rows, 'jsonl' if flavour == 'bio-jsonl' else 'conll', word_boundary=options['word_boundary'],
+    )
+
+
+def _fields(flavour):
+    from . import bio, exporter
+
+    return bio.BIO_FIELDS if flavour in ('conll', 'bio-jsonl') else exporter.EXPORT_FIELDS
+
+
+def export_range(flavour, filter_type, options, start_id, end_id, path=None):
+    """Serialise the annotations with ``start_id <= id < end_id`` (no upper bound if None).
+
+    Returns (rows, data) with the output bytes, or (rows, size) after writing
+    them to ``path`` when one is given.
+    """
+    from . import exporter
+
+    queryset = exporter.filtered_annotations(filter_type).filter(id__gte=start_id)
+    if end_id is not None:
+        queryset = queryset.filter(id__lt=end_id)
+    counter = [0]
+
+    def rows():
+        for row in exporter.iter_rows(queryset, _fields(flavour), include_changes=options.get('include_changes', False)):
+            counter[0] += 1
+            yield row
+
+    chunks = exporter.buffered(_lines(flavour, rows(), options))
+    if options.get('compress'):
+        chunks = exporter.gzip_stream(chunks)
+    if path is None:
+        data = b''.join(chunks)
+        return counter[0], data
+    size = 0
+    with open(path, 'wb') as handle:
+        for chunk in chunks:
+            handle.write(chunk)
+            size += len(chunk)
+    return counter[0], size
+
+
+def partition(filter_type, range_size=RANGE_SIZE):
+    """(start_id, end_id) ranges of ``range_size`` selected annotations, in id order"""
+    from . import exporter
+
+    ids = exporter.filtered_annotations(filter_type).order_by('id').values_list('id', flat=True)
+    starts = [
+        annotation_id
+        for index, annotation_id in enumerate(ids.iterator(chunk_size=10000))
+        if index % range_size == 0
+    ]
+    return [(start, starts[index + 1] if index + 1 < len(starts) else None) for index, start in enumerate(starts)]
+
+
+def _run(tasks, workers):
+    """Yield task results in order, running them on ``workers`` processes"""
+    if workers <= 1:
+        for args in tasks:
+            yield export_range(*args)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'), initializer=_setup_worker)
+    try:
+        pending = deque()
+        tasks = iter(tasks)
+        while True:
+            for args in tasks:
+                pending.append(pool.submit(export_range, *args))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _options(include_changes, word_boundary, compress):
+    return {'include_changes': include_changes, 'word_boundary': word_boundary, 'compress': compress}
+
+
+def iter_export(flavour='jsonl', filter_type='all', include_changes=False, word_boundary=True,
+                compress=False, workers=WORKERS, range_size=RANGE_SIZE, result=None):
+    """Yield the export as byte chunks in id order, one chunk per id range.
+
+    With ``compress`` every range is a gzip member of its own (compressed on
+    the workers); concatenated members are a valid gzip file.
+    """
+    options = _options(include_changes, word_boundary, compress)
+    ranges = partition(filter_type, range_size)
+    tasks = ((flavour, filter_type, options, start, end) for start, end in ranges)
+    for rows, data in _run(tasks, workers):
+        if result is not None:
+            result.rows += rows
+            result.bytes += len(data)
+            result.ranges += 1
+        yield data
+
+
+def write_shards(directory, flavour='jsonl', filter_type='all', include_changes=False, word_boundary=True,
+                 compress=False, workers=WORKERS, range_size=RANGE_SIZE):
+    """Write one numbered shard file per id range into ``directory``, plus a manifest"""
+    started = time.perf_counter()
+    result = ExportResult()
+    os.makedirs(directory, exist_ok=True)
+    options = _options(include_changes, word_boundary, compress)
+    extension = EXTENSIONS[flavour] + ('.gz' if compress else '')
+    ranges = partition(filter_type, range_size)
+    names = [f'part-{index:05d}.{extension}' for index in range(len(ranges))]
+    tasks = (
+        (flavour, filter_type, options, start, end, os.path.join(directory, name))
+        for (start, end), name in zip(ranges, names)
+    )
+    for (start, end), name, (rows, size) in zip(ranges, names, _run(tasks, workers)):
+        result.rows += rows
+        result.bytes += size
+        result.ranges += 1
+        result.shards.append({'file': name, 'first_id': start, 'end_id': end, 'rows': rows, 'bytes': size})
+    result.elapsed = time.perf_counter() - started
+
+    manifest = {
+        'flavour': flavour,
+        'filter': filter_type,
+        'include_changes': include_changes,
+        'word_boundary': word_boundary,
+        'compress': 'gzip' if compress else None,
+        'rows': result.rows,
+        'shards': result.shards,
+    }
+    with open(os.path.join(directory, MANIFEST_NAME), 'w', encoding='utf-8') as handle:
+        json.dump(manifest, handle, indent=2)
+    return result
@@ -0,0 +1,221 @@
+"""Background publishing to the Hugging Face Hub.
+
+Every publish request is recorded as a ``PublishJob`` row and run by a small
+thread pool through the steps of ``annotation.huggingface`` (token check,
+repository creation, upload). The job stores its current step, the time
+spent in each step, upload progress and the outcome, so ``upload_hf.html``
+can poll it and the result is kept when the browser gives up. A step that
+fails with a transient error (network, rate limiting, gateway) is retried
+with exponential backoff; the POSTs do not retry on their own as well, so
+an upload is streamed at most ``HUGGINGFACE_PUBLISH_ATTEMPTS`` times.
+
+The token is only held in memory (of the process that queued the job) until
+the job has run, never stored: a job cut off by a server restart, whether it
+was running or still queued, is marked failed and has to be published again.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import huggingface
+from .models import PublishJob
+
+MAX_WORKERS = getattr(settings, 'HUGGINGFACE_PUBLISH_WORKERS', 2)
+# Attempts per step, and seconds before the second one (doubled for each further attempt)
+ATTEMPTS = getattr(settings, 'HUGGINGFACE_PUBLISH_ATTEMPTS', 4)
+BACKOFF = getattr(settings, 'HUGGINGFACE_PUBLISH_BACKOFF', 2)
+# Seconds between upload progress updates
+PROGRESS_INTERVAL = 1.0
+# A running job that has not been updated for this long lost its worker
+# (e.g. the server restarted); longer than any timeout or backoff wait.
+# Queued jobs may wait behind long uploads, they only expire once their
+# token is gone.
+STALE_AFTER = timedelta(minutes=10)
+INTERRUPTED_MESSAGE = 'The upload was interrupted (the server may have restarted). Please publish again.'
+
+_executor = None
+_executor_lock = threading.Lock()
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='huggingface-publish')
+        return _executor
+
+
+def create_job(token, dataset_name, dataset_description='', is_private=False, filter_type='all'):
+    """Record a publish request and queue it once the caller's transaction commits"""
+    job = PublishJob.objects.create(
+        dataset_name=dataset_name,
+        dataset_description=dataset_description,
+        is_private=is_private,
+        filter_type=filter_type,
+    )
+    with _tokens_lock:
+        _tokens[job.pk] = token
+    transaction.on_commit(lambda: submit(job.pk))
+    return job
+
+
+def submit(job_id):
+    return _get_executor().submit(run_job, job_id)
+
+
+def expire_stale(job):
+    """Mark a job that can no longer finish as failed; returns True if it was.
+
+    That is a running job whose worker stopped updating it, or a queued one
+    whose token is not held here (lost with a restart), so it can never run.
+    """
+    stale = Q(status='running', updated_at__lt=timezone.now() - STALE_AFTER)
+    with _tokens_lock:
+        orphaned = job.pk not in _tokens
+    if orphaned:
+        stale |= Q(status='queued')
+    expired = PublishJob.objects.filter(stale, pk=job.pk).update(
+        status='failed', message=INTERRUPTED_MESSAGE, finished_at=timezone.now()
+    )
+    if expired:
+        job.refresh_from_db()
+    return bool(expired)
+
+
+def run_job(job_id):
+    """Publish a queued job in the current thread"""
+    close_old_connections()
+    try:
+        _run(job_id)
+    finally:
+        with _tokens_lock:
+            _tokens.pop(job_id, None)
+        connection.close()
+
+
+def _run(job_id):
+    now = timezone.now()
+    if not PublishJob.objects.filter(pk=job_id, status='queued').update(
+        status='running', started_at=now, updated_at=now
+    ):
+        # Expired, or picked up by another worker
+        return
+    job = PublishJob.objects.get(pk=job_id)
+    with _tokens_lock:
+        token = _tokens.get(job_id)
+
+    status, message, fields = 'failed', INTERRUPTED_MESSAGE, {}
+    try:
+        if token is not None:
+            fields = _publish(job, token)
+            status, message = 'completed', ''
+    except huggingface.HubError as e:
+        message = str(e)
+    except Exception as e:
+        message = f'Error uploading to Hugging Face: {str(e)}'
+    finally:
+        PublishJob.objects.filter(pk=job_id).update(
+            status=status,
+            message=message,
+            next_attempt_at=None,
+            finished_at=timezone.now(),
+            updated_at=timezone.now(),
+            **fields,
+        )
+
+
+def _publish(job, token):
+    """Run the publish steps, returning the fields to store on success"""
+    username = _step(job, 'whoami', lambda: huggingface.whoami(token, cached=True))
+    PublishJob.objects.filter(pk=job.pk).update(username=username)
+
+    annotations = huggingface.upload_annotations(job.filter_type)
+    info = huggingface.dataset_info(
+        annotations, job.dataset_name, job.dataset_description, job.filter_type, job.is_private
+    )
+    _step(job, 'create_repo', lambda: huggingface.create_repo(
+        token, job.dataset_name, info['description'], job.is_private, retries=0
+    ))
+    # Every attempt streams a fresh body, and reports its own progress
+    _step(job, 'upload', lambda: huggingface.upload_files(
+        token, username, job.dataset_name, huggingface.dataset_parts(annotations, info),
+        progress=_upload_progress(job.pk), retries=0,
+    ))
+    return {'step': '', 'dataset_url': huggingface.dataset_url(username, job.dataset_name)}
+
+
+def _step(job, name, func):
+    """Run one step, retrying transient failures with exponential backoff, and record its time"""
+    started = time.perf_counter()
+    PublishJob.objects.filter(pk=job.pk).update(
+        step=name, attempt=1, message='', next_attempt_at=None, updated_at=timezone.now()
+    )
+    try:
+        for attempt in range(1, ATTEMPTS + 1):
+            try:
+                return func()
+            except huggingface.HubError as e:
+                if not e.retryable or attempt == ATTEMPTS:
+                    raise
+                delay = BACKOFF * 2 ** (attempt - 1)
+                PublishJob.objects.filter(pk=job.pk).update(
+                    attempt=attempt + 1,
+                    retries=F('retries') + 1,
+                    message=f'{e} (retrying in {delay:g} s)',
+                    next_attempt_at=timezone.now() + timedelta(seconds=delay),
+                    updated_at=timezone.now(),
+                )
+                time.sleep(delay)
+    finally:
+        job.step_timings[name] = round(time.perf_counter() - started, 3)
+        PublishJob.objects.filter(pk=job.pk).update(step_timings=job.step_timings, updated_at=timezone.now())
+
+
+def _upload_progress(job_id):
+    """Progress callback storing the bytes sent at most every PROGRESS_INTERVAL seconds"""
+    last_update = [0.0]
+
+    def progress(sent, total):
+        now = time.monotonic()
+        if now - last_update[0] >= PROGRESS_INTERVAL or sent == total:
+            last_update[0] = now
+            PublishJob.objects.filter(pk=job_id).update(
+                bytes_sent=sent, bytes_total=total or 0, updated_at=timezone.now()
+            )
+
+    return progress
+
+
+def job_payload(job):
+    """JSON-serializable progress of a publish job"""
+    return {
+        'id': job.id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'step': job.step,
+        'step_display': job.get_step_display(),
+        'attempt': job.attempt,
+        'retries': job.retries,
+        'next_attempt_at': job.next_attempt_at.isoformat() if job.next_attempt_at else None,
+        'step_timings': job.step_timings,
+        'bytes_sent': job.bytes_sent,
+        'bytes_total': job.bytes_total,
+        'progress_percentage': job.progress_percentage,
+        'elapsed_seconds': round(job.elapsed_seconds, 1),
+        'dataset_name': job.dataset_name,
+        'is_private': job.is_private,
+        'username': job.username,
+        'dataset_url': job.dataset_url,
+        'message': job.message,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
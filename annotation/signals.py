@@ -0,0 +1,169 @@
+"""Signal handlers keeping derived data in sync with annotation writes"""
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import navigation, vocabulary
+from .models import TextAnnotation, DataVersion, DeletedAnnotation, DrugListEntry, ADEListEntry, ProgressCounter
+
+_state = threading.local()
+
+
+@contextmanager
+def bulk_changes():
+    """Skip per-row bookkeeping during a bulk write and resync once at the end.
+
+    Use inside the same ``transaction.atomic`` block as the bulk write so the
+    counters are recomputed in that transaction.
+    """
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    if _state.depth == 1:
+        _state.deleted_ids = []
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+    if not _state.depth:
+        DeletedAnnotation.record(_state.deleted_ids)
+        _state.deleted_ids = []
+        DataVersion.bump()
+        ProgressCounter.recount()
+        transaction.on_commit(vocabulary.invalidate)
+        transaction.on_commit(navigation.invalidate)
+
+
+def in_bulk_changes():
+    return getattr(_state, 'depth', 0) > 0
+
+
+@receiver(pre_save, sender=TextAnnotation)
+def remember_stored_annotation(sender, instance, raw=False, **kwargs):
+    """Stash the stored row so post_save handlers can compute deltas"""
+    if raw or in_bulk_changes():
+        return
+    stored = None
+    if instance.pk is not None:
+        stored = sender.objects.filter(pk=instance.pk).values_list(
+            'drugs', 'adverse_events', 'is_validated'
+        ).first()
+    instance._stored_state = stored or ([], [], None)
+
+
+@receiver(post_save, sender=TextAnnotation)
+def update_counters_on_annotation_save(sender, instance, created, raw=False, **kwargs):
+    if raw or in_bulk_changes():
+        return
+    old_validated = getattr(instance, '_stored_state', ([], [], None))[2]
+    if created or old_validated is None:
+        ProgressCounter.adjust(total=1, validated=1 if instance.is_validated else 0)
+    elif old_validated != instance.is_validated:
+        ProgressCounter.adjust(validated=1 if instance.is_validated else -1)
+
+
+@receiver(post_save, sender=TextAnnotation)
+def update_vocabulary_on_annotation_save(sender, instance, raw=False, **kwargs):
+    if raw or in_bulk_changes():
+        return
+    old_drugs, old_events, _ = getattr(instance, '_stored_state', ([], [], None))
+    old_drugs = vocabulary._terms(old_drugs)
+    old_events = vocabulary._terms(old_events)
+    new_drugs = vocabulary._terms(instance.drugs)
+    new_events = vocabulary._terms(instance.adverse_events)
+    delta = {
+        'drugs_added': new_drugs - old_drugs,
+        'drugs_removed': old_drugs - new_drugs,
+        'ades_added': new_events - old_events,
+        'ades_removed': old_events - new_events,
+    }
+    transaction.on_commit(lambda: vocabulary.apply_delta(**delta))
+
+
+@receiver(post_save, sender=TextAnnotation)
+def update_navigation_on_annotation_create(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and not in_bulk_changes():
+        annotation_id = instance.pk
+        transaction.on_commit(lambda: navigation.record_insert(annotation_id))
+
+
+@receiver(post_delete, sender=TextAnnotation)
+def update_counters_on_annotation_delete(sender, instance, **kwargs):
+    if not in_bulk_changes():
+        ProgressCounter.adjust(total=-1, validated=-1 if instance.is_validated else 0)
+
+
+@receiver(post_delete, sender=TextAnnotation)
+def update_vocabulary_on_annotation_delete(sender, instance, **kwargs):
+    if in_bulk_changes():
+        return
+    delta = {
+        'drugs_removed': vocabulary._terms(instance.drugs),
+        'ades_removed': vocabulary._terms(instance.adverse_events),
+    }
+    transaction.on_commit(lambda: vocabulary.apply_delta(**delta))
+
+
+@receiver(post_delete, sender=TextAnnotation)
+def update_navigation_on_annotation_delete(sender, instance, **kwargs):
+    if in_bulk_changes():
+        return
+    annotation_id = instance.pk
+    transaction.on_commit(lambda: navigation.record_delete(annotation_id))
+
+
+@receiver(post_delete, sender=TextAnnotation)
+def record_annotation_tombstone(sender, instance, **kwargs):
+    """Keep the deleted id for delta exports (written in one INSERT after a bulk delete)"""
+    if in_bulk_changes():
+        _state.deleted_ids.append(instance.pk)
+    else:
+        DeletedAnnotation.record([instance.pk])
+
+
+@receiver(post_save, sender=TextAnnotation)
+@receiver(post_delete, sender=TextAnnotation)
+def bump_data_version(sender, raw=False, **kwargs):
+    """Invalidate cached exports (bulk writes bump once when they finish).
+
+    Change history is written by ``AnnotationChangeSet.save`` and deleted
+    through the admin, which bump the version themselves; no receiver on
+    AnnotationChange, so deleting an annotation fast-deletes its changes.
+    """
+    if not raw and not in_bulk_changes():
+        DataVersion.bump()
+
+
+@receiver(post_save, sender=DrugListEntry)
+def update_vocabulary_on_drug_entry_save(sender, instance, created, raw=False, **kwargs):
+    if raw or in_bulk_changes():
+        return
+    if created:
+        transaction.on_commit(lambda: vocabulary.apply_delta(drugs_added=[instance.name]))
+    else:
+        # Renamed in the admin, the old name is no longer known here
+        transaction.on_commit(vocabulary.invalidate)
+
+
+@receiver(post_delete, sender=DrugListEntry)
+def update_vocabulary_on_drug_entry_delete(sender, instance, **kwargs):
+    if not in_bulk_changes():
+        transaction.on_commit(lambda: vocabulary.apply_delta(drugs_removed=[instance.name]))
+
+
+@receiver(post_save, sender=ADEListEntry)
+def update_vocabulary_on_ade_entry_save(sender, instance, created, raw=False, **kwargs):
+    if raw or in_bulk_changes():
+        return
+    if created:
+        transaction.on_commit(lambda: vocabulary.apply_delta(ades_added=[instance.name]))
+    else:
+        # Renamed in the admin, the old name is no longer known here
+        transaction.on_commit(vocabulary.invalidate)
+
+
+@receiver(post_delete, sender=ADEListEntry)
+def update_vocabulary_on_ade_entry_delete(sender, instance, **kwargs):
+    if not in_bulk_changes():
+        transaction.on_commit(lambda: vocabulary.apply_delta(ades_removed=[instance.name]))
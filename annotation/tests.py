@@ -1,3 +1,1367 @@
-from django.test import TestCase
+import functools
+import gzip
+import json
+import os
+import tempfile
+import threading
+import zlib
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import (
+    bio, export_cache, exporter, huggingface, import_jobs, importer, matcher, navigation, offsets, partitioned_export,
+    publish_jobs, vocabulary, vocabulary_loader, work_queue,
+)
+from .models import (
+    TextAnnotation, AnnotationChange, AnnotationLease, BrandGenericMapping, CacheVersion, DataVersion, DrugListEntry,
+    ProgressCounter, PublishJob,
+)
+
+THREADS = 12
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def file_cache(test):
+    """Point the default cache at a fresh directory for one test, like the shipped settings"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    override = override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': directory.name,
+    }})
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+def export_cache_dir(test):
+    """Keep export snapshots in a fresh directory for one test"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    patcher = mock.patch.object(export_cache, 'CACHE_DIR', directory.name)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def run_concurrently(target, count=THREADS):
+    """Start target(0) ... target(count - 1) on threads at the same moment, returning what they raised"""
+    errors = []
+    barrier = threading.Barrier(count)
+
+    def run(number):
+        try:
+            barrier.wait()
+            target(number)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # Each thread has its own connection to the test database
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class HubHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Hub API, recording every POST on the server"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        length = int(self.headers['Content-Length'])
+        body = self.rfile.read(length)
+        # None if the client gave up before sending the whole body
+        return body if len(body) == length else None
+
+    def do_GET(self):
+        self.reply(200, {'name': 'annotator'})
+
+    def do_POST(self):
+        body = self.read_body()
+        if body is None:
+            self.close_connection = True
+            return
+        self.server.requests.append((self.path, self.headers, body))
+        self.reply(self.server.statuses.pop(0) if self.server.statuses else 200, {})
+
+
+class StandInHub:
+    """Serve HubHandler on a free local port with huggingface.ENDPOINT pointed at it"""
+
+    def __init__(self, statuses=()):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), HubHandler)
+        self.server.requests = []
+        self.server.statuses = list(statuses)
+        self.endpoint = mock.patch.object(huggingface, 'ENDPOINT', f'http://127.0.0.1:{self.server.server_port}')
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.endpoint.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def create_annotations(count, **fields):
+    TextAnnotation.objects.bulk_create(
+        TextAnnotation(text=f'Patient {number} took aspirin and had a headache.', **fields)
+        for number in range(count)
+    )
+    ProgressCounter.recount()
+    return list(TextAnnotation.objects.values_list('id', flat=True))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ConcurrentSaveTests(TransactionTestCase):
+    """Saves read the stored row and write it in one transaction; parallel annotators must not fail"""
+
+    def test_parallel_saves_keep_counters(self):
+        saves_per_thread = 20
+        ids = create_annotations(THREADS * saves_per_thread)
+
+        def save_annotations(number):
+            for annotation_id in ids[number * saves_per_thread:(number + 1) * saves_per_thread]:
+                annotation = TextAnnotation.objects.get(pk=annotation_id)
+                annotation.is_validated = True
+                annotation.drugs = ['aspirin']
+                annotation.save()
+
+        self.assertEqual(run_concurrently(save_annotations), [])
+        counter = ProgressCounter.get()
+        self.assertEqual(counter.total, len(ids))
+        self.assertEqual(counter.validated, TextAnnotation.objects.filter(is_validated=True).count())
+        self.assertEqual(counter.validated, len(ids))
+
+
+class ConcurrentClaimTests(TransactionTestCase):
+    """Many annotators claiming from the work queue at once"""
+
+    def test_parallel_claims_get_distinct_annotations(self):
+        create_annotations(THREADS * 2)
+        leases = {}
+
+        def claim(number):
+            lease = work_queue.claim(f'session:{number}')
+            self.assertIsNotNone(lease)
+            # Claiming again renews the same lease
+            self.assertEqual(work_queue.claim(f'session:{number}').annotation_id, lease.annotation_id)
+            leases[number] = lease.annotation_id
+
+        self.assertEqual(run_concurrently(claim), [])
+        self.assertEqual(len(set(leases.values())), THREADS)
+        self.assertEqual(AnnotationLease.objects.count(), THREADS)
+
+    def test_parallel_claims_when_queue_runs_out(self):
+        create_annotations(THREADS // 2)
+        leases = []
+
+        def claim(number):
+            lease = work_queue.claim(f'session:{number}')
+            if lease is not None:
+                leases.append(lease.annotation_id)
+
+        self.assertEqual(run_concurrently(claim), [])
+        self.assertEqual(sorted(leases), sorted(TextAnnotation.objects.values_list('id', flat=True)))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ConcurrentAnnotatorTests(TransactionTestCase):
+    """Annotators claiming from the queue and saving through the annotation page at the same time"""
+
+    def test_parallel_claim_and_save(self):
+        rounds = 5
+        create_annotations(THREADS * rounds * 2)
+        saved = [[] for _ in range(THREADS)]
+
+        def annotate(number):
+            client = Client()
+            for _ in range(rounds):
+                response = client.get('/annotation/')
+                self.assertEqual(response.status_code, 302)
+                annotation_url = response['Location']
+                response = client.post(
+                    annotation_url,
+                    {'drugs': 'aspirin', 'adverse_events': 'headache', 'is_validated': 'on'},
+                    HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                )
+                self.assertTrue(response.json()['success'], response.json())
+                saved[number].append(annotation_url)
+
+        self.assertEqual(run_concurrently(annotate), [])
+        urls = [url for urls in saved for url in urls]
+        # Every save was on an annotation leased to that annotator alone
+        self.assertEqual(len(set(urls)), THREADS * rounds)
+        self.assertEqual(TextAnnotation.objects.filter(is_validated=True).count(), THREADS * rounds)
+        self.assertEqual(AnnotationChange.objects.count(), THREADS * rounds * 2)
+        self.assertEqual(ProgressCounter.get().validated, THREADS * rounds)
+        self.assertFalse(AnnotationLease.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class LeaseTests(TestCase):
+    """Annotations leased to another annotator cannot be saved by anyone else"""
+
+    def setUp(self):
+        self.ids = create_annotations(4)
+        self.other = Client()
+        # The other annotator lands on the first annotation
+        self.assertEqual(self.other.get('/annotation/')['Location'], f'/annotation/{self.ids[0]}/')
+
+    def patch(self, annotation_id):
+        return self.client.patch(
+            f'/annotation/api/{annotation_id}/',
+            json.dumps({'operations': [{'op': 'add', 'field': 'drugs', 'entity': 'aspirin'}]}),
+            content_type='application/json',
+        )
+
+    def test_patch_is_refused_while_another_annotator_holds_the_lease(self):
+        response = self.patch(self.ids[0])
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(TextAnnotation.objects.get(pk=self.ids[0]).drugs, [])
+
+        # A lapsed lease no longer protects it
+        AnnotationLease.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.patch(self.ids[0]).status_code, 200)
+
+    def test_claim_refused_for_a_leased_annotation(self):
+        response = self.client.post('/annotation/queue/claim/', {'annotation_id': self.ids[0]})
+        self.assertEqual(response.status_code, 409)
+
+    def test_save_and_next_leases_the_next_free_annotation(self):
+        self.client.get('/annotation/')
+        # The second annotator holds ids[1]; the other one moves on past it
+        response = self.other.post(f'/annotation/{self.ids[0]}/', {'drugs': 'aspirin', 'save_and_next': '1'})
+        self.assertEqual(response['Location'], f'/annotation/{self.ids[2]}/')
+        # Moving on handed ids[0] back to the queue
+        self.assertEqual(set(AnnotationLease.objects.values_list('annotation_id', flat=True)), {self.ids[1], self.ids[2]})
+
+    def test_claims_delete_lapsed_leases(self):
+        AnnotationLease.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        lease = work_queue.claim('session:third')
+        self.assertEqual(lease.annotation_id, self.ids[0])
+        self.assertEqual(AnnotationLease.objects.count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class AnnotationPatchTests(TestCase):
+    """Entity operations sent by the annotation page"""
+
+    def setUp(self):
+        self.annotation = TextAnnotation.objects.create(text='Patient took aspirin and had a headache.')
+
+    def patch(self, operations):
+        return self.client.patch(
+            f'/annotation/api/{self.annotation.id}/',
+            json.dumps({'operations': operations}),
+            content_type='application/json',
+        )
+
+    def test_bad_operations_do_not_fail_the_others(self):
+        response = self.patch([
+            {'op': 'add', 'field': 'drugs', 'entity': ' aspirin '},
+            # Offsets are not part of the format and are ignored
+            {'op': 'add', 'field': 'adverse_events', 'entity': 'headache', 'start': 0, 'end': 8},
+            {'op': 'rename', 'field': 'drugs', 'entity': 'aspirin'},
+            {'op': 'add', 'field': 'drugs', 'entity': ''},
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['applied'], 2)
+        self.assertEqual(len(data['errors']), 2)
+        self.annotation.refresh_from_db()
+        self.assertEqual(self.annotation.drugs, ['aspirin'])
+        self.assertEqual(self.annotation.adverse_events, ['headache'])
+
+    def test_operations_must_be_a_list(self):
+        response = self.patch({'op': 'add'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class StreamingImportTests(TestCase):
+    """JSONL read in chunks and inserted in batches"""
+
+    def test_lines_split_across_chunks(self):
+        data = '\n'.join(json.dumps({'text': f'Patient {number} took ibuprofène.', 'drugs': ['ibuprofène']},
+                                    ensure_ascii=False) for number in range(5)).encode()
+        # Three-byte chunks cut lines and multi-byte characters
+        chunks = [data[start:start + 3] for start in range(0, len(data), 3)]
+        with CaptureQueriesContext(connection) as queries:
+            result = importer.import_stream(chunks, batch_size=2)
+        self.assertEqual((result.lines, result.imported, result.skipped), (5, 5, 0))
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "annotation_textannotation"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(
+            list(TextAnnotation.objects.order_by('id').values_list('text', flat=True)),
+            [f'Patient {number} took ibuprofène.' for number in range(5)],
+        )
+        self.assertEqual(TextAnnotation.objects.filter(drugs=['ibuprofène']).count(), 5)
+        self.assertEqual(ProgressCounter.get().total, 5)
+
+    def test_bad_lines_only_reject_themselves(self):
+        data = b'\n'.join([
+            b'\xef\xbb\xbf{"text": "Took aspirin.", "drugs": ["aspirin"]}',
+            b'{"text": "Truncated',
+            b'[1, 2]',
+            b'',
+            b'{"text": "Took codeine.", "drugs": "codeine"}',
+            b'{"text": "Was validated.", "is_validated": "yes"}',
+            b'\xff\xfe',
+            b'{"text": "Had a rash.", "adverse_events": ["rash"], "is_validated": true}',
+        ])
+        result = importer.import_stream([data], batch_size=1, error_limit=2)
+        self.assertEqual((result.lines, result.imported, result.skipped), (8, 2, 5))
+        self.assertEqual([line for line, _ in result.errors.errors], [2, 3])
+        self.assertEqual(result.errors.omitted, 3)
+        self.assertEqual(
+            list(TextAnnotation.objects.order_by('id').values_list('text', 'is_validated')),
+            [('Took aspirin.', False), ('Had a rash.', True)],
+        )
+
+
+class ImportJobTests(TransactionTestCase):
+    """Background imports commit batch by batch and resume where they stopped"""
+
+    def setUp(self):
+        file_cache(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in (
+            mock.patch.object(import_jobs, 'SPOOL_DIR', Path(directory.name)),
+            # Run jobs on the test thread instead of the pool
+            mock.patch.object(import_jobs, 'submit'),
+            # One line per parsed range so batches can stop mid-file
+            mock.patch.object(import_jobs, 'parse_ranges', functools.partial(importer.parse_ranges, range_size=1)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.texts = [f'Patient {number} took aspirin.' for number in range(5)]
+        TextAnnotation.objects.create(text='Cleared by the import.')
+
+    def create_job(self):
+        data = '\n'.join(json.dumps({'text': text, 'drugs': ['aspirin']}) for text in self.texts)
+        return import_jobs.create_job(
+            SimpleUploadedFile('data.jsonl', data.encode()), clear_existing=True, batch_size=2
+        )
+
+    def stop_after_first_batch(self, stop):
+        commit = import_jobs._commit
+        calls = []
+
+        def first_batch_then_stop(job, *args):
+            if calls:
+                stop(job)
+            calls.append(job.pk)
+            commit(job, *args)
+
+        return mock.patch.object(import_jobs, '_commit', first_batch_then_stop)
+
+    def assert_resumes_to_completion(self, job):
+        self.assertTrue(import_jobs.is_resumable(job))
+        response = self.client.post(f'/annotation/import/jobs/{job.pk}/resume/')
+        self.assertEqual(response.json()['job']['status'], 'queued')
+        import_jobs.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual((job.rows_inserted, job.lines_committed), (5, 5))
+        self.assertEqual(list(TextAnnotation.objects.order_by('id').values_list('text', flat=True)), self.texts)
+        self.assertEqual(ProgressCounter.get().total, 5)
+        self.assertFalse(os.path.exists(job.spool_path))
+
+    def test_cancel_and_resume(self):
+        job = self.create_job()
+
+        def cancel(job):
+            response = self.client.post(f'/annotation/import/jobs/{job.pk}/cancel/')
+            self.assertTrue(response.json()['job']['cancel_requested'])
+
+        with self.stop_after_first_batch(cancel):
+            import_jobs.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'cancelled')
+        self.assertEqual((job.rows_inserted, job.lines_committed), (4, 4))
+        self.assertEqual(TextAnnotation.objects.count(), 4)
+        self.assertEqual(self.client.post(f'/annotation/import/jobs/{job.pk}/cancel/').status_code, 409)
+
+        self.assert_resumes_to_completion(job)
+        self.assertEqual(self.client.post(f'/annotation/import/jobs/{job.pk}/resume/').status_code, 409)
+
+    def test_failed_job_resumes_after_its_last_batch(self):
+        job = self.create_job()
+
+        def fail(job):
+            raise OSError('disk full')
+
+        with self.stop_after_first_batch(fail):
+            import_jobs.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.message), ('failed', 'disk full'))
+        self.assertEqual(job.lines_committed, 2)
+        self.assert_resumes_to_completion(job)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ParallelParseTests(TestCase):
+    """Parsing a file on worker processes gives what the serial parse gives"""
+
+    def setUp(self):
+        lines = []
+        for number in range(60):
+            row = {'text': f'Patient {number} took ibuprofène.', 'drugs': ['ibuprofène'], 'is_validated': number % 3 == 0}
+            lines.append(json.dumps(row, ensure_ascii=False).encode())
+            if number % 17 == 5:
+                lines.append(b'{"text": "Truncated')
+            if number % 23 == 7:
+                lines.append(b'')
+        lines[10] += b'\r'
+        handle = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+        self.addCleanup(os.remove, handle.name)
+        with handle:
+            # No newline after the last line
+            handle.write(b'\n'.join(lines))
+        self.path = handle.name
+
+    def parse(self, **kwargs):
+        return [(parsed.rows, parsed.errors, parsed.last_line, parsed.end)
+                for parsed in importer.parse_ranges(self.path, range_size=300, **kwargs)]
+
+    def test_workers_return_the_serial_ranges(self):
+        serial = self.parse()
+        self.assertGreater(len(serial), 4)
+        self.assertEqual(self.parse(workers=3), serial)
+        # Resuming from a range boundary
+        _, _, last_line, end = serial[1]
+        self.assertEqual(self.parse(start=end, first_line=last_line + 1, workers=2), serial[2:])
+
+        with open(self.path, 'rb') as handle:
+            errors = importer.ErrorReport()
+            rows = list(importer.parse_lines(importer.iter_lines(importer.read_chunks(handle)), errors))
+        self.assertEqual([row for parsed in serial for row in parsed[0]], rows)
+        self.assertEqual([error for parsed in serial for error in parsed[1]], errors.errors)
+
+    def test_parallel_import_inserts_the_same_rows(self):
+        fields = ('text', 'drugs', 'adverse_events', 'is_validated')
+        with open(self.path, 'rb') as handle:
+            streamed = importer.import_stream(importer.read_chunks(handle))
+        expected = list(TextAnnotation.objects.order_by('id').values_list(*fields))
+        TextAnnotation.objects.all().delete()
+
+        result = importer.import_file(self.path, workers=2)
+        self.assertEqual(list(TextAnnotation.objects.order_by('id').values_list(*fields)), expected)
+        self.assertEqual((result.lines, result.imported, result.errors.errors),
+                         (streamed.lines, streamed.imported, streamed.errors.errors))
+
+
+class ImportCommandTests(TransactionTestCase):
+    """manage.py import_jsonl for scripted bulk loads"""
+
+    def setUp(self):
+        file_cache(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        rows = [
+            {'text': 'Took aspirin.', 'drugs': ['aspirin'], 'drug_ade_pairs': []},
+            {'text': 'Aspirin caused a rash.', 'drugs': ['aspirin'], 'adverse_events': ['rash'],
+             'drug_ade_pairs': [['aspirin', 'rash']]},
+            {'text': 'Had a headache.', 'adverse_events': ['headache']},
+        ]
+        self.data = '\n'.join(json.dumps(row) for row in rows).encode() + b'\nnot json\n'
+
+    def write(self, name, compress=False):
+        path = self.directory / name
+        path.write_bytes(gzip.compress(self.data) if compress else self.data)
+        return str(path)
+
+    def indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s ORDER BY name",
+                [TextAnnotation._meta.db_table],
+            )
+            return cursor.fetchall()
+
+    def import_jsonl(self, *args):
+        out = StringIO()
+        call_command('import_jsonl', *args, stdout=out)
+        return out.getvalue()
+
+    def test_gzip_upsert_with_validated_field(self):
+        path = self.write('gold.jsonl.gz', compress=True)
+        indexes = self.indexes()
+        output = self.import_jsonl(path, '--validated-from-field', 'drug_ade_pairs', '--batch-size', '2')
+        self.assertIn('(gzip)', output)
+        self.assertIn('Inserted: 3', output)
+        self.assertIn('Skipped line 4: Invalid JSON', output)
+        self.assertEqual(
+            list(TextAnnotation.objects.order_by('id').values_list('text', 'is_validated')),
+            [('Took aspirin.', False), ('Aspirin caused a rash.', True), ('Had a headache.', False)],
+        )
+        # Indexes dropped for the load are rebuilt
+        self.assertEqual(self.indexes(), indexes)
+        self.assertEqual(ProgressCounter.get().validated, 1)
+
+        output = self.import_jsonl(path, '--validated-from-field', 'drug_ade_pairs', '--upsert')
+        self.assertIn('Inserted: 0', output)
+        self.assertIn('Updated: 0', output)
+        self.assertIn('Unchanged: 3', output)
+        self.assertEqual(TextAnnotation.objects.count(), 3)
+
+    def test_parallel_import_and_clear(self):
+        TextAnnotation.objects.create(text='Cleared by the import.')
+        output = self.import_jsonl(self.write('data.jsonl'), '--parallel', '2', '--clear', '--no-tune')
+        self.assertIn('with 2 parser process(es)', output)
+        self.assertIn('Inserted: 3', output)
+        self.assertEqual(TextAnnotation.objects.count(), 3)
+        self.assertEqual(ProgressCounter.get().total, 3)
+
+    def test_bad_arguments(self):
+        gzipped = self.write('data.jsonl.gz', compress=True)
+        for args in ((gzipped, '--parallel', '2'), (gzipped, '--batch-size', '0'), (str(self.directory),)):
+            with self.assertRaises(CommandError):
+                self.import_jsonl(*args)
+        self.assertFalse(TextAnnotation.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class UpsertImportTests(TestCase):
+    """Upsert imports match every input line to one stored annotation"""
+
+    def import_lines(self, *rows, upsert=True, batch_size=importer.DEFAULT_BATCH_SIZE):
+        data = '\n'.join(json.dumps(row) for row in rows).encode()
+        return importer.import_stream([data], upsert=upsert, batch_size=batch_size)
+
+    def test_counts_match_the_lines_read(self):
+        # Two stored copies of the same text
+        TextAnnotation.objects.create(text='Took aspirin.', drugs=['aspirin'])
+        TextAnnotation.objects.create(text='Took aspirin.', drugs=['aspirin'])
+        result = self.import_lines(
+            {'id': 1, 'text': 'Took aspirin.', 'drugs': ['aspirin']},
+            {'id': 1, 'text': 'Took aspirin.', 'drugs': ['aspirin']},
+            {'id': 2, 'text': 'Had a headache.', 'adverse_events': ['headache']},
+        )
+        self.assertEqual((result.imported, result.updated, result.unchanged), (1, 0, 2))
+
+        result = self.import_lines(
+            {'id': 1, 'text': 'Took aspirin.', 'drugs': ['aspirin', 'ibuprofen']},
+            {'id': 2, 'text': 'Had a headache.', 'adverse_events': ['headache']},
+        )
+        self.assertEqual((result.imported, result.updated, result.unchanged), (0, 1, 1))
+        # Only the copy the line was matched to changed
+        self.assertEqual(TextAnnotation.objects.filter(drugs=['aspirin', 'ibuprofen']).count(), 1)
+
+    def test_importing_the_same_file_twice_changes_nothing(self):
+        # The same text with different entities, in different batches, and no is_validated key
+        rows = [
+            {'text': 'Took aspirin.', 'drugs': ['aspirin'], 'adverse_events': []},
+            {'text': 'Had a rash.', 'drugs': [], 'adverse_events': ['rash']},
+            {'text': 'Took aspirin.', 'drugs': [], 'adverse_events': []},
+            {'text': 'Took aspirin.', 'drugs': ['aspirin'], 'adverse_events': ['nausea']},
+        ]
+        self.import_lines(*rows, upsert=False)
+        TextAnnotation.objects.update(is_validated=True)
+        stored = list(TextAnnotation.objects.order_by('id').values_list('drugs', 'adverse_events', 'is_validated'))
+
+        for _ in range(2):
+            result = self.import_lines(*rows, batch_size=2)
+            self.assertEqual((result.imported, result.updated, result.unchanged), (0, 0, len(rows)))
+        self.assertEqual(
+            list(TextAnnotation.objects.order_by('id').values_list('drugs', 'adverse_events', 'is_validated')), stored
+        )
+        self.assertFalse(AnnotationChange.objects.exists())
+
+    def test_fields_missing_from_the_line_are_kept(self):
+        TextAnnotation.objects.create(text='Took aspirin.', drugs=['aspirin'], is_validated=True)
+        result = self.import_lines({'text': 'Took aspirin.', 'adverse_events': ['nausea']})
+        self.assertEqual((result.imported, result.updated, result.unchanged), (0, 1, 0))
+        annotation = TextAnnotation.objects.get()
+        self.assertEqual(annotation.drugs, ['aspirin'])
+        self.assertEqual(annotation.adverse_events, ['nausea'])
+        self.assertTrue(annotation.is_validated)
+
+
+class OffsetCacheTests(TestCase):
+    """The per-process offset cache stays bounded however many rows are exported"""
+
+    def tearDown(self):
+        offsets.clear_cache()
+
+    def test_cache_is_bounded(self):
+        offsets.clear_cache()
+        with mock.patch.object(offsets, 'CACHE_SIZE', 5):
+            for number in range(20):
+                found = offsets.entity_offsets(number, None, 'Took aspirin.', ['aspirin'], [])
+                self.assertEqual(found, ((5, 12, offsets.DRUG, 'aspirin'),))
+        self.assertEqual(len(offsets._cache), 5)
+        self.assertEqual([key[0] for key in offsets._cache], list(range(15, 20)))
+
+
+class DataVersionTests(TestCase):
+    """Writes to annotations and their change history invalidate cached exports once"""
+
+    def setUp(self):
+        self.annotation = TextAnnotation.objects.create(text='Took aspirin.')
+        changes = AnnotationChange.change_set(self.annotation, 'session')
+        for number in range(50):
+            changes.add('drug_added', 'drugs', f'drug {number}', [], [f'drug {number}'])
+        changes.save()
+
+    def test_deleting_an_annotation_bumps_once(self):
+        version = DataVersion.current().version
+        with CaptureQueriesContext(connection) as queries:
+            self.annotation.delete()
+        self.assertEqual(DataVersion.current().version, version + 1)
+        self.assertFalse(AnnotationChange.objects.exists())
+        # The changes go in one DELETE, not one per row
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE FROM "annotation_annotationchange"')]
+        self.assertEqual(len(deletes), 1)
+
+    def test_admin_delete_bumps_once(self):
+        change_admin = admin.site._registry[AnnotationChange]
+        version = DataVersion.current().version
+        change_admin.delete_queryset(None, AnnotationChange.objects.all())
+        self.assertEqual(DataVersion.current().version, version + 1)
+        self.assertFalse(AnnotationChange.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class StreamingExportTests(TestCase):
+    """Exports stream value rows in id order with a fixed number of queries"""
+
+    def setUp(self):
+        export_cache_dir(self)
+        TextAnnotation.objects.create(text='Took aspirin.', drugs=['aspirin'], is_validated=True)
+        TextAnnotation.objects.create(text='Had a rash.', adverse_events=['rash'])
+        TextAnnotation.objects.create(text='Nothing to report.')
+
+    def export(self, path='/annotation/export/', **params):
+        response = self.client.get(path, params)
+        self.assertTrue(response.streaming)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_rows_in_id_order_with_constant_queries(self):
+        with CaptureQueriesContext(connection) as few:
+            rows = self.export()
+        self.assertEqual([row['text'] for row in rows], ['Took aspirin.', 'Had a rash.', 'Nothing to report.'])
+        self.assertEqual(set(rows[0]), {'text', 'drugs', 'adverse_events', 'is_validated', 'created_at', 'updated_at'})
+
+        create_annotations(500)
+        # bulk_create skips the signals, like the importer's bulk writes
+        DataVersion.bump()
+        with CaptureQueriesContext(connection) as many:
+            rows = self.export()
+        self.assertEqual(len(rows), 503)
+        self.assertEqual(len(many), len(few))
+
+    def test_filters(self):
+        AnnotationChange.objects.create(
+            annotation=TextAnnotation.objects.get(text='Nothing to report.'), change_type='drug_removed',
+        )
+        for filter_type, texts in (
+            ('annotated', ['Took aspirin.', 'Had a rash.']),
+            ('validated', ['Took aspirin.']),
+            ('annotated_validated', ['Took aspirin.']),
+            ('modified', ['Nothing to report.']),
+            ('all', ['Took aspirin.', 'Had a rash.', 'Nothing to report.']),
+        ):
+            self.assertEqual([row['text'] for row in self.export(filter=filter_type)], texts, filter_type)
+
+    def test_entities_export(self):
+        rows = self.export('/annotation/export-entities/')
+        self.assertEqual(rows[0]['entities'], [{'start': 5, 'end': 12, 'label': 'DRUG', 'text': 'aspirin'}])
+        self.assertEqual(rows[1]['entities'], [{'start': 6, 'end': 10, 'label': 'ADVERSE_EVENT', 'text': 'rash'}])
+        self.assertEqual(rows[2]['entities'], [])
+
+    def test_lines_are_sent_in_buffers(self):
+        lines = [f'{number:03d}\n' for number in range(100)]
+        chunks = list(exporter.buffered(iter(lines), buffer_size=64))
+        self.assertEqual(b''.join(chunks), ''.join(lines).encode())
+        self.assertTrue(all(len(chunk) >= 64 for chunk in chunks[:-1]))
+        self.assertEqual(len(chunks), 7)
+
+
+class ChangeHistoryExportTests(TestCase):
+    """include_changes merges each annotation's history into its row"""
+
+    def setUp(self):
+        export_cache_dir(self)
+        self.ids = create_annotations(4)
+        now = timezone.now()
+        for annotation_id, change_type, entity, minutes in (
+            (self.ids[0], 'drug_added', 'aspirin', 3),
+            (self.ids[0], 'event_added', 'headache', 1),
+            (self.ids[0], 'bulk_update', None, 2),
+            (self.ids[2], 'drug_removed', 'aspirin', 5),
+        ):
+            change = AnnotationChange.objects.create(
+                annotation_id=annotation_id, change_type=change_type, field_name='drugs', entity_name=entity,
+                old_value=[], new_value=[entity] if entity else [], session_id='test',
+            )
+            AnnotationChange.objects.filter(pk=change.pk).update(timestamp=now - timedelta(minutes=minutes))
+
+    def export(self, **params):
+        response = self.client.get('/annotation/export/', {'include_changes': 'true', **params})
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def expected(self, annotation):
+        changes = annotation.changes.order_by('-timestamp').values(*exporter.CHANGE_FIELDS)
+        return exporter.build_change_fields(annotation.get_change_summary(), changes)
+
+    def test_history_matches_each_annotation(self):
+        rows = self.export()
+        self.assertEqual(len(rows), 4)
+        for annotation, row in zip(TextAnnotation.objects.order_by('id'), rows):
+            self.assertEqual({field: row[field] for field in self.expected(annotation)}, self.expected(annotation))
+
+        first = rows[0]
+        self.assertEqual(first['change_summary']['total_changes'], 3)
+        self.assertEqual([change['change_type'] for change in first['changes']], ['event_added', 'bulk_update', 'drug_added'])
+        self.assertEqual(first['change_statistics']['total_additions'], 2)
+        self.assertEqual(rows[1]['changes'], [])
+        self.assertEqual(rows[1]['change_summary']['total_changes'], 0)
+        self.assertEqual(rows[2]['change_statistics']['total_removals'], 1)
+
+        self.assertEqual([row['change_summary']['total_changes'] for row in self.export(filter='modified')], [3, 1])
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # Create the version row up front so both exports do the same lookups
+        DataVersion.current()
+        with CaptureQueriesContext(connection) as few:
+            self.export()
+        for annotation_id in create_annotations(50)[4:]:
+            AnnotationChange.objects.create(annotation_id=annotation_id, change_type='drug_added', entity_name='aspirin')
+        # Written directly, without the annotation saves that bump the version
+        DataVersion.bump()
+        with CaptureQueriesContext(connection) as many:
+            rows = self.export()
+        self.assertEqual(len(rows), 54)
+        self.assertEqual(rows[-1]['change_summary']['drug_additions'], 1)
+        self.assertEqual(len(many), len(few))
+
+
+class DeltaExportTests(TestCase):
+    """since= exports what changed after a cursor, with tombstones for removals"""
+
+    def setUp(self):
+        export_cache_dir(self)
+        patcher = mock.patch.object(exporter, 'DELTA_OVERLAP', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.kept = TextAnnotation.objects.create(text='Took aspirin.', drugs=['aspirin'])
+        self.edited = TextAnnotation.objects.create(text='Had a rash.', adverse_events=['rash'])
+        self.deleted = TextAnnotation.objects.create(text='Took codeine.', drugs=['codeine'])
+
+    def export(self, **params):
+        response = self.client.get('/annotation/export/', params)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        return response['X-Export-Cursor'], lines
+
+    def test_changes_and_deletions_after_the_cursor(self):
+        cursor, full = self.export()
+        self.assertEqual(len(full), 3)
+
+        self.edited.adverse_events = []
+        self.edited.save()
+        deleted_id = self.deleted.pk
+        self.deleted.delete()
+        added = TextAnnotation.objects.create(text='Had a headache.', adverse_events=['headache'])
+
+        next_cursor, delta = self.export(since=cursor)
+        self.assertEqual(delta, [
+            {'id': self.edited.pk, **exporter.annotation_record(
+                TextAnnotation.objects.values(*exporter.EXPORT_FIELDS).get(pk=self.edited.pk))},
+            {'id': added.pk, **exporter.annotation_record(
+                TextAnnotation.objects.values(*exporter.EXPORT_FIELDS).get(pk=added.pk))},
+            {'id': deleted_id, 'deleted': True},
+        ])
+        self.assertGreater(exporter.parse_since(next_cursor), exporter.parse_since(cursor))
+
+        # Nothing happened since the new cursor
+        _, delta = self.export(since=next_cursor)
+        self.assertEqual(delta, [])
+
+    def test_rows_leaving_the_filter_become_tombstones(self):
+        cursor, full = self.export(filter='annotated')
+        self.assertEqual(len(full), 3)
+        self.edited.adverse_events = []
+        self.edited.save()
+        self.kept.is_validated = True
+        self.kept.save()
+
+        _, delta = self.export(filter='annotated', since=cursor)
+        self.assertEqual([(row['id'], row.get('deleted', False)) for row in delta],
+                         [(self.kept.pk, False), (self.edited.pk, True)])
+
+    def test_since_formats(self):
+        moment = timezone.now()
+        self.kept.save()
+        _, delta = self.export(since=moment.isoformat())
+        self.assertEqual([row['id'] for row in delta], [self.kept.pk])
+        self.assertEqual(exporter.parse_since(exporter.encode_cursor(moment)), moment)
+
+        response = self.client.get('/annotation/export/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+
+
+class GzipExportTests(TestCase):
+    """compress=gzip sends the same export compressed on the fly"""
+
+    def setUp(self):
+        export_cache_dir(self)
+        create_annotations(200)
+        DataVersion.bump()
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        return response, b''.join(response.streaming_content) if response.streaming else b''
+
+    def test_exports_decompress_to_the_plain_output(self):
+        for path, params in (
+            ('/annotation/export/', {}),
+            ('/annotation/export/', {'include_changes': 'true'}),
+            ('/annotation/export-entities/', {}),
+            ('/annotation/export-bio/', {'format': 'conll'}),
+            ('/annotation/export/', {'since': '2000-01-01T00:00:00Z'}),
+        ):
+            plain, body = self.get(path, **params)
+            compressed, data = self.get(path, compress='gzip', **params)
+            self.assertEqual(compressed['Content-Encoding'], 'gzip')
+            self.assertFalse(plain.has_header('Content-Encoding'))
+            self.assertEqual(gzip.decompress(data), body, path)
+            self.assertLess(len(data), len(body))
+
+    def test_snapshot_is_kept_per_compression(self):
+        plain, _ = self.get('/annotation/export/')
+        first, data = self.get('/annotation/export/', compress='gzip')
+        self.assertNotEqual(first['ETag'], plain['ETag'])
+        second, cached = self.get('/annotation/export/', compress='gzip')
+        self.assertEqual((first['X-Export-Cache'], second['X-Export-Cache']), ('miss', 'hit'))
+        self.assertEqual(second['Content-Encoding'], 'gzip')
+        self.assertEqual(cached, data)
+
+    def test_unknown_compression_is_refused(self):
+        response, _ = self.get('/annotation/export/', compress='brotli')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_sync_flush_sends_what_was_compressed(self):
+        chunks = [bytes([65 + number]) * 100 for number in range(5)]
+        decompressor = zlib.decompressobj(exporter.GZIP_WBITS)
+        received = []
+        for data in exporter.gzip_stream(iter(chunks), flush_every=150):
+            received.append(decompressor.decompress(data))
+        # Everything up to each flush can be decompressed as soon as it arrives
+        self.assertEqual([len(part) for part in received if part], [200, 200, 100])
+        self.assertEqual(b''.join(received), b''.join(chunks))
+        self.assertTrue(decompressor.eof)
+
+
+class PartitionedExportTests(TestCase):
+    """Id-range exports and shards reproduce the streamed exports.
+
+    Worker processes open the configured database rather than the test one,
+    so these run the ranges in-process (workers=1).
+    """
+
+    def setUp(self):
+        export_cache_dir(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        create_annotations(25, drugs=['aspirin'])
+        ids = TextAnnotation.objects.order_by('id').values_list('id', flat=True)
+        TextAnnotation.objects.filter(id__in=ids[::3]).update(
+            is_validated=True, adverse_events=['headache'],
+        )
+        DataVersion.bump()
+
+    def streamed(self, path, **params):
+        return b''.join(self.client.get(path, params).streaming_content)
+
+    def test_shards_and_manifest(self):
+        result = partitioned_export.write_shards(self.directory, range_size=10, workers=1)
+        names = ['part-00000.jsonl', 'part-00001.jsonl', 'part-00002.jsonl']
+        self.assertEqual(sorted(path.name for path in self.directory.iterdir()), ['manifest.json'] + names)
+        self.assertEqual(b''.join((self.directory / name).read_bytes() for name in names),
+                         self.streamed('/annotation/export/'))
+
+        manifest = json.loads((self.directory / 'manifest.json').read_text())
+        ids = list(TextAnnotation.objects.order_by('id').values_list('id', flat=True))
+        self.assertEqual((manifest['flavour'], manifest['rows'], result.rows), ('jsonl', 25, 25))
+        self.assertEqual(
+            [(shard['file'], shard['first_id'], shard['end_id'], shard['rows']) for shard in manifest['shards']],
+            [(names[0], ids[0], ids[10], 10), (names[1], ids[10], ids[20], 10), (names[2], ids[20], None, 5)],
+        )
+        self.assertEqual([shard['bytes'] for shard in manifest['shards']],
+                         [(self.directory / name).stat().st_size for name in names])
+
+    def test_gzip_shards_of_a_filtered_flavour(self):
+        partitioned_export.write_shards(
+            self.directory, flavour='bio-jsonl', filter_type='validated', compress=True, range_size=4, workers=1,
+        )
+        manifest = json.loads((self.directory / 'manifest.json').read_text())
+        self.assertEqual((manifest['rows'], manifest['compress']), (9, 'gzip'))
+        self.assertEqual([shard['file'] for shard in manifest['shards']],
+                         ['part-00000.jsonl.gz', 'part-00001.jsonl.gz', 'part-00002.jsonl.gz'])
+        data = b''.join(gzip.decompress((self.directory / shard['file']).read_bytes()) for shard in manifest['shards'])
+        self.assertEqual(data, self.streamed('/annotation/export-bio/', format='jsonl', filter='validated'))
+
+    def test_export_dataset_command(self):
+        output = self.directory / 'entities.jsonl.gz'
+        call_command('export_dataset', str(output), '--flavour', 'entities', '--gzip', '--workers', '1',
+                     '--rows-per-part', '7', stderr=StringIO())
+        # Ranges are gzip members of their own, read back as one file
+        self.assertEqual(gzip.decompress(output.read_bytes()), self.streamed('/annotation/export-entities/'))
+
+        call_command('export_dataset', str(self.directory / 'shards'), '--shards', '--flavour', 'conll',
+                     '--workers', '1', '--rows-per-part', '30', stderr=StringIO())
+        self.assertEqual((self.directory / 'shards' / 'part-00000.conll').read_bytes(),
+                         self.streamed('/annotation/export-bio/', format='conll'))
+
+        for args in (('-', '--shards'), ('-', '--flavour', 'conll', '--include-changes'), ('-', '--workers', '0')):
+            with self.assertRaises(CommandError):
+                call_command('export_dataset', *args, stderr=StringIO())
+
+
+class ExportCacheTests(TestCase):
+    """Full exports are served from a snapshot of the data version, or answered with 304"""
+
+    def setUp(self):
+        export_cache_dir(self)
+        TextAnnotation.objects.create(text='Took aspirin.', drugs=['aspirin'], is_validated=True)
+        TextAnnotation.objects.create(text='Had a rash.', adverse_events=['rash'])
+
+    def export(self, **headers):
+        response = self.client.get('/annotation/export/', headers=headers)
+        body = b''.join(response.streaming_content) if response.status_code == 200 else b''
+        return response, body
+
+    def test_snapshot_hit_and_not_modified(self):
+        first, body = self.export()
+        self.assertEqual(first['X-Export-Cache'], 'miss')
+        self.assertEqual(len(body.splitlines()), 2)
+
+        # Served from the snapshot without counting the rows again
+        with CaptureQueriesContext(connection) as queries:
+            second, cached = self.export()
+        self.assertEqual(second['X-Export-Cache'], 'hit')
+        self.assertEqual(cached, body)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+
+        not_modified, _ = self.export(if_none_match=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_write_changes_the_etag(self):
+        first, _ = self.export()
+        annotation = TextAnnotation.objects.get(text='Had a rash.')
+        annotation.is_validated = True
+        annotation.save()
+        response, body = self.export(if_none_match=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Export-Cache'], 'miss')
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertTrue(all(json.loads(line)['is_validated'] for line in body.splitlines()))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PublishJobTests(TestCase):
+    """Background publishing: retries and expiry"""
+
+    def setUp(self):
+        TextAnnotation.objects.create(text='Took aspirin.', drugs=['aspirin'])
+
+    def create_job(self, **fields):
+        return PublishJob.objects.create(dataset_name='adverse-events', **fields)
+
+    @mock.patch.object(publish_jobs, 'BACKOFF', 0)
+    @mock.patch.object(huggingface, 'BACKOFF', 0)
+    def test_upload_is_retried_by_one_layer_only(self):
+        job = self.create_job()
+        publish_jobs._tokens[job.pk] = 'token'
+        # create_repo succeeds, every upload gets a gateway error
+        with StandInHub(statuses=[200] + [503] * 20) as hub:
+            publish_jobs._run(job.pk)
+        uploads = [path for path, _, _ in hub.requests if path.endswith('/upload')]
+        self.assertEqual(len(uploads), publish_jobs.ATTEMPTS)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.retries, publish_jobs.ATTEMPTS - 1)
+
+    def test_only_running_jobs_expire(self):
+        queued = self.create_job()
+        publish_jobs._tokens[queued.pk] = 'token'
+        self.addCleanup(publish_jobs._tokens.pop, queued.pk, None)
+        running = self.create_job(status='running')
+        long_ago = timezone.now() - publish_jobs.STALE_AFTER - timedelta(minutes=1)
+        PublishJob.objects.update(updated_at=long_ago)
+        self.assertFalse(publish_jobs.expire_stale(queued))
+        self.assertTrue(publish_jobs.expire_stale(running))
+        self.assertEqual(running.status, 'failed')
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, 'queued')
+
+    def test_queued_job_without_token_expires(self):
+        # Queued before a restart: the token went with the old process
+        orphaned = self.create_job()
+        waiting = self.create_job()
+        publish_jobs._tokens[waiting.pk] = 'token'
+        self.addCleanup(publish_jobs._tokens.pop, waiting.pk, None)
+        self.assertTrue(publish_jobs.expire_stale(orphaned))
+        self.assertEqual(orphaned.status, 'failed')
+        self.assertEqual(orphaned.message, publish_jobs.INTERRUPTED_MESSAGE)
+        self.assertFalse(publish_jobs.expire_stale(waiting))
+
+
+class UploadBodyTests(TestCase):
+    """Multipart uploads streamed to a local stand-in for the Hub"""
+
+    def parts(self):
+        return [
+            ('data.jsonl', 'data.jsonl', 'application/jsonl', lambda: [b'{"id": 1}', b'\n', b'{"id": 2}']),
+            ('README.md', 'README.md', 'text/markdown', lambda: ['# Ünïcode'.encode()]),
+        ]
+
+    def upload(self, parts, chunked):
+        with StandInHub() as hub:
+            huggingface.upload_files('token', 'annotator', 'adverse-events', parts, chunked=chunked, retries=0)
+        self.assertEqual(len(hub.requests), 1)
+        return hub.requests[0]
+
+    def assert_body(self, headers, body):
+        boundary = headers['Content-Type'].split('boundary=')[1]
+        self.assertEqual(body, (
+            f'--{boundary}\r\n'
+            'Content-Disposition: form-data; name="data.jsonl"; filename="data.jsonl"\r\n'
+            'Content-Type: application/jsonl\r\n\r\n'
+            '{"id": 1}\n{"id": 2}\r\n'
+            f'--{boundary}\r\n'
+            'Content-Disposition: form-data; name="README.md"; filename="README.md"\r\n'
+            'Content-Type: text/markdown\r\n\r\n'
+            '# Ünïcode\r\n'
+            f'--{boundary}--\r\n'
+        ).encode())
+
+    def test_body_matches_content_length(self):
+        path, headers, body = self.upload(self.parts(), chunked=False)
+        self.assertEqual(path, '/api/datasets/annotator/adverse-events/upload')
+        self.assertIsNone(headers['Transfer-Encoding'])
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        self.assert_body(headers, body)
+
+    def test_chunked_upload(self):
+        _, headers, body = self.upload(self.parts(), chunked=True)
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertIsNone(headers['Content-Length'])
+        self.assert_body(headers, body)
+
+    def test_data_changed_between_passes(self):
+        for extra in (b'{"id": 20}', b''):
+            passes = []
+
+            def make_chunks():
+                # The length pass sees two rows, the upload one more or one less
+                passes.append(None)
+                return [b'{"id": 1}', b'{"id": 2}' if len(passes) == 1 else extra]
+
+            with self.subTest(extra=extra), StandInHub() as hub:
+                with self.assertRaises(huggingface.HubError) as raised:
+                    huggingface.upload_files(
+                        'token', 'annotator', 'adverse-events',
+                        [('data.jsonl', 'data.jsonl', 'application/jsonl', make_chunks)],
+                        chunked=False, retries=0,
+                    )
+                self.assertTrue(raised.exception.retryable)
+                self.assertIn('data changed', str(raised.exception))
+                # The server never received a complete request
+                self.assertEqual(hub.requests, [])
+
+
+class VocabularyLoaderTests(TransactionTestCase):
+    """Reference term lists and brand names loaded in bulk"""
+
+    def setUp(self):
+        file_cache(self)
+        vocabulary._local.update(version=None, vocabulary=None)
+
+    def test_term_list_is_deduplicated_and_loaded_in_a_few_queries(self):
+        DrugListEntry.objects.create(name='aspirin')
+        lines = ['\ufeffaspirin', '', 'ibuprofen\r', 'aspirin', 'x' * 300] + [f'drug {number}' for number in range(5000)]
+        terms = vocabulary_loader.read_terms(BytesIO('\n'.join(lines).encode()))
+        self.assertEqual(terms[:3], ['aspirin', 'ibuprofen', 'x' * 300])
+        self.assertIn('aspirin', vocabulary.get_vocabulary().drugs)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = vocabulary_loader.load_terms(DrugListEntry, terms)
+        self.assertLess(len(queries), 20)
+        self.assertEqual((result.terms, result.added, result.too_long), (5002, 5001, 1))
+        self.assertEqual(DrugListEntry.objects.count(), 5002)
+        # The shared vocabulary is reset once the load commits
+        self.assertIn('drug 4999', vocabulary.get_vocabulary().drugs)
+
+        result = vocabulary_loader.load_terms(DrugListEntry, terms)
+        self.assertEqual((result.terms, result.added), (5002, 0))
+
+    def test_medications_map_brands_to_generics(self):
+        medications = json.dumps([
+            {'generic': 'ibuprofen', 'brand': 'Advil; Motrin ;'},
+            {'generic': 'naproxen', 'brand': 'Aleve'},
+            {'generic': 'ibuprofen', 'brand': 'Advil'},
+            {'generic': 'paracetamol'},
+        ]).encode()
+        response = self.client.post('/annotation/upload-drugs/', {
+            'drug_file': SimpleUploadedFile('medications.json', medications),
+        })
+        self.assertRedirects(response, '/annotation/', fetch_redirect_response=False)
+        self.assertEqual(
+            sorted(DrugListEntry.objects.values_list('name', flat=True)),
+            ['Advil', 'Aleve', 'Motrin', 'ibuprofen', 'naproxen', 'paracetamol'],
+        )
+        self.assertEqual(BrandGenericMapping.objects.count(), 3)
+        self.assertEqual(BrandGenericMapping.generics_for(' ADVIL '), ['ibuprofen'])
+        self.assertEqual(BrandGenericMapping.generics_for('aleve'), ['naproxen'])
+        self.assertIn('Motrin', vocabulary.get_vocabulary().drugs)
+
+        result = vocabulary_loader.load_medications(vocabulary_loader.read_medications(BytesIO(medications)))
+        self.assertEqual((result.added, result.mappings, result.mappings_added), (0, 3, 0))
+        for bad in (b'{"generic": "ibuprofen"}', b'[{"brand": "Advil"}]', b'[{"generic": "a", "brand": ["b"]}]'):
+            with self.assertRaises(ValueError):
+                vocabulary_loader.read_medications(BytesIO(bad))
+
+
+class VocabularyTests(TransactionTestCase):
+    """The shared vocabulary follows saves on the shipped file-based cache"""
+
+    def setUp(self):
+        file_cache(self)
+        vocabulary._local.update(version=None, vocabulary=None)
+
+    def test_save_updates_the_vocabulary_without_a_rebuild(self):
+        annotation = TextAnnotation.objects.create(text='Took aspirin.', drugs=['aspirin'])
+        version = vocabulary.get_version()
+        self.assertIn('aspirin', vocabulary.get_vocabulary().drugs)
+
+        with mock.patch.object(vocabulary.Vocabulary, 'from_database', side_effect=AssertionError('rebuilt')):
+            annotation.drugs = ['aspirin', 'ibuprofen']
+            annotation.save()
+            # Read it back from the cache, as another process would
+            vocabulary._local.update(version=None, vocabulary=None)
+            current = vocabulary.get_vocabulary()
+        self.assertIn('ibuprofen', current.drugs)
+        self.assertEqual(current.changes_since(version), [('drugs', True, 'ibuprofen')])
+
+    def test_parallel_saves_keep_every_term(self):
+        ids = create_annotations(THREADS)
+        vocabulary.get_vocabulary()
+
+        def add_drug(number):
+            annotation = TextAnnotation.objects.get(pk=ids[number])
+            annotation.drugs = [f'drug {number}']
+            annotation.save()
+
+        self.assertEqual(run_concurrently(add_drug), [])
+        vocabulary._local.update(version=None, vocabulary=None)
+        with mock.patch.object(vocabulary.Vocabulary, 'from_database', side_effect=AssertionError('rebuilt')):
+            drugs = vocabulary.get_vocabulary().drugs
+        self.assertEqual(sorted(drugs.terms), sorted(f'drug {number}' for number in range(THREADS)))
+
+
+class AhoCorasickTests(TestCase):
+    """The suggestion automaton finds distinct, word-bounded spans"""
+
+    def setUp(self):
+        self.automaton = matcher.AhoCorasick()
+
+    def spans(self, text, **kwargs):
+        return [(match.start, match.end, match.text, sorted(match.labels))
+                for match in self.automaton.search(text, **kwargs)]
+
+    def test_leftmost_longest(self):
+        for term in ('acetylsalicylic', 'acetylsalicylic acid', 'acid', 'salicylic acid'):
+            self.automaton.add(term, matcher.DRUG)
+        self.assertEqual(self.spans('Took acetylsalicylic acid daily, then folic acid.'), [
+            (5, 25, 'acetylsalicylic acid', ['drug']),
+            (44, 48, 'acid', ['drug']),
+        ])
+
+    def test_word_boundaries(self):
+        self.automaton.add('aspirin', matcher.DRUG)
+        self.assertEqual(self.spans('aspirinate and preaspirin'), [])
+        self.assertEqual(self.spans('aspirin-induced rash'), [(0, 7, 'aspirin', ['drug'])])
+        self.assertEqual(self.spans('preaspirin', word_boundary=False), [(3, 10, 'aspirin', ['drug'])])
+
+    def test_multi_word_terms_keep_original_offsets(self):
+        self.automaton.add('nausea and vomiting', matcher.ADE)
+        self.automaton.add('Ibuprofen', matcher.DRUG)
+        text = 'After IBUPROFEN she had Nausea and Vomiting.'
+        self.assertEqual(self.spans(text), [
+            (6, 15, 'IBUPROFEN', ['drug']),
+            (24, 43, 'Nausea and Vomiting', ['ade']),
+        ])
+        for start, end, matched, labels in self.spans(text):
+            self.assertEqual(text[start:end], matched)
+
+    def test_add_and_discard_are_reference_counted(self):
+        self.automaton.add('codeine', matcher.DRUG)
+        self.automaton.add('codeine', matcher.DRUG)
+        self.automaton.add('codeine', matcher.ADE)
+        self.automaton.discard('codeine', matcher.DRUG)
+        self.assertEqual(self.spans('codeine'), [(0, 7, 'codeine', ['ade', 'drug'])])
+        self.automaton.discard('codeine', matcher.ADE)
+        self.assertEqual(self.spans('codeine'), [(0, 7, 'codeine', ['drug'])])
+        self.automaton.discard('codeine', matcher.DRUG)
+        self.automaton.discard('codeine', matcher.DRUG)
+        self.assertEqual(self.spans('codeine'), [])
+        self.automaton.add('codeine', matcher.DRUG)
+        self.assertEqual(self.spans('codeine'), [(0, 7, 'codeine', ['drug'])])
+
+
+class SuggestionMatcherTests(TransactionTestCase):
+    """The process-local matcher replays vocabulary changes"""
+
+    def setUp(self):
+        file_cache(self)
+        vocabulary._local.update(version=None, vocabulary=None)
+        matcher._local['matcher'] = None
+        self.addCleanup(matcher._local.update, matcher=None)
+
+    def test_save_is_replayed_without_a_rebuild(self):
+        annotation = TextAnnotation.objects.create(text='Took zopiclone.', adverse_events=['dizziness'])
+        current = matcher.get_matcher()
+
+        annotation.drugs = ['zopiclone']
+        annotation.adverse_events = []
+        annotation.save()
+        with mock.patch.object(matcher, 'SuggestionMatcher', side_effect=AssertionError('rebuilt')):
+            self.assertIs(matcher.get_matcher(), current)
+        drugs, ades = current.suggest('Zopiclone caused dizziness.')
+        self.assertEqual(drugs, [{'text': 'Zopiclone', 'start': 0, 'end': 9}])
+        self.assertEqual(ades, [])
+
+
+class NavigationTests(TransactionTestCase):
+    """The id index follows inserts and deletes on the shipped file-based cache"""
+
+    def setUp(self):
+        file_cache(self)
+        navigation._local.update(version=None, index=None)
+        self.addCleanup(navigation._local.update, version=None, index=None)
+        self.ids = create_annotations(4)
+
+    def test_insert_and_delete_update_the_index_in_place(self):
+        index = navigation.get_index()
+        added = TextAnnotation.objects.create(text='Took aspirin.')
+        with self.assertNumQueries(0):
+            self.assertIs(navigation.get_index(), index)
+        self.assertEqual(index.next(self.ids[-1]), added.pk)
+        self.assertEqual(index.previous(added.pk), self.ids[-1])
+        self.assertEqual(index.position(added.pk), 5)
+        self.assertEqual(index.ranges(), [[self.ids[0], added.pk]])
+
+        TextAnnotation.objects.get(pk=self.ids[1]).delete()
+        with self.assertNumQueries(0):
+            self.assertIs(navigation.get_index(), index)
+        self.assertEqual(index.next(self.ids[0]), self.ids[2])
+        self.assertEqual(index.previous(self.ids[2]), self.ids[0])
+        self.assertIsNone(index.position(self.ids[1]))
+        self.assertEqual(index.ranges(), [[self.ids[0], self.ids[0]], [self.ids[2], added.pk]])
+        self.assertEqual(json.loads(index.ranges_json()), index.ranges())
+
+    def test_change_from_another_process_reloads_the_index(self):
+        navigation.get_index()
+        stale = (navigation._local['version'], navigation.IdIndex(navigation._local['index'].ids))
+        TextAnnotation.objects.get(pk=self.ids[0]).delete()
+        # The other process still holds the index from before the delete
+        navigation._local.update(version=stale[0], index=stale[1])
+        index = navigation.get_index()
+        self.assertIsNot(index, stale[1])
+        self.assertEqual(list(index.ids), self.ids[1:])
+        self.assertIsNone(index.previous(self.ids[1]))
+
+    def test_parallel_inserts_take_distinct_versions(self):
+        navigation.get_index()
+        start = CacheVersion.objects.get(name=navigation.LOCK_NAME).version
+
+        def insert(number):
+            TextAnnotation.objects.create(text=f'Took drug {number}.')
+
+        self.assertEqual(run_concurrently(insert), [])
+        self.assertEqual(CacheVersion.objects.get(name=navigation.LOCK_NAME).version, start + THREADS)
+        navigation._local.update(version=None, index=None)
+        self.assertEqual(navigation.get_index().total, len(self.ids) + THREADS)
+
+
+class BioTagTests(TestCase):
+    """BIO tags cover exactly the entity spans"""
+
+    def sentence(self, text, drugs=(), adverse_events=()):
+        annotation = TextAnnotation.objects.create(text=text, drugs=list(drugs), adverse_events=list(adverse_events))
+        row = TextAnnotation.objects.values(*bio.BIO_FIELDS).get(pk=annotation.pk)
+        return list(zip(*bio.bio_sentence(row)))
+
+    def test_entity_inside_a_hyphenated_compound_is_split_out(self):
+        self.assertEqual(self.sentence('Ofloxacin-induced hepatitis was reported.', ['ofloxacin'], ['hepatitis']), [
+            ('Ofloxacin', 'B-DRUG'),
+            ('-', 'O'),
+            ('induced', 'O'),
+            ('hepatitis', 'B-ADVERSE_EVENT'),
+            ('was', 'O'),
+            ('reported', 'O'),
+            ('.', 'O'),
+        ])
+
+    def test_hyphenated_entity_stays_one_token(self):
+        self.assertEqual(self.sentence('Given 5-fluorouracil and 2.5mg warfarin-sodium.', ['5-fluorouracil', 'warfarin']), [
+            ('Given', 'O'),
+            ('5-fluorouracil', 'B-DRUG'),
+            ('and', 'O'),
+            ('2.5mg', 'O'),
+            ('warfarin', 'B-DRUG'),
+            ('-', 'O'),
+            ('sodium', 'O'),
+            ('.', 'O'),
+        ])
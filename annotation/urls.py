@@ -5,10 +5,21 @@ urlpatterns = [
     path('', views.annotation_list, name='annotation_list'),
     path('<int:annotation_id>/', views.annotation_list, name='annotation_single'),
     path('edit/<int:annotation_id>/', views.annotation_edit, name='annotation_edit'),
+    path('api/<int:annotation_id>/', views.annotation_patch, name='annotation_patch'),
+    path('api/next/', views.annotation_prefetch, name='annotation_prefetch'),
+    path('queue/claim/', views.queue_claim, name='queue_claim'),
+    path('queue/<int:annotation_id>/renew/', views.queue_renew, name='queue_renew'),
+    path('queue/<int:annotation_id>/release/', views.queue_release, name='queue_release'),
     path('import/', views.import_jsonl, name='import_jsonl'),
+    path('import/jobs/<int:job_id>/', views.import_job_status, name='import_job_status'),
+    path('import/jobs/<int:job_id>/cancel/', views.import_job_cancel, name='import_job_cancel'),
+    path('import/jobs/<int:job_id>/resume/', views.import_job_resume, name='import_job_resume'),
     path('export/', views.export_jsonl, name='export_jsonl'),
     path('export-entities/', views.export_entities_jsonl, name='export_entities_jsonl'),
+    path('export-bio/', views.export_bio, name='export_bio'),
+    path('export-change-stats/', views.export_change_statistics, name='export_change_statistics'),
     path('upload-hf/', views.upload_to_huggingface, name='upload_to_huggingface'),
+    path('upload-hf/jobs/<int:job_id>/', views.publish_job_status, name='publish_job_status'),
     path('test-hf-token/', views.test_hf_token, name='test_hf_token'),
     path('stats/', views.annotation_stats, name='annotation_stats'),
     path('entity-examples/', views.entity_examples, name='entity_examples'),
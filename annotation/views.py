@@ -1,18 +1,28 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.http import JsonResponse, HttpResponse
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.db import transaction
-from django.db.models import Q, Count, Max
-from .models import TextAnnotation, AnnotationChange, DrugListEntry, ADEListEntry
+from django.db.models import Count, Max
+from django.utils import timezone
+from .models import TextAnnotation, AnnotationChange, ProgressCounter, ImportJob, PublishJob, ENTITY_FIELDS
+from .matcher import get_matcher
+from .navigation import get_index
+from . import bio, export_cache, exporter, huggingface, import_jobs, importer, publish_jobs, vocabulary_loader, work_queue
+from .vocabulary import get_vocabulary
 import json
 import re
-import requests
-from datetime import datetime
 
-# Global sets for uploaded drugs/ADEs, initialized from data
-UPLOADED_DRUGS = set(d for ann in TextAnnotation.objects.all() for d in ann.drugs)
-UPLOADED_ADES = set(a for ann in TextAnnotation.objects.all() for a in ann.adverse_events)
+# Sets of uploaded drugs/ADEs, loaded lazily from the shared vocabulary
+# (invalidate with annotation.vocabulary.invalidate()) so importing this
+# module never touches the database
+def __getattr__(name):
+    if name == 'UPLOADED_DRUGS':
+        return set(get_vocabulary().drugs.terms)
+    if name == 'UPLOADED_ADES':
+        return set(get_vocabulary().ades.terms)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def annotation_list(request, annotation_id=None):
     """Main annotation interface - shows one annotation at a time"""
@@ -21,7 +31,12 @@ def annotation_list(request, annotation_id=None):
     if annotation_id:
         annotation = get_object_or_404(TextAnnotation, id=annotation_id)
     else:
-        # Get first unvalidated annotation, or first annotation if all are validated
+        # Lease the next free unvalidated annotation to this annotator, or fall
+        # back to the first unvalidated/first annotation if none is free
+        lease = work_queue.claim(work_queue.get_holder(request))
+        if lease:
+            return redirect('annotation_single', annotation_id=lease.annotation_id)
+        
         annotation = TextAnnotation.objects.filter(is_validated=False).first()
         if not annotation:
             annotation = TextAnnotation.objects.first()
@@ -44,55 +59,38 @@ def annotation_list(request, annotation_id=None):
             old_drugs = annotation.drugs.copy()
             old_events = annotation.adverse_events.copy()
             old_validated = annotation.is_validated
+            changes = AnnotationChange.change_set(annotation, session_id)
             
             # Handle drugs
             if 'drugs' in request.POST:
                 drugs_string = request.POST.get('drugs', '')
                 annotation.set_drugs_from_string(drugs_string)
-                
-                # Log drug changes
-                if old_drugs != annotation.drugs:
-                    # Find added drugs
-                    added_drugs = [drug for drug in annotation.drugs if drug not in old_drugs]
-                    for drug in added_drugs:
-                        AnnotationChange.log_drug_change(
-                            annotation, 'drug_added', drug, old_drugs, annotation.drugs, session_id
-                        )
-                    
-                    # Find removed drugs
-                    removed_drugs = [drug for drug in old_drugs if drug not in annotation.drugs]
-                    for drug in removed_drugs:
-                        AnnotationChange.log_drug_change(
-                            annotation, 'drug_removed', drug, old_drugs, annotation.drugs, session_id
-                        )
+                changes.diff_drugs(old_drugs, annotation.drugs)
             
             # Handle adverse events
             if 'adverse_events' in request.POST:
                 events_string = request.POST.get('adverse_events', '')
                 annotation.set_adverse_events_from_string(events_string)
-                
-                # Log event changes
-                if old_events != annotation.adverse_events:
-                    # Find added events
-                    added_events = [event for event in annotation.adverse_events if event not in old_events]
-                    for event in added_events:
-                        AnnotationChange.log_event_change(
-                            annotation, 'event_added', event, old_events, annotation.adverse_events, session_id
-                        )
-                    
-                    # Find removed events
-                    removed_events = [event for event in old_events if event not in annotation.adverse_events]
-                    for event in removed_events:
-                        AnnotationChange.log_event_change(
-                            annotation, 'event_removed', event, old_events, annotation.adverse_events, session_id
-                        )
+                changes.diff_events(old_events, annotation.adverse_events)
             
             # Handle validation status (not tracked)
             new_validated = request.POST.get('is_validated') == 'on'
             if old_validated != new_validated:
                 annotation.is_validated = new_validated
             
-            annotation.save()
+            holder = work_queue.get_holder(request)
+            # Write the annotation and its change log in one transaction
+            with transaction.atomic():
+                if work_queue.leased_to_other(holder, annotation.id):
+                    if is_ajax:
+                        return JsonResponse({'success': False, 'message': LEASED_MESSAGE}, status=409)
+                    messages.error(request, LEASED_MESSAGE)
+                    return redirect('annotation_single', annotation_id=annotation.id)
+                annotation.save()
+                changes.save()
+                if annotation.is_validated:
+                    # Done with it, hand the lease back to the queue
+                    work_queue.release(holder, annotation.id)
             
             if is_ajax:
                 return JsonResponse({
@@ -107,9 +105,10 @@ def annotation_list(request, annotation_id=None):
             
             # Check if user wants to go to next annotation
             if 'save_and_next' in request.POST:
-                next_annotation = TextAnnotation.objects.filter(id__gt=annotation.id).first()
-                if next_annotation:
-                    return redirect('annotation_single', annotation_id=next_annotation.id)
+                # Lease the next free annotation so two annotators never land on the same one
+                lease = work_queue.claim(holder, after=annotation.id)
+                if lease:
+                    return redirect('annotation_single', annotation_id=lease.annotation_id)
                 else:
                     messages.info(request, 'No more annotations to edit.')
                     return redirect('annotation_single', annotation_id=annotation.id)
@@ -131,43 +130,31 @@ def annotation_list(request, annotation_id=None):
         }
         return render(request, 'annotation/list.html', context)
     
-    # Get navigation info
-    prev_annotation = TextAnnotation.objects.filter(id__lt=annotation.id).last()
-    next_annotation = TextAnnotation.objects.filter(id__gt=annotation.id).first()
+    # Get navigation info from the ordered id index
+    id_index = get_index()
+    prev_id = id_index.previous(annotation.id)
+    next_id = id_index.next(annotation.id)
+    prev_annotation = {'id': prev_id} if prev_id else None
+    next_annotation = {'id': next_id} if next_id else None
     
     # Get statistics
-    total_count = TextAnnotation.objects.count()
-    validated_count = TextAnnotation.objects.filter(is_validated=True).count()
-    unvalidated_count = total_count - validated_count
+    counters = ProgressCounter.get()
+    total_count = counters.total
+    validated_count = counters.validated
+    unvalidated_count = counters.unvalidated
     
     # Get current position
-    current_position = TextAnnotation.objects.filter(id__lte=annotation.id).count()
+    current_position = id_index.position(annotation.id) or 0
     
-    # Get all annotation IDs for slider navigation
-    all_annotation_ids = list(TextAnnotation.objects.order_by('id').values_list('id', flat=True))
-    
-    # Get all unique drugs and ADEs from DB and data
-    all_drugs_set = set(d for ann in TextAnnotation.objects.all() for d in ann.drugs)
-    all_ades_set = set(a for ann in TextAnnotation.objects.all() for a in ann.adverse_events)
-    all_drugs_set.update(d.name for d in DrugListEntry.objects.all())
-    all_ades_set.update(a.name for a in ADEListEntry.objects.all())
-    all_drugs = sorted(list(all_drugs_set), key=str.lower)
-    all_ades = sorted(list(all_ades_set), key=str.lower)
-
-    # Quick add suggestions (Python logic)
-    text = annotation.text if annotation else ''
-    words = re.findall(r"\b\w[\w\-']*\b", text.lower())
-    annotated_drugs = set(d.lower() for d in annotation.drugs)
-    annotated_ades = set(a.lower() for a in annotation.adverse_events)
-    all_annotated = annotated_drugs | annotated_ades
-    def is_not_in_any_entity(word, entities):
-        return all(word not in entity for entity in entities)
-    quick_drug_suggestions = [w for w in words if w in (d.lower() for d in all_drugs)
-                             and w not in annotated_drugs
-                             and is_not_in_any_entity(w, all_annotated)]
-    quick_ade_suggestions = [w for w in words if w in (a.lower() for a in all_ades)
-                            and w not in annotated_ades
-                            and is_not_in_any_entity(w, all_annotated)]
+    # Get all unique drugs and ADEs from the shared vocabulary cache
+    vocabulary = get_vocabulary()
+    all_drugs = vocabulary.drugs.terms
+    all_ades = vocabulary.ades.terms
+
+    # Quick add suggestions from a single pass of the entity matcher
+    quick_drug_suggestions, quick_ade_suggestions = get_matcher().suggest(
+        annotation.text, annotation.drugs, annotation.adverse_events
+    )
 
     context = {
         'annotation': annotation,
@@ -177,7 +164,7 @@ def annotation_list(request, annotation_id=None):
         'validated_count': validated_count,
         'unvalidated_count': unvalidated_count,
         'current_position': current_position,
-        'all_annotation_ids': json.dumps(all_annotation_ids),
+        'annotation_id_ranges': id_index.ranges_json(),
         'progress_percentage': int((current_position / total_count) * 100) if total_count > 0 else 0,
         'validation_percentage': int((validated_count / total_count) * 100) if total_count > 0 else 0,
         'all_drugs': all_drugs,
@@ -189,6 +176,196 @@ def annotation_list(request, annotation_id=None):
     return render(request, 'annotation/list.html', context)
 
 
+PREFETCH_DEFAULT_LIMIT = 5
+PREFETCH_MAX_LIMIT = 50
+
+
+def annotation_payload(annotation, matcher, id_index):
+    """JSON-serializable annotation with suggestions and navigation info"""
+    drug_suggestions, ade_suggestions = matcher.suggest(
+        annotation.text, annotation.drugs, annotation.adverse_events
+    )
+    return {
+        'id': annotation.id,
+        'text': annotation.text,
+        'drugs': annotation.drugs,
+        'adverse_events': annotation.adverse_events,
+        'is_validated': annotation.is_validated,
+        'position': id_index.position(annotation.id),
+        'prev_id': id_index.previous(annotation.id),
+        'next_id': id_index.next(annotation.id),
+        'quick_drug_suggestions': drug_suggestions,
+        'quick_ade_suggestions': ade_suggestions,
+    }
+
+
+def annotation_prefetch(request):
+    """AJAX endpoint returning the next unvalidated annotations after a cursor"""
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = int(request.GET.get('limit', PREFETCH_DEFAULT_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'after and limit must be integers'}, status=400)
+    limit = max(1, min(limit, PREFETCH_MAX_LIMIT))
+    
+    # Keyset pagination over pending ids keeps the cost flat deep into the corpus;
+    # annotations leased to other annotators are skipped
+    holder = work_queue.get_holder(request)
+    annotations = list(
+        TextAnnotation.objects.filter(is_validated=False, id__gt=after)
+        .exclude(work_queue.leased_by_others(holder))
+        .order_by('id')[:limit]
+    )
+    
+    matcher = get_matcher()
+    id_index = get_index()
+    return JsonResponse({
+        'annotations': [annotation_payload(a, matcher, id_index) for a in annotations],
+        'next_cursor': annotations[-1].id if len(annotations) == limit else None,
+        'vocabulary_version': matcher.version,
+    })
+
+
+ENTITY_OPERATIONS = ('add', 'remove')
+LEASED_MESSAGE = 'This annotation is being edited by another annotator.'
+
+
+def parse_entity_operations(operations):
+    """Validate PATCH operations one by one.
+    
+    Returns the normalized operations and a message for every one that was
+    dropped, so one bad operation does not fail the rest. Entities are lists
+    of names, so operations match on the entity text alone and any other
+    keys are ignored. Raises ValueError when ``operations`` is not a list.
+    """
+    if not isinstance(operations, list):
+        raise ValueError('operations must be a list')
+    parsed = []
+    errors = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            errors.append(f'operation {index} must be an object')
+            continue
+        op = operation.get('op')
+        field = operation.get('field')
+        entity = operation.get('entity')
+        if op not in ENTITY_OPERATIONS:
+            errors.append(f'operation {index}: op must be one of {", ".join(ENTITY_OPERATIONS)}')
+            continue
+        if field not in ENTITY_FIELDS:
+            errors.append(f'operation {index}: field must be one of {", ".join(ENTITY_FIELDS)}')
+            continue
+        if not isinstance(entity, str) or not entity.strip():
+            errors.append(f'operation {index}: entity must be a non-empty string')
+            continue
+        parsed.append({'op': op, 'field': field, 'entity': entity.strip()})
+    return parsed, errors
+
+
+def annotation_patch(request, annotation_id):
+    """AJAX endpoint applying entity add/remove operations to an annotation.
+    
+    Expects a JSON body like {"operations": [{"op": "add", "field": "drugs",
+    "entity": "aspirin"}], "is_validated": true}.
+    Operations that are already reflected in the annotation are skipped, so
+    a retried request is harmless; invalid ones are dropped and reported in
+    ``errors`` without failing the others.
+    """
+    if request.method not in ('PATCH', 'POST'):
+        return JsonResponse({'success': False, 'error': 'PATCH method required'}, status=405)
+    try:
+        data = json.loads(request.body or b'{}')
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return JsonResponse({'success': False, 'error': 'Invalid JSON body'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'success': False, 'error': 'Body must be a JSON object'}, status=400)
+    is_validated = data.get('is_validated')
+    if is_validated is not None and not isinstance(is_validated, bool):
+        return JsonResponse({'success': False, 'error': 'is_validated must be a boolean'}, status=400)
+    
+    session_id = request.session.session_key
+    if not session_id:
+        request.session.create()
+        session_id = request.session.session_key
+    holder = work_queue.get_holder(request)
+    
+    with transaction.atomic():
+        # Lock the row so concurrent patches apply one after the other
+        annotation = get_object_or_404(TextAnnotation.objects.select_for_update(), id=annotation_id)
+        if work_queue.leased_to_other(holder, annotation.id):
+            return JsonResponse({'success': False, 'error': LEASED_MESSAGE}, status=409)
+        try:
+            operations, errors = parse_entity_operations(data.get('operations', []))
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        
+        changes = AnnotationChange.change_set(annotation, session_id)
+        applied = annotation.apply_entity_operations(operations, changes)
+        validation_changed = is_validated is not None and is_validated != annotation.is_validated
+        if validation_changed:
+            annotation.is_validated = is_validated
+        
+        if applied or validation_changed:
+            annotation.save()
+            changes.save()
+        if annotation.is_validated:
+            # Done with it, hand the lease back to the queue
+            work_queue.release(holder, annotation.id)
+    
+    return JsonResponse({
+        'success': True,
+        'applied': len(applied),
+        'skipped': len(operations) - len(applied),
+        'errors': errors,
+        'drugs': annotation.drugs,
+        'adverse_events': annotation.adverse_events,
+        'is_validated': annotation.is_validated,
+    })
+
+
+def lease_payload(lease):
+    return {
+        'annotation_id': lease.annotation_id,
+        'holder': lease.holder,
+        'expires_at': lease.expires_at.isoformat(),
+    }
+
+
+def queue_claim(request):
+    """AJAX endpoint to lease the next free annotation, or a specific one"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST method required'}, status=405)
+    annotation_id = request.POST.get('annotation_id')
+    if annotation_id is not None and not annotation_id.isdigit():
+        return JsonResponse({'success': False, 'error': 'annotation_id must be an integer'}, status=400)
+    
+    lease = work_queue.claim(
+        work_queue.get_holder(request),
+        annotation_id=int(annotation_id) if annotation_id else None,
+    )
+    if lease is None:
+        return JsonResponse({'success': False, 'error': 'No annotation available'}, status=409)
+    return JsonResponse({'success': True, 'lease': lease_payload(lease)})
+
+
+def queue_renew(request, annotation_id):
+    """AJAX endpoint to extend the current annotator's lease"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST method required'}, status=405)
+    expires_at = work_queue.renew(work_queue.get_holder(request), annotation_id)
+    if expires_at is None:
+        return JsonResponse({'success': False, 'error': 'Lease not held or expired'}, status=409)
+    return JsonResponse({'success': True, 'expires_at': expires_at.isoformat()})
+
+
+def queue_release(request, annotation_id):
+    """AJAX endpoint to give an annotation back to the queue"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST method required'}, status=405)
+    released = work_queue.release(work_queue.get_holder(request), annotation_id)
+    return JsonResponse({'success': True, 'released': released})
+
+
 def annotation_edit(request, annotation_id):
     """Redirect to main annotation interface"""
     return redirect('annotation_single', annotation_id=annotation_id)
@@ -202,289 +379,206 @@ def import_jsonl(request):
             
             if not uploaded_file:
                 messages.error(request, 'Please select a file to upload.')
-                return render(request, 'annotation/import.html', {'current_count': TextAnnotation.objects.count()})
+                return render(request, 'annotation/import.html', {'current_count': ProgressCounter.get().total})
             
             # Validate file extension
             if not uploaded_file.name.lower().endswith(('.jsonl', '.json')):
                 messages.error(request, 'Please upload a .jsonl or .json file.')
-                return render(request, 'annotation/import.html', {'current_count': TextAnnotation.objects.count()})
+                return render(request, 'annotation/import.html', {'current_count': ProgressCounter.get().total})
             
-            with transaction.atomic():
-                # Clear existing data if requested
-                if request.POST.get('clear_existing'):
-                    TextAnnotation.objects.all().delete()
-                
-                imported_count = 0
-                skipped_count = 0
-                
-                # Read file content
-                file_content = uploaded_file.read().decode('utf-8')
-                lines = file_content.strip().split('\n')
-                
-                for line_num, line in enumerate(lines, 1):
-                    try:
-                        line = line.strip()
-                        if line:
-                            data = json.loads(line)
-                            annotation = TextAnnotation(
-                                text=data.get('text', ''),
-                                drugs=data.get('drugs', []),
-                                adverse_events=data.get('adverse_events', []),
-                                is_validated=data.get('is_validated', False)
-                            )
-                            annotation.save()
-                            imported_count += 1
-                    except json.JSONDecodeError as e:
-                        skipped_count += 1
-                        messages.warning(request, f'Skipped invalid JSON on line {line_num}: {str(e)}')
-                    except Exception as e:
-                        skipped_count += 1
-                        messages.warning(request, f'Error importing line {line_num}: {str(e)}')
-                
-                # Success message
-                success_msg = f'Successfully imported {imported_count} annotations!'
-                if skipped_count > 0:
-                    success_msg += f' ({skipped_count} lines skipped due to errors)'
-                
-                messages.success(request, success_msg)
-                return redirect('annotation_list')
+            # Spool the upload and import it in the background so large files
+            # never tie up this worker; the page polls the job's progress
+            job = import_jobs.create_job(
+                uploaded_file,
+                clear_existing=bool(request.POST.get('clear_existing')),
+                upsert=bool(request.POST.get('upsert')),
+                workers=importer.PARALLEL_WORKERS if request.POST.get('parallel') else 1,
+            )
+            messages.info(request, f'Import of {uploaded_file.name} started.')
+            return redirect(f"{reverse('import_jsonl')}?job={job.id}")
                 
         except Exception as e:
             messages.error(request, f'Error processing file: {str(e)}')
     
+    job = None
+    job_id = request.GET.get('job', '')
+    if job_id.isdigit():
+        job = ImportJob.objects.filter(pk=int(job_id)).first()
+    
     context = {
-        'current_count': TextAnnotation.objects.count(),
+        'current_count': ProgressCounter.get().total,
+        'job': job,
+        'recent_jobs': ImportJob.objects.all()[:5],
     }
     return render(request, 'annotation/import.html', context)
 
 
+def import_job_status(request, job_id):
+    """AJAX endpoint reporting the progress of a background import"""
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return JsonResponse({'success': True, 'job': import_jobs.job_payload(job)})
+
+
+def import_job_cancel(request, job_id):
+    """AJAX endpoint to stop a background import after its current batch"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST method required'}, status=405)
+    job = get_object_or_404(ImportJob, pk=job_id)
+    if not import_jobs.cancel(job):
+        return JsonResponse({'success': False, 'error': f'Job is already {job.status}'}, status=409)
+    job.refresh_from_db()
+    return JsonResponse({'success': True, 'job': import_jobs.job_payload(job)})
+
+
+def import_job_resume(request, job_id):
+    """AJAX endpoint to continue a stopped import from its last committed batch"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST method required'}, status=405)
+    job = get_object_or_404(ImportJob, pk=job_id)
+    if not import_jobs.resume(job):
+        return JsonResponse({'success': False, 'error': f'Job cannot be resumed while {job.status}'}, status=409)
+    job.refresh_from_db()
+    return JsonResponse({'success': True, 'job': import_jobs.job_payload(job)})
+
+
 def export_jsonl(request):
-    """View to export data to JSONL format"""
+    """View to export data to JSONL format, streamed row by row"""
     try:
         # Get filter type from query parameters
         filter_type = request.GET.get('filter', 'all')
         include_changes = request.GET.get('include_changes', 'false').lower() == 'true'
-        
-        # Start with all annotations
-        annotations = TextAnnotation.objects.all()
-        
-        # Apply filters based on the filter_type
-        if filter_type == 'annotated':
-            # Only export texts that have drugs or adverse events
-            annotations = annotations.exclude(Q(drugs=[]) & Q(adverse_events=[]))
-        elif filter_type == 'validated':
-            # Only export validated annotations
-            annotations = annotations.filter(is_validated=True)
-        elif filter_type == 'annotated_validated':
-            # Only export texts that are both annotated and validated
-            annotations = annotations.exclude(Q(drugs=[]) & Q(adverse_events=[])).filter(is_validated=True)
-        elif filter_type == 'modified':
-            # Only export texts that have been modified (have changes tracked)
-            annotations = annotations.filter(changes__isnull=False).distinct()
-        # 'all' or any other value exports everything (default behavior)
-        
+        compress = exporter.check_compression(request.GET.get('compress'))
+        annotations = exporter.filtered_annotations(filter_type)
+
         # Determine filename based on filter
-        filter_names = {
-            'annotated': 'annotated_only',
-            'validated': 'validated_only', 
-            'annotated_validated': 'annotated_validated',
-            'modified': 'modified_only',
-            'all': 'all'
-        }
-        filename_suffix = filter_names.get(filter_type, 'all')
-        
-        # Add changes suffix if including changes
+        filename_suffix = exporter.FILTER_NAMES.get(filter_type, 'all')
         if include_changes:
             filename_suffix += '_with_changes'
-        
-        # Create response
-        response = HttpResponse(content_type='application/json')
-        response['Content-Disposition'] = f'attachment; filename="exported_annotations_{filename_suffix}.jsonl"'
-        
-        for annotation in annotations:
-            data = {
-                'text': annotation.text,
-                'drugs': annotation.drugs,
-                'adverse_events': annotation.adverse_events,
-                'is_validated': annotation.is_validated,
-                'created_at': annotation.created_at.isoformat() if annotation.created_at else None,
-                'updated_at': annotation.updated_at.isoformat() if annotation.updated_at else None,
-            }
-            
-            # Include change tracking data if requested
-            if include_changes:
-                # Get change summary for this annotation
-                change_summary = annotation.get_change_summary()
-                # Create JSON-serializable version of change summary
-                serializable_change_summary = {
-                    'total_changes': change_summary['total_changes'],
-                    'drug_additions': change_summary['drug_additions'],
-                    'drug_removals': change_summary['drug_removals'],
-                    'event_additions': change_summary['event_additions'],
-                    'event_removals': change_summary['event_removals'],
-                    'last_modified': change_summary['last_modified'].isoformat() if change_summary['last_modified'] else None,
-                }
-                data['change_summary'] = serializable_change_summary
-                
-                # Get detailed changes
-                changes = []
-                for change in annotation.changes.all():
-                    changes.append({
-                        'change_type': change.change_type,
-                        'change_type_display': change.get_change_type_display(),
-                        'field_name': change.field_name,
-                        'entity_name': change.entity_name,
-                        'old_value': change.old_value,
-                        'new_value': change.new_value,
-                        'timestamp': change.timestamp.isoformat() if change.timestamp else None,
-                        'session_id': change.session_id,
-                    })
-                data['changes'] = changes
-                
-                # Add aggregated change statistics
-                data['change_statistics'] = {
-                    'total_changes': change_summary['total_changes'],
-                    'drug_additions': change_summary['drug_additions'],
-                    'drug_removals': change_summary['drug_removals'],
-                    'event_additions': change_summary['event_additions'],
-                    'event_removals': change_summary['event_removals'],
-                    'total_additions': change_summary['drug_additions'] + change_summary['event_additions'],
-                    'total_removals': change_summary['drug_removals'] + change_summary['event_removals'],
-                    'last_modified': change_summary['last_modified'].isoformat() if change_summary['last_modified'] else None,
-                }
-            
-            response.write(json.dumps(data, ensure_ascii=False) + '\n')
-        
+
+        # The cursor lets the next sync ask only for what changed after this export
+        until = timezone.now()
+        since = request.GET.get('since')
+        if since:
+            try:
+                since = exporter.parse_since(since)
+            except ValueError as e:
+                return JsonResponse({'success': False, 'error': str(e)}, status=400)
+            response = exporter.streaming_response(
+                exporter.iter_delta(filter_type, since, until, include_changes=include_changes),
+                f'exported_annotations_{filename_suffix}_delta.jsonl',
+                compress=compress,
+            )
+            response['X-Export-Cursor'] = exporter.encode_cursor(until)
+            return response
+
+        # Served from the snapshot of the current data version when there is one (or 304)
+        response = export_cache.export_response(
+            request,
+            'export_jsonl',
+            {'filter': filter_type, 'include_changes': include_changes},
+            lambda: exporter.iter_jsonl(
+                exporter.iter_rows(annotations, exporter.EXPORT_FIELDS, include_changes=include_changes),
+                exporter.annotation_record,
+                include_changes=include_changes,
+            ),
+            f'exported_annotations_{filename_suffix}.jsonl',
+            compress=compress,
+        )
+        response['X-Export-Cursor'] = exporter.encode_cursor(until)
+        # Counting is only worth it when the export is actually built
+        if response.status_code != 200 or response['X-Export-Cache'] == 'hit':
+            return response
+
         total_count = TextAnnotation.objects.count()
         exported_count = annotations.count()
-        
         if filter_type == 'all':
             messages.success(request, f'Successfully exported all {exported_count} annotations!')
         else:
             messages.success(request, f'Successfully exported {exported_count} {filter_type} annotations out of {total_count} total!')
-        
+
         return response
-        
+
     except Exception as e:
         messages.error(request, f'Error exporting data: {str(e)}')
         return redirect('annotation_list')
 
 
 def export_entities_jsonl(request):
-    """View to export data to JSONL format with entities (character positions)"""
-    def find_entity_positions(text, entity_name):
-        """Find all positions of an entity in text"""
-        positions = []
-        start = 0
-        while True:
-            pos = text.lower().find(entity_name.lower(), start)
-            if pos == -1:
-                break
-            positions.append((pos, pos + len(entity_name)))
-            start = pos + 1
-        return positions
-    
+    """View to export data to JSONL format with entities (character positions), streamed row by row"""
     try:
         include_changes = request.GET.get('include_changes', 'false').lower() == 'true'
+        # Match entities only as whole words unless word_boundary=false
+        word_boundary = request.GET.get('word_boundary', 'true').lower() != 'false'
+        compress = exporter.check_compression(request.GET.get('compress'))
         annotations = TextAnnotation.objects.all()
-        
-        # Create response
-        response = HttpResponse(content_type='application/json')
+
         filename = 'exported_annotations_entities'
         if include_changes:
             filename += '_with_changes'
-        response['Content-Disposition'] = f'attachment; filename="{filename}.jsonl"'
-        
-        for annotation in annotations:
-            entities = []
-            
-            # Add drug entities
-            for drug in annotation.drugs:
-                positions = find_entity_positions(annotation.text, drug)
-                for start, end in positions:
-                    entities.append({
-                        "start": start,
-                        "end": end,
-                        "label": "DRUG",
-                        "text": drug
-                    })
-            
-            # Add adverse event entities
-            for event in annotation.adverse_events:
-                positions = find_entity_positions(annotation.text, event)
-                for start, end in positions:
-                    entities.append({
-                        "start": start,
-                        "end": end,
-                        "label": "ADVERSE_EVENT",
-                        "text": event
-                    })
-            
-            data = {
-                'text': annotation.text,
-                'entities': entities,
-                'is_validated': annotation.is_validated,
-                'created_at': annotation.created_at.isoformat() if annotation.created_at else None,
-                'updated_at': annotation.updated_at.isoformat() if annotation.updated_at else None,
-            }
-            
-            # Include change tracking data if requested
-            if include_changes:
-                # Get change summary for this annotation
-                change_summary = annotation.get_change_summary()
-                # Create JSON-serializable version of change summary
-                serializable_change_summary = {
-                    'total_changes': change_summary['total_changes'],
-                    'drug_additions': change_summary['drug_additions'],
-                    'drug_removals': change_summary['drug_removals'],
-                    'event_additions': change_summary['event_additions'],
-                    'event_removals': change_summary['event_removals'],
-                    'last_modified': change_summary['last_modified'].isoformat() if change_summary['last_modified'] else None,
-                }
-                data['change_summary'] = serializable_change_summary
-                
-                # Get detailed changes
-                changes = []
-                for change in annotation.changes.all():
-                    changes.append({
-                        'change_type': change.change_type,
-                        'change_type_display': change.get_change_type_display(),
-                        'field_name': change.field_name,
-                        'entity_name': change.entity_name,
-                        'old_value': change.old_value,
-                        'new_value': change.new_value,
-                        'timestamp': change.timestamp.isoformat() if change.timestamp else None,
-                        'session_id': change.session_id,
-                    })
-                data['changes'] = changes
-                
-                # Add aggregated change statistics
-                data['change_statistics'] = {
-                    'total_changes': change_summary['total_changes'],
-                    'drug_additions': change_summary['drug_additions'],
-                    'drug_removals': change_summary['drug_removals'],
-                    'event_additions': change_summary['event_additions'],
-                    'event_removals': change_summary['event_removals'],
-                    'total_additions': change_summary['drug_additions'] + change_summary['event_additions'],
-                    'total_removals': change_summary['drug_removals'] + change_summary['event_removals'],
-                    'last_modified': change_summary['last_modified'].isoformat() if change_summary['last_modified'] else None,
-                }
-            
-            response.write(json.dumps(data, ensure_ascii=False) + '\n')
-        
+
+        response = export_cache.export_response(
+            request,
+            'export_entities_jsonl',
+            {'include_changes': include_changes, 'word_boundary': word_boundary},
+            lambda: exporter.iter_jsonl(
+                exporter.iter_rows(annotations, exporter.EXPORT_FIELDS, include_changes=include_changes),
+                exporter.entities_record,
+                include_changes=include_changes,
+                word_boundary=word_boundary,
+            ),
+            f'{filename}.jsonl',
+            compress=compress,
+        )
+        if response.status_code != 200 or response['X-Export-Cache'] == 'hit':
+            return response
+
         messages.success(request, f'Successfully exported {annotations.count()} annotations with entity positions!')
         return response
-        
+
     except Exception as e:
         messages.error(request, f'Error exporting data: {str(e)}')
         return redirect('annotation_list')
 
 
+def export_bio(request):
+    """View to export token-level BIO tags (CoNLL or JSONL) for NER training, streamed row by row"""
+    try:
+        filter_type = request.GET.get('filter', 'all')
+        output_format = request.GET.get('format', 'conll')
+        if output_format not in bio.FORMATS:
+            messages.error(request, f'Unknown BIO format: {output_format}')
+            return redirect('annotation_list')
+        word_boundary = request.GET.get('word_boundary', 'true').lower() != 'false'
+        compress = exporter.check_compression(request.GET.get('compress'))
+        annotations = exporter.filtered_annotations(filter_type)
+
+        filename_suffix = exporter.FILTER_NAMES.get(filter_type, 'all')
+        extension = 'conll' if output_format == 'conll' else 'jsonl'
+        exported_count = annotations.count()
+        response = exporter.streaming_response(
+            bio.iter_bio(
+                exporter.iter_rows(annotations, bio.BIO_FIELDS),
+                output_format,
+                word_boundary=word_boundary,
+            ),
+            f'exported_bio_{filename_suffix}.{extension}',
+            content_type='text/plain; charset=utf-8' if output_format == 'conll' else 'application/json',
+            compress=compress,
+        )
+
+        messages.success(request, f'Successfully exported {exported_count} sentences with BIO tags!')
+        return response
+
+    except Exception as e:
+        messages.error(request, f'Error exporting data: {str(e)}')
+        return redirect('annotation_list')
+
 def annotation_stats(request):
     """View to display annotation statistics"""
-    total_count = TextAnnotation.objects.count()
-    validated_count = TextAnnotation.objects.filter(is_validated=True).count()
-    unvalidated_count = total_count - validated_count
+    counters = ProgressCounter.get()
+    total_count = counters.total
+    validated_count = counters.validated
+    unvalidated_count = counters.unvalidated
     
     # Get drug statistics and single tag type statistics
     all_drugs = []
@@ -950,15 +1044,16 @@ def upload_drug_list(request):
     from django.contrib import messages
     if request.method == 'POST' and request.FILES.get('drug_file'):
         file = request.FILES['drug_file']
-        content = file.read().decode('utf-8')
-        added = 0
-        for line in content.splitlines():
-            drug = line.strip()
-            if drug:
-                obj, created = DrugListEntry.objects.get_or_create(name=drug)
-                if created:
-                    added += 1
-        messages.success(request, f'Drug list uploaded! {added} new drugs added.')
+        try:
+            # Plain text lists or the medications JSON (generic + brands), loaded in bulk
+            result = vocabulary_loader.load_drug_file(file, file.name)
+        except (ValueError, UnicodeDecodeError) as e:
+            messages.error(request, f'Could not read {file.name}: {e}')
+            return redirect('upload_drug_list')
+        message = f'Drug list uploaded! {result.added} new drugs added.'
+        if result.mappings:
+            message += f' {result.mappings_added} new brand names mapped to generics.'
+        messages.success(request, message)
         return redirect('annotation_list')
     return render(request, 'annotation/upload_drugs.html')
 
@@ -967,15 +1062,8 @@ def upload_ade_list(request):
     from django.contrib import messages
     if request.method == 'POST' and request.FILES.get('ade_file'):
         file = request.FILES['ade_file']
-        content = file.read().decode('utf-8')
-        added = 0
-        for line in content.splitlines():
-            ade = line.strip()
-            if ade:
-                obj, created = ADEListEntry.objects.get_or_create(name=ade)
-                if created:
-                    added += 1
-        messages.success(request, f'ADE list uploaded! {added} new ADEs added.')
+        result = vocabulary_loader.load_ade_file(file)
+        messages.success(request, f'ADE list uploaded! {result.added} new ADEs added.')
         return redirect('annotation_list')
     return render(request, 'annotation/upload_ades.html')
 
@@ -1067,11 +1155,13 @@ def export_change_statistics(request):
         }
         
         # Create response
-        response = HttpResponse(
-            json.dumps(statistics_data, ensure_ascii=False, indent=2),
-            content_type='application/json'
-        )
-        response['Content-Disposition'] = 'attachment; filename="change_tracking_statistics.json"'
+        content = json.dumps(statistics_data, ensure_ascii=False, indent=2)
+        compress = exporter.check_compression(request.GET.get('compress'))
+        if compress:
+            response = exporter.streaming_response([content], 'change_tracking_statistics.json', compress=compress)
+        else:
+            response = HttpResponse(content, content_type='application/json')
+            response['Content-Disposition'] = 'attachment; filename="change_tracking_statistics.json"'
         
         messages.success(request, f'Successfully exported change tracking statistics!')
         return response
@@ -1105,178 +1195,41 @@ def upload_to_huggingface(request):
                 messages.error(request, 'Dataset name can only contain letters, numbers, underscores, and hyphens!')
                 return redirect('annotation_stats')
             
-            # Get annotations based on filter
-            if filter_type == 'annotated':
-                annotations = TextAnnotation.objects.filter(drugs__isnull=False, adverse_events__isnull=False).exclude(drugs=[], adverse_events=[])
-            elif filter_type == 'validated':
-                annotations = TextAnnotation.objects.filter(is_validated=True)
-            else:  # all
-                annotations = TextAnnotation.objects.all()
-            
-            # Prepare dataset data
-            dataset_data = []
-            for annotation in annotations:
-                data = {
-                    'id': annotation.id,
-                    'text': annotation.text,
-                    'drugs': annotation.drugs,
-                    'adverse_events': annotation.adverse_events,
-                    'is_validated': annotation.is_validated,
-                    'created_at': annotation.created_at.isoformat() if annotation.created_at else None,
-                    'updated_at': annotation.updated_at.isoformat() if annotation.updated_at else None,
-                }
-                dataset_data.append(data)
-            
-            # Create dataset info
-            dataset_info = {
-                'dataset_name': dataset_name,
-                'description': dataset_description or f'Medical text annotation dataset with {len(dataset_data)} examples',
-                'upload_timestamp': datetime.now().isoformat(),
-                'total_examples': len(dataset_data),
-                'filter_type': filter_type,
-                'is_private': is_private,
-                'validated_count': sum(1 for item in dataset_data if item['is_validated']),
-                'unvalidated_count': sum(1 for item in dataset_data if not item['is_validated']),
-            }
-            
-            # Prepare files for upload
-            files = {
-                'data.jsonl': ('data.jsonl', '\n'.join(json.dumps(item, ensure_ascii=False) for item in dataset_data), 'application/jsonl'),
-                'dataset_info.json': ('dataset_info.json', json.dumps(dataset_info, ensure_ascii=False, indent=2), 'application/json'),
-                'README.md': ('README.md', f'''# {dataset_name}
-
-{dataset_description or f'Medical text annotation dataset with {len(dataset_data)} examples'}
-
-## Dataset Information
-- **Total Examples**: {len(dataset_data)}
-- **Validated Examples**: {dataset_info['validated_count']}
-- **Unvalidated Examples**: {dataset_info['unvalidated_count']}
-- **Filter Type**: {filter_type}
-- **Privacy**: {'Private' if is_private else 'Public'}
-- **Upload Date**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-
-## Data Format
-Each example contains:
-- `id`: Annotation ID
-- `text`: Medical text content
-- `drugs`: List of identified drugs
-- `adverse_events`: List of identified adverse events
-- `is_validated`: Validation status
-- `created_at`: Creation timestamp
-- `updated_at`: Last update timestamp
-
-## Usage
-This dataset can be used for training medical text annotation models or for research in pharmacovigilance and medical text analysis.
-''', 'text/markdown')
-            }
-            
-            # First, try to get user info to validate token
-            try:
-                # Debug: Log the token (first few characters only)
-                token_preview = hf_token[:8] + "..." if len(hf_token) > 8 else hf_token
-                print(f"Attempting to validate token: {token_preview}")
-                
-                user_info_response = requests.get(
-                    'https://huggingface.co/api/whoami',
-                    headers={'Authorization': f'Bearer {hf_token}'},
-                    timeout=10
-                )
-                
-                print(f"Token validation response status: {user_info_response.status_code}")
-                print(f"Token validation response: {user_info_response.text[:200]}...")
-                
-                if user_info_response.status_code != 200:
-                    error_detail = user_info_response.text
-                    if '401' in str(user_info_response.status_code):
-                        messages.error(request, 'Invalid Hugging Face token. Please check your token and try again.')
-                    else:
-                        messages.error(request, f'Error validating token: {error_detail}')
-                    return redirect('annotation_stats')
-                
-                user_info = user_info_response.json()
-                username = user_info.get('name', '')
-                
-                print(f"Retrieved username: {username}")
-                
-                if not username:
-                    messages.error(request, 'Could not retrieve username from token. Please check your token.')
-                    return redirect('annotation_stats')
-                    
-            except requests.exceptions.RequestException as e:
-                print(f"Network error during token validation: {str(e)}")
-                messages.error(request, f'Network error while validating token: {str(e)}')
-                return redirect('annotation_stats')
-            
-            # Create dataset repository using the correct API endpoint
-            create_url = f'https://huggingface.co/api/repos/create'
-            create_data = {
-                'name': dataset_name,
-                'type': 'dataset',
-                'description': dataset_info['description'],
-                'private': is_private
-            }
-            
-            create_response = requests.post(
-                create_url, 
-                headers={'Authorization': f'Bearer {hf_token}'}, 
-                json=create_data
+            # Publish in the background so a slow hub never ties up this worker;
+            # the page polls the job's progress
+            job = publish_jobs.create_job(
+                hf_token,
+                dataset_name,
+                dataset_description=dataset_description,
+                is_private=is_private,
+                filter_type=filter_type,
             )
-            
-            if create_response.status_code not in [200, 201, 409]:  # 409 means already exists
-                error_msg = create_response.text
-                if 'already exists' in error_msg.lower():
-                    messages.error(request, f'Dataset "{dataset_name}" already exists. Please choose a different name.')
-                else:
-                    messages.error(request, f'Failed to create dataset repository: {error_msg}')
-                return redirect('annotation_stats')
-            
-            # Upload files using the datasets API
-            upload_url = f'https://huggingface.co/api/datasets/{username}/{dataset_name}/upload'
-            
-            # Prepare multipart form data
-            import io
-            from urllib.parse import urlencode
-            
-            # Create a custom multipart encoder
-            boundary = '----WebKitFormBoundary' + ''.join([str(ord(c)) for c in 'abcdefghijklmnop'])
-            
-            body = []
-            for field_name, (filename, content, content_type) in files.items():
-                body.append(f'--{boundary}'.encode())
-                body.append(f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"'.encode())
-                body.append(f'Content-Type: {content_type}'.encode())
-                body.append(b''.encode())
-                body.append(content.encode('utf-8'))
-                body.append(b'')
-            
-            body.append(f'--{boundary}--'.encode())
-            body.append(b'')
-            
-            upload_headers = {
-                'Authorization': f'Bearer {hf_token}',
-                'Content-Type': f'multipart/form-data; boundary={boundary}'
-            }
-            
-            upload_response = requests.post(
-                upload_url,
-                headers=upload_headers,
-                data=b'\r\n'.join(body)
-            )
-            
-            if upload_response.status_code in [200, 201]:
-                dataset_url = f'https://huggingface.co/datasets/{username}/{dataset_name}'
-                privacy_status = 'private' if is_private else 'public'
-                messages.success(request, f'Successfully uploaded {privacy_status} dataset to Hugging Face! View it at: {dataset_url}')
-            else:
-                messages.error(request, f'Failed to upload dataset: {upload_response.text}')
+            messages.info(request, f'Publishing of {dataset_name} started.')
+            return redirect(f"{reverse('upload_to_huggingface')}?job={job.id}")
             
         except Exception as e:
             messages.error(request, f'Error uploading to Hugging Face: {str(e)}')
         
         return redirect('annotation_stats')
     
-    # GET request - show upload form
-    return render(request, 'annotation/upload_hf.html')
+    # GET request - show upload form, with the progress of a publish job
+    job = None
+    job_id = request.GET.get('job', '')
+    if job_id.isdigit():
+        job = PublishJob.objects.filter(pk=int(job_id)).first()
+    
+    context = {
+        'job': job,
+        'recent_jobs': PublishJob.objects.all()[:5],
+    }
+    return render(request, 'annotation/upload_hf.html', context)
+
+
+def publish_job_status(request, job_id):
+    """AJAX endpoint reporting the progress of a background Hugging Face publish"""
+    job = get_object_or_404(PublishJob, pk=job_id)
+    publish_jobs.expire_stale(job)
+    return JsonResponse({'success': True, 'job': publish_jobs.job_payload(job)})
 
 
 def test_hf_token(request):
@@ -1287,27 +1240,19 @@ def test_hf_token(request):
             return JsonResponse({'success': False, 'error': 'No token provided'})
         
         try:
-            # Test the token
-            response = requests.get(
-                'https://huggingface.co/api/whoami',
-                headers={'Authorization': f'Bearer {hf_token}'},
-                timeout=10
-            )
+            # Test the token; a result from the last few seconds is reused
+            username = huggingface.whoami(hf_token, cached=True)
+            return JsonResponse({
+                'success': True, 
+                'username': username,
+                'message': f'Token is valid for user: {username}'
+            })
             
-            if response.status_code == 200:
-                user_info = response.json()
-                username = user_info.get('name', '')
-                return JsonResponse({
-                    'success': True, 
-                    'username': username,
-                    'message': f'Token is valid for user: {username}'
-                })
-            else:
-                return JsonResponse({
-                    'success': False, 
-                    'error': f'Token validation failed: {response.status_code} - {response.text}'
-                })
-                
+        except huggingface.HubError as e:
+            return JsonResponse({
+                'success': False, 
+                'error': f'Token validation failed: {str(e)}'
+            })
         except Exception as e:
             return JsonResponse({
                 'success': False, 
@@ -0,0 +1,244 @@
+"""Shared drug/ADE vocabulary kept in sync with the database.
+
+The vocabulary is the union of every entity used in a ``TextAnnotation`` and
+every ``DrugListEntry``/``ADEListEntry``. It is built once, stored in Django's
+cache under a version key so all worker processes share it, and then kept up
+to date incrementally by the signal handlers in ``annotation.signals``.
+
+Writers (incremental updates, rebuilds and invalidation) lock the
+vocabulary's ``CacheVersion`` row and take their version number from it, so
+they are serialised by the database on any cache backend, including the
+shipped file-based cache whose ``add``/``incr`` are not atomic. Readers only
+touch the cache.
+"""
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'annotation:vocabulary:version'
+DATA_KEY = 'annotation:vocabulary:data:{version}'
+# CacheVersion row locked by writers
+LOCK_NAME = 'vocabulary'
+# Seconds a stored vocabulary is kept; superseded ones are deleted right
+# away, this only bounds copies orphaned by racing rebuilds (an expired
+# current copy is simply rebuilt)
+DATA_TIMEOUT = 24 * 60 * 60
+JOURNAL_LIMIT = 256
+
+# Process-local copy of the last vocabulary read from the cache
+_local = {'version': None, 'vocabulary': None}
+
+
+class TermIndex:
+    """Reference-counted set of terms kept sorted case-insensitively"""
+
+    def __init__(self):
+        self.counts = {}
+        self.folded = {}
+        self.terms = []
+        self._keys = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, term):
+        return term in self.counts
+
+    def add(self, term, count=1):
+        """Add references to a term, inserting it in sorted position if new"""
+        if term in self.counts:
+            self.counts[term] += count
+            return False
+        self.counts[term] = count
+        lower = term.lower()
+        self.folded[lower] = self.folded.get(lower, 0) + 1
+        key = (lower, term)
+        index = bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self.terms.insert(index, term)
+        return True
+
+    def discard(self, term, count=1):
+        """Drop references to a term, removing it once none are left"""
+        if term not in self.counts:
+            return False
+        self.counts[term] -= count
+        if self.counts[term] > 0:
+            return False
+        del self.counts[term]
+        lower = term.lower()
+        self.folded[lower] -= 1
+        if not self.folded[lower]:
+            del self.folded[lower]
+        index = bisect_left(self._keys, (lower, term))
+        del self._keys[index]
+        del self.terms[index]
+        return True
+
+    def has_folded(self, term):
+        """Case-insensitive membership test"""
+        return term.lower() in self.folded
+
+
+class Vocabulary:
+    """Drug and adverse event vocabularies at a given cache version"""
+
+    def __init__(self):
+        self.drugs = TermIndex()
+        self.ades = TermIndex()
+        self.version = None
+        # Recent (version, [(field, added, term), ...]) entries so consumers
+        # such as the suggestion matcher can follow along incrementally
+        self.journal = []
+        self.journal_base = None
+
+    def changes_since(self, version):
+        """Term changes after ``version``, or None if the journal no longer covers it"""
+        if self.journal_base is None or version is None or version < self.journal_base:
+            return None
+        changes = []
+        for entry_version, entry_changes in self.journal:
+            if entry_version > version:
+                changes.extend(entry_changes)
+        return changes
+
+    @classmethod
+    def from_database(cls):
+        """Build the vocabulary with a single pass over the annotations"""
+        from .models import TextAnnotation, DrugListEntry, ADEListEntry
+
+        vocabulary = cls()
+        drug_counts = {}
+        ade_counts = {}
+        rows = TextAnnotation.objects.values_list('drugs', 'adverse_events')
+        for drugs, adverse_events in rows.iterator(chunk_size=2000):
+            for drug in _terms(drugs):
+                drug_counts[drug] = drug_counts.get(drug, 0) + 1
+            for event in _terms(adverse_events):
+                ade_counts[event] = ade_counts.get(event, 0) + 1
+        for name in DrugListEntry.objects.values_list('name', flat=True).iterator():
+            drug_counts[name] = drug_counts.get(name, 0) + 1
+        for name in ADEListEntry.objects.values_list('name', flat=True).iterator():
+            ade_counts[name] = ade_counts.get(name, 0) + 1
+
+        vocabulary.drugs = _index_from_counts(drug_counts)
+        vocabulary.ades = _index_from_counts(ade_counts)
+        return vocabulary
+
+
+def _terms(values):
+    """Distinct, non-empty string entities of one annotation field"""
+    if not values:
+        return set()
+    return {value for value in values if isinstance(value, str) and value.strip()}
+
+
+def _index_from_counts(counts):
+    index = TermIndex()
+    index.counts = counts
+    for term in counts:
+        lower = term.lower()
+        index.folded[lower] = index.folded.get(lower, 0) + 1
+    index._keys = sorted((term.lower(), term) for term in counts)
+    index.terms = [term for _, term in index._keys]
+    return index
+
+
+def _lock():
+    """Lock the vocabulary's version row until the surrounding transaction ends"""
+    from .models import CacheVersion
+
+    return CacheVersion.lock(LOCK_NAME)
+
+
+def _store(vocabulary, previous_version, row, changes=None):
+    version = row.advance()
+    vocabulary.version = version
+    if changes is None:
+        vocabulary.journal = []
+        vocabulary.journal_base = version
+    else:
+        vocabulary.journal.append((version, changes))
+        if len(vocabulary.journal) > JOURNAL_LIMIT:
+            dropped_version, _ = vocabulary.journal.pop(0)
+            vocabulary.journal_base = dropped_version
+    cache.set(DATA_KEY.format(version=version), vocabulary, DATA_TIMEOUT)
+    cache.set(VERSION_KEY, version, None)
+    if previous_version is not None and previous_version != version:
+        # Superseded versions go explicitly; a reader that misses it falls
+        # back to _rebuild and finds this one
+        cache.delete(DATA_KEY.format(version=previous_version))
+    _local['version'] = version
+    _local['vocabulary'] = vocabulary
+    return vocabulary
+
+
+def _rebuild():
+    with transaction.atomic():
+        row = _lock()
+        version = cache.get(VERSION_KEY)
+        if version is not None:
+            # Another process finished a rebuild while we were waiting
+            vocabulary = cache.get(DATA_KEY.format(version=version))
+            if vocabulary is not None:
+                _local['version'] = version
+                _local['vocabulary'] = vocabulary
+                return vocabulary
+        return _store(Vocabulary.from_database(), version, row)
+
+
+def get_vocabulary():
+    """Return the current shared vocabulary, building it on first use"""
+    version = cache.get(VERSION_KEY)
+    if version is not None and version == _local['version']:
+        return _local['vocabulary']
+    if version is not None:
+        vocabulary = cache.get(DATA_KEY.format(version=version))
+        if vocabulary is not None:
+            _local['version'] = version
+            _local['vocabulary'] = vocabulary
+            return vocabulary
+    return _rebuild()
+
+
+def get_version():
+    """Current vocabulary version, building the vocabulary if needed"""
+    return get_vocabulary().version
+
+
+def apply_delta(drugs_added=(), drugs_removed=(), ades_added=(), ades_removed=()):
+    """Apply entity additions/removals to the shared vocabulary"""
+    if not (drugs_added or drugs_removed or ades_added or ades_removed):
+        return
+    if cache.get(VERSION_KEY) is None:
+        # Nothing built yet, the next reader will load the current state
+        return
+    with transaction.atomic():
+        row = _lock()
+        version = cache.get(VERSION_KEY)
+        vocabulary = cache.get(DATA_KEY.format(version=version)) if version is not None else None
+        if vocabulary is None:
+            return
+        changes = []
+        for field, added, terms in (('drugs', True, drugs_added), ('drugs', False, drugs_removed),
+                                    ('ades', True, ades_added), ('ades', False, ades_removed)):
+            index = getattr(vocabulary, field)
+            for term in terms:
+                changed = index.add(term) if added else index.discard(term)
+                if changed:
+                    changes.append((field, added, term))
+        _store(vocabulary, version, row, changes)
+
+
+def invalidate():
+    """Force a full rebuild on next access, e.g. after bulk writes"""
+    with transaction.atomic():
+        # Waits for a writer still storing the version being dropped
+        _lock()
+        version = cache.get(VERSION_KEY)
+        cache.delete(VERSION_KEY)
+        if version is not None:
+            cache.delete(DATA_KEY.format(version=version))
+    _local['version'] = None
+    _local['vocabulary'] = None
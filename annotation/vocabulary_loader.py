@@ -0,0 +1,116 @@
+"""Bulk loading of reference vocabularies.
+
+Term lists (``drugs_list.txt``, ADE lists) and the medications JSON
+(``Support Docs/medications_top500.json``: a generic name plus
+``;``-separated brand names per entry) are deduplicated in memory and
+written with ``bulk_create(ignore_conflicts=True)``, so a list costs a few
+INSERT statements instead of a SELECT and an INSERT per line. Each load runs
+in one transaction and resets the shared vocabulary once it commits.
+"""
+import json
+
+from django.db import transaction
+
+from . import vocabulary
+from .importer import read_chunks
+from .jsonl import iter_lines
+from .models import DrugListEntry, ADEListEntry, BrandGenericMapping
+
+BATCH_SIZE = 2000
+MAX_NAME_LENGTH = 255
+
+
+class LoadResult:
+    """Terms read and rows added by one load"""
+
+    def __init__(self):
+        self.terms = 0
+        self.added = 0
+        self.mappings = 0
+        self.mappings_added = 0
+        self.too_long = 0
+
+
+def read_terms(fileobj):
+    """Distinct non-empty lines of a text file, in first-seen order"""
+    terms = {}
+    for _, raw in iter_lines(read_chunks(fileobj)):
+        term = raw.decode('utf-8-sig', errors='replace').strip()
+        if term:
+            terms[term] = None
+    return list(terms)
+
+
+def read_medications(fileobj):
+    """(generic, [brands]) pairs from the medications JSON format"""
+    data = json.loads(b''.join(read_chunks(fileobj)).decode('utf-8-sig'))
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON list of {"generic", "brand"} objects')
+    medications = []
+    for entry in data:
+        if not isinstance(entry, dict) or not isinstance(entry.get('generic'), str):
+            raise ValueError('Every entry needs a "generic" name')
+        brands = entry.get('brand') or ''
+        if not isinstance(brands, str):
+            raise ValueError(f'"brand" of {entry["generic"]} must be a string')
+        medications.append((entry['generic'].strip(), [brand.strip() for brand in brands.split(';') if brand.strip()]))
+    return medications
+
+
+def _bulk_insert(model, objects):
+    """bulk_create skipping existing rows, returning how many were actually added"""
+    before = model.objects.count()
+    model.objects.bulk_create(objects, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    return model.objects.count() - before
+
+
+def _insert_names(model, names, result):
+    names = list(dict.fromkeys(name for name in names if name))
+    kept = [name for name in names if len(name) <= MAX_NAME_LENGTH]
+    result.too_long += len(names) - len(kept)
+    result.terms += len(kept)
+    result.added += _bulk_insert(model, [model(name=name) for name in kept])
+
+
+def load_terms(model, terms):
+    """Add terms to DrugListEntry or ADEListEntry in one transaction"""
+    result = LoadResult()
+    with transaction.atomic():
+        _insert_names(model, terms, result)
+        transaction.on_commit(vocabulary.invalidate)
+    return result
+
+
+def load_medications(medications):
+    """Add generics and brands as drug terms and record each brand's generic, in one transaction"""
+    result = LoadResult()
+    mappings = {}
+    for generic, brands in medications:
+        for brand in brands:
+            key = BrandGenericMapping.key_for(brand)
+            if len(brand) <= MAX_NAME_LENGTH and generic and len(generic) <= MAX_NAME_LENGTH:
+                mappings.setdefault((key, generic), brand)
+    with transaction.atomic():
+        _insert_names(
+            DrugListEntry,
+            [generic for generic, _ in medications] + [brand for _, brands in medications for brand in brands],
+            result,
+        )
+        result.mappings = len(mappings)
+        result.mappings_added = _bulk_insert(BrandGenericMapping, [
+            BrandGenericMapping(brand=brand, brand_key=key, generic=generic)
+            for (key, generic), brand in mappings.items()
+        ])
+        transaction.on_commit(vocabulary.invalidate)
+    return result
+
+
+def load_drug_file(fileobj, name=''):
+    """Load a drug list upload: medications JSON by extension, plain text otherwise"""
+    if name.lower().endswith('.json'):
+        return load_medications(read_medications(fileobj))
+    return load_terms(DrugListEntry, read_terms(fileobj))
+
+
+def load_ade_file(fileobj):
+    return load_terms(ADEListEntry, read_terms(fileobj))
@@ -0,0 +1,135 @@
+"""Lease-based work queue handing out unvalidated annotations.
+
+Each annotator (session or logged-in user) holds at most one lease. A lease
+expires unless renewed, so abandoned tabs return their annotation to the
+queue. Claims take the lowest pending id without an active lease: on
+databases with ``SELECT ... FOR UPDATE SKIP LOCKED`` concurrent claimers
+skip each other's candidate rows, and everywhere the unique lease row per
+annotation acts as the lock (a losing insert moves on to the next
+candidate). On SQLite, which has neither row locks nor SKIP LOCKED, claims
+run in IMMEDIATE transactions (see DATABASES in settings) so concurrent
+claimers queue for the write lock instead of failing with "database is
+locked". Both lookups go through indexes and only step over currently
+leased rows, so claim latency does not grow with the queue.
+"""
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import TextAnnotation, AnnotationLease
+
+LEASE_DURATION = timedelta(minutes=10)
+# Candidates fetched per claim attempt; losing a race just moves to the next one
+CLAIM_BATCH = 10
+
+
+def get_holder(request):
+    """Identify the annotator making a request"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    if not request.session.session_key:
+        request.session.create()
+    return f'session:{request.session.session_key}'
+
+
+def expire(now=None):
+    """Delete lapsed leases, returning how many were removed (run by every claim)"""
+    deleted, _ = AnnotationLease.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
+
+
+def _candidate_ids(now, annotation_id=None, after=None):
+    active_leases = AnnotationLease.objects.filter(annotation=OuterRef('pk'), expires_at__gt=now)
+    candidates = (
+        TextAnnotation.objects.filter(is_validated=False)
+        .exclude(Exists(active_leases))
+        .order_by('id')
+    )
+    if annotation_id is not None:
+        candidates = candidates.filter(pk=annotation_id)
+    if after is not None:
+        candidates = candidates.filter(pk__gt=after)
+    if connection.features.has_select_for_update_skip_locked:
+        candidates = candidates.select_for_update(skip_locked=True)
+    return list(candidates.values_list('id', flat=True)[:CLAIM_BATCH])
+
+
+def _take(holder, annotation_id, expires_at, now):
+    """Try to lease one annotation, returning the lease or None if someone else won"""
+    try:
+        with transaction.atomic():
+            AnnotationLease.objects.filter(annotation_id=annotation_id, expires_at__lte=now).delete()
+            # One lease per holder: moving on returns the previous annotation to the queue
+            AnnotationLease.objects.filter(holder=holder).exclude(annotation_id=annotation_id).delete()
+            return AnnotationLease.objects.create(
+                annotation_id=annotation_id, holder=holder, expires_at=expires_at
+            )
+    except IntegrityError:
+        return None
+
+
+def claim(holder, annotation_id=None, duration=LEASE_DURATION, after=None):
+    """Lease the next free unvalidated annotation (or a specific one) to ``holder``.
+
+    With ``after`` only annotations with a higher id are considered. Returns
+    the lease, or None when nothing is available. Claiming again while
+    holding a lease on a pending annotation renews and returns it.
+    """
+    now = timezone.now()
+    expires_at = now + duration
+    with transaction.atomic():
+        expire(now)
+        current = AnnotationLease.objects.filter(
+            holder=holder, expires_at__gt=now, annotation__is_validated=False
+        )
+        if annotation_id is not None:
+            current = current.filter(annotation_id=annotation_id)
+        if after is not None:
+            current = current.filter(annotation_id__gt=after)
+        lease = current.first()
+        if lease is not None:
+            lease.expires_at = expires_at
+            lease.save(update_fields=['expires_at'])
+            return lease
+
+        for candidate_id in _candidate_ids(now, annotation_id, after):
+            lease = _take(holder, candidate_id, expires_at, now)
+            if lease is not None:
+                return lease
+    return None
+
+
+def renew(holder, annotation_id, duration=LEASE_DURATION):
+    """Extend a lease still held by ``holder``; returns the new expiry or None"""
+    now = timezone.now()
+    expires_at = now + duration
+    renewed = AnnotationLease.objects.filter(
+        holder=holder, annotation_id=annotation_id, expires_at__gt=now
+    ).update(expires_at=expires_at)
+    return expires_at if renewed else None
+
+
+def release(holder, annotation_id=None):
+    """Give back the holder's lease (on one annotation, or all of them)"""
+    leases = AnnotationLease.objects.filter(holder=holder)
+    if annotation_id is not None:
+        leases = leases.filter(annotation_id=annotation_id)
+    deleted, _ = leases.delete()
+    return deleted > 0
+
+
+def leased_to_other(holder, annotation_id, now=None):
+    """True if someone other than ``holder`` holds a live lease on the annotation"""
+    return AnnotationLease.objects.filter(
+        annotation_id=annotation_id, expires_at__gt=now or timezone.now()
+    ).exclude(holder=holder).exists()
+
+
+def leased_by_others(holder, now=None):
+    """Subquery filter for annotations currently leased to someone else"""
+    return Exists(AnnotationLease.objects.filter(
+        annotation=OuterRef('pk'), expires_at__gt=now or timezone.now()
+    ).exclude(holder=holder))
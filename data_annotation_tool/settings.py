@@ -73,10 +73,38 @@ WSGI_APPLICATION = "data_annotation_tool.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Saves read the stored row before writing it (counter and vocabulary deltas)
+# and leases are claimed with a read then an insert, all inside atomic().
+# IMMEDIATE takes SQLite's write lock when the transaction starts, so
+# concurrent writers wait for it (up to "timeout" seconds) instead of failing
+# with "database is locked" when a read lock cannot be upgraded. Tests use a
+# file database so they can exercise that with several connections.
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
+        "TEST": {
+            "NAME": BASE_DIR / "test_db.sqlite3",
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Shared between worker processes; use Redis or Memcached in production.
+# The file-based cache has no atomic add()/incr(), so writers of shared
+# structures serialise on a database row instead (see annotation.vocabulary and
+# annotation.navigation)
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".django_cache",
     }
 }
 
@@ -121,3 +149,51 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# JSONL import
+# Rows per bulk_create batch and rejected lines listed after an import;
+# uploads are spooled to disk and imported by a background thread pool
+
+ANNOTATION_IMPORT_BATCH_SIZE = 2000
+ANNOTATION_IMPORT_ERROR_LIMIT = 50
+ANNOTATION_IMPORT_SPOOL_DIR = BASE_DIR / "import_spool"
+ANNOTATION_IMPORT_WORKERS = 1
+# Processes decoding JSON for parallel imports (None uses every CPU core)
+ANNOTATION_IMPORT_PARALLEL_WORKERS = None
+
+# JSONL export
+# Rows fetched per database round trip while streaming an export
+
+ANNOTATION_EXPORT_CHUNK_SIZE = 2000
+# Annotations whose entity offsets each process keeps for repeated exports of
+# recently edited rows; every exported row passes through it, so keep it small
+ANNOTATION_OFFSET_CACHE_SIZE = 1000
+# Seconds before a delta-export cursor that are sent again, so rows committed
+# by transactions still open when the cursor was issued are not missed
+ANNOTATION_EXPORT_DELTA_OVERLAP = 60
+# Annotations per id range / shard of a partitioned export (manage.py export_dataset),
+# and processes serialising them (None uses every CPU core)
+ANNOTATION_EXPORT_RANGE_SIZE = 50000
+ANNOTATION_EXPORT_WORKERS = None
+# Snapshots of full exports per data version, served until the data changes
+ANNOTATION_EXPORT_CACHE_DIR = BASE_DIR / "export_cache"
+
+# Hugging Face publishing
+# Hub URL (point it at a mirror or a local stand-in for testing), (connect, read)
+# timeouts in seconds and retries of failed requests; uploads stream the dataset
+# with a Content-Length from a first pass unless they are sent chunked
+
+HUGGINGFACE_ENDPOINT = "https://huggingface.co"
+HUGGINGFACE_TIMEOUT = (10, 120)
+HUGGINGFACE_RETRIES = 3
+HUGGINGFACE_UPLOAD_CHUNKED = False
+# Seconds a token check (test_hf_token) is reused instead of asking the hub again
+HUGGINGFACE_WHOAMI_TTL = 60
+# Publishing runs in the background on a thread pool; each step (token check,
+# repository creation, upload) is attempted up to HUGGINGFACE_PUBLISH_ATTEMPTS
+# times, waiting HUGGINGFACE_PUBLISH_BACKOFF seconds before the second attempt
+# and twice as long before each further one
+HUGGINGFACE_PUBLISH_WORKERS = 2
+HUGGINGFACE_PUBLISH_ATTEMPTS = 4
+HUGGINGFACE_PUBLISH_BACKOFF = 2